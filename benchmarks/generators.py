@@ -0,0 +1,90 @@
+"""Synthetic, reproducible input data for the benchmarks.
+Every generator takes a seed, the same arguments always give the same data.
+"""
+import datetime
+
+import numpy as np
+import pandas as pd
+
+import eventflow
+from eventflow import dateparse, db_queries, storage
+
+START = datetime.date(1800, 1, 1).toordinal()
+
+
+def graph_data(num_edges, num_nodes=None, actorID=1, seed=0, nodes=None):
+    """Nodes and edges of one actor in the format of db_queries.get_graph.
+    The actor travels between random nodes, every stay takes 1-30 days.
+    nodes are the nodes of another graph to travel between, like the
+    locations, which all actors of the database share.
+
+    :rtype: pandas.DataFrame, pandas.DataFrame
+    """
+    random = np.random.RandomState(seed)
+    if nodes is not None:
+        num_nodes = len(nodes)
+        nodes = nodes.copy()
+    if num_nodes is None:
+        num_nodes = max(10, num_edges // 10)
+
+    if nodes is None:
+        nodes = pd.DataFrame({
+            "locationID": np.arange(num_nodes, dtype=np.int64),
+            "label": ["location{}".format(i) for i in range(num_nodes)],
+            "WDid": ["Q{}".format(i) for i in range(num_nodes)],
+            "lat": random.uniform(-80, 80, num_nodes),
+            "lon": random.uniform(-170, 170, num_nodes)},
+            columns=[name for name, _ in db_queries.NODES_COLUMNS])
+
+    stops = random.randint(0, num_nodes, num_edges + 1)
+    days = START + np.cumsum(random.randint(1, 31, num_edges + 1))
+    dates = [d.isoformat() for d in dateparse.from_ordinals(days)]
+    edges = pd.DataFrame({
+        "actorID": np.full(num_edges, actorID, dtype=np.int64),
+        "from_node": stops[:-1],
+        "from_date": dates[:-1],
+        "to_node": stops[1:],
+        "to_date": dates[1:]},
+        columns=[name for name, _ in db_queries.EDGES_COLUMNS[:5]])
+    for prefix in ["from", "to"]:
+        node_ids = edges[prefix + "_node"].values
+        edges[prefix + "_lat"] = nodes.lat.values[node_ids]
+        edges[prefix + "_lon"] = nodes.lon.values[node_ids]
+    return nodes, edges
+
+
+def graph(num_edges, num_nodes=None, actorID=1, seed=0):
+    """An EventGraph of graph_data."""
+    return eventflow.EventGraph(*graph_data(num_edges, num_nodes, actorID, seed))
+
+
+def triples(num_events, num_locations=1000, seed=0):
+    """Events of one actor as used by database_setup.build_connections."""
+    random = np.random.RandomState(seed)
+    dates = dateparse.from_ordinals(START + random.randint(0, 200 * 365, num_events))
+    return pd.DataFrame({
+        "locationID": random.randint(0, num_locations, num_events),
+        "year": [d.year for d in dates],
+        "month": [d.month for d in dates],
+        "day": [d.day for d in dates]})
+
+
+def collection(num_actors, edges_per_actor, num_nodes=1000, seed=0):
+    """A store with the actors and a load_function, which generates their
+    graphs without any database. All graphs share the same nodes.
+
+    :returns: store, load_function
+    """
+    store = storage.SQLiteStore(":memory:")
+    ids = np.arange(num_actors, dtype=np.int64)
+    store.load(None, None, pd.DataFrame({
+        "actorID": ids,
+        "WDid": ["Q{}".format(1000000 + i) for i in ids],
+        "name": ["actor{}".format(i) for i in ids]}))
+
+    nodes, _ = graph_data(0, num_nodes, seed=seed)
+
+    def load_function(client, actorID):
+        return graph_data(edges_per_actor, num_nodes, int(actorID),
+                          seed + int(actorID), nodes)
+    return store, load_function
@@ -0,0 +1,344 @@
+"""Run the benchmarks and store the timings as JSON, one file per commit.
+
+Usage::
+
+    python -m benchmarks.run --scale small
+    python -m benchmarks.run --compare benchmarks/results/a1b2c3d.json \\
+        benchmarks/results/e4f5a6b.json
+
+Every case is timed `repeat` times after an untimed warm up run.
+The minimum is the most stable number to compare between two runs.
+"""
+import argparse
+import datetime
+import json
+import operator
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import matplotlib
+matplotlib.use("Agg")
+from matplotlib.backend_bases import MouseEvent
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+import numpy as np
+
+import database_setup
+import eventflow
+from eventflow import session
+from eventflow.drawing import GraphLayer
+
+from benchmarks import generators
+
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 "results")
+
+# Edges per graph, number of actors and edges per drawn graph of each scale
+SCALES = {"small": {"edges": 1000, "actors": 10, "drawn_edges": 200},
+          "medium": {"edges": 100000, "actors": 1000, "drawn_edges": 1000},
+          "large": {"edges": 1000000, "actors": 10000, "drawn_edges": 5000}}
+
+# Ratio of two timings, above which compare reports a regression
+REGRESSION_THRESHOLD = 1.1
+
+
+def cases(scale):
+    """The benchmark cases of one scale.
+
+    :returns: (name, setup) pairs. setup() prepares the input and returns
+        the function, which is timed.
+    :rtype: list
+    """
+    num_edges = scale["edges"]
+    num_actors = scale["actors"]
+
+    def init():
+        nodes, edges = generators.graph_data(num_edges)
+        return lambda: eventflow.EventGraph(nodes, edges.copy())
+
+    def build():
+        graph = generators.graph(num_edges)
+        start, end = graph.min_date, graph.max_date
+        middle = start + (end - start) / 2
+        return lambda: graph.build(start, middle)
+
+    def append():
+        # Every call appends the next batch of 10 edges to the same graph
+        num_batches = 100
+        nodes, edges = generators.graph_data(num_edges + 10 * num_batches)
+        graph = eventflow.EventGraph(nodes, edges.iloc[:num_edges].copy())
+        graph.build(graph.min_date, datetime.date(9999, 12, 31))
+        batches = iter([edges.iloc[i:i + 10] for i in
+                        range(num_edges, len(edges), 10)])
+        return lambda: graph.append(nodes, next(batches))
+
+    def coocurrence():
+        first = generators.graph(num_edges, seed=0).build()
+        second = generators.graph(num_edges, seed=1)
+        return lambda: first.coocurrence(second)
+
+    def intersect():
+        first = generators.graph(num_edges, seed=0).build()
+        second = generators.graph(num_edges, seed=0)
+        return lambda: first.intersect(second)
+
+    def fingerprint():
+        graph = generators.graph(num_edges)
+
+        def run():
+            # Computed again every time, it is cached otherwise
+            graph._fingerprint = None
+            return graph.fingerprint
+        return run
+
+    def graphs():
+        store, load_function = generators.collection(
+            num_actors, max(10, num_edges // num_actors))
+        actors = list(range(num_actors))
+
+        def run():
+            gc = eventflow.GraphCollection(actors, store, load_function)
+            return list(gc.graphs())
+        return run
+
+    def session_save():
+        store, load_function = generators.collection(
+            num_actors, max(10, num_edges // num_actors))
+        gc = eventflow.GraphCollection(list(range(num_actors)), store,
+                                       load_function)
+        list(gc.graphs())
+        filename = os.path.join(tempfile.mkdtemp(), "session.npz")
+        return lambda: session.save(filename, gc)
+
+    def session_load():
+        store, load_function = generators.collection(
+            num_actors, max(10, num_edges // num_actors))
+        gc = eventflow.GraphCollection(list(range(num_actors)), store,
+                                       load_function)
+        list(gc.graphs())
+        filename = os.path.join(tempfile.mkdtemp(), "session.npz")
+        session.save(filename, gc)
+        return lambda: session.load(filename)
+
+    def map_reduce(processes):
+        def setup():
+            store, load_function = generators.collection(
+                num_actors, max(10, num_edges // num_actors))
+            gc = eventflow.GraphCollection(list(range(num_actors)), store,
+                                           load_function)
+            list(gc.graphs())
+            return lambda: gc.map_reduce(_num_stays, operator.add, 0,
+                                         processes=processes)
+        return setup
+
+    def build_connections():
+        triples = generators.triples(num_edges)
+        return lambda: database_setup.build_connections(triples)
+
+    def layer_update():
+        axes = _axes()
+        graph = generators.graph(scale["drawn_edges"]).build()
+        return lambda: GraphLayer(axes).update(graph, actorID=1)
+
+    def layer_plot():
+        axes = _axes()
+        layer = GraphLayer(axes)
+        layer.update(generators.graph(scale["drawn_edges"]).build(), actorID=1)
+        return layer.plot
+
+    def layer_hover():
+        axes = _axes()
+        layer = GraphLayer(axes)
+        graph = generators.graph(scale["drawn_edges"]).build()
+        layer.update(graph, actorID=1)
+        layer.plot()
+        # The position of a plotted node, whatever the order of its
+        # coordinates in the layer is. The limits of _axes need not
+        # contain it, the event would be outside of the axes then
+        axes.autoscale()
+        x, y = axes.transData.transform(layer._nids.get_offsets()[0])
+        event = MouseEvent("motion_notify_event", axes.figure.canvas, x, y)
+        layer.hover(event)
+        assert layer._last_node is not None, "The hover misses the node"
+
+        def run():
+            # A hit every time, hovering the same node again hides it
+            layer._last_node = None
+            layer.hover(event)
+        return run
+
+    return [("EventGraph.__init__", init),
+            ("EventGraph.build", build),
+            ("EventGraph.append", append),
+            ("EventGraph.coocurrence", coocurrence),
+            ("EventGraph.intersect", intersect),
+            ("EventGraph.fingerprint", fingerprint),
+            ("GraphCollection.graphs", graphs),
+            ("session.save", session_save),
+            ("session.load", session_load),
+            # The same work in one and in all cores, their ratio is the
+            # speedup of the process pool
+            ("GraphCollection.map_reduce[1]", map_reduce(1)),
+            ("GraphCollection.map_reduce[cores]", map_reduce(_pool_size())),
+            ("database_setup.build_connections", build_connections),
+            ("GraphLayer.update", layer_update),
+            ("GraphLayer.plot", layer_plot),
+            ("GraphLayer.hover", layer_hover)]
+
+
+def run(scale_name, repeat=5, select=None, verbose=True):
+    """Time all cases of a scale.
+
+    :param scale_name: Key of SCALES
+    :type scale_name: string
+    :param repeat: Number of timed runs per case
+    :type repeat: int
+    :param select: Only run the cases, which contain this string
+    :type select: string
+
+    :returns: The result document, see save
+    :rtype: dict
+    """
+    timings = dict()
+    for name, setup in cases(SCALES[scale_name]):
+        if select and select not in name:
+            continue
+        func = setup()
+        func()
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        timings[name] = {"min": min(times), "median": float(np.median(times)),
+                         "repeat": repeat}
+        if verbose:
+            print("{:<36} {:>10.4f}s".format(name, min(times)))
+
+    result = {"commit": _commit(),
+              "date": datetime.datetime.now().isoformat(),
+              "scale": scale_name,
+              "scale_parameters": SCALES[scale_name],
+              "python": platform.python_version(),
+              "numpy": np.__version__,
+              "cpu_count": os.cpu_count(),
+              "timings": timings}
+    speedup = pool_speedup(timings)
+    if speedup is not None:
+        result["map_reduce_speedup"] = speedup
+        if verbose:
+            print("{:<36} {:>10.2f}x with {} processes on {} cpus".format(
+                "map_reduce speedup", speedup["speedup"],
+                speedup["processes"], os.cpu_count()))
+    return result
+
+
+def save(result, directory=RESULTS_DIRECTORY):
+    """Store the result as <commit>-<scale>.json.
+
+    :returns: Filename
+    :rtype: string
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    filename = os.path.join(directory, "{}-{}.json".format(
+        result["commit"], result["scale"]))
+    with open(filename, "w") as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+    return filename
+
+
+def compare(before, after, threshold=REGRESSION_THRESHOLD):
+    """Compare the minimum timings of two result documents.
+
+    :returns: (name, before, after, ratio) for all common cases
+        and the names of the regressions
+    :rtype: list, list
+    """
+    rows = []
+    regressions = []
+    for name in sorted(set(before["timings"]) & set(after["timings"])):
+        old = before["timings"][name]["min"]
+        new = after["timings"][name]["min"]
+        ratio = new / old if old else float("inf")
+        rows.append((name, old, new, ratio))
+        if ratio > threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+def pool_speedup(timings):
+    """Speedup of GraphCollection.map_reduce with one process per cpu over
+    a single process. It is only meaningful on a machine with several
+    cpus, on a single cpu the pool cannot be faster.
+
+    :returns: {"processes": ..., "speedup": ...} or None, if not both
+        map_reduce cases were timed
+    :rtype: dict
+    """
+    single = timings.get("GraphCollection.map_reduce[1]")
+    pool = timings.get("GraphCollection.map_reduce[cores]")
+    if single is None or pool is None:
+        return None
+    return {"processes": _pool_size(),
+            "speedup": single["min"] / pool["min"]}
+
+
+def _pool_size():
+    return max(2, os.cpu_count() or 1)
+
+
+def _num_stays(actor_id, graph):
+    return len(graph.stays)
+
+
+def _axes():
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot(111)
+    axes.set_xlim(-180, 180)
+    axes.set_ylim(-90, 90)
+    return axes
+
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--select", help="Only run the matching cases")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"),
+                        help="Compare two result files instead of running")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0], "r") as f:
+            before = json.load(f)
+        with open(args.compare[1], "r") as f:
+            after = json.load(f)
+        rows, regressions = compare(before, after)
+        for name, old, new, ratio in rows:
+            print("{:<36} {:>10.4f}s {:>10.4f}s {:>7.2f}x{}".format(
+                name, old, new, ratio, "  REGRESSION" if name in regressions else ""))
+        return 1 if regressions else 0
+
+    result = run(args.scale, args.repeat, args.select)
+    print("Saved to {}".format(save(result)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
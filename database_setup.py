@@ -2,6 +2,9 @@
 Author: Jan Greulich
 """
 
+import json
+import multiprocessing
+import os
 import sys
 
 import numpy as np
@@ -10,6 +13,9 @@ import pymongo
 
 from eventflow import util
 
+EDGE_COLUMNS = ["from_node", "to_node", "from_date", "to_date"]
+PIPELINE_STAGES = ["locations", "edges"]
+
 def build_connections(triples):
     ''' This function builds the connections for one actor
         1. Group by year,month and day and select the maximum locationID (that should be the most refined event)
@@ -17,23 +23,39 @@ def build_connections(triples):
         3.Sort the events by date
         4.Create an edge betweent two adjacent events
     '''
-    unique_dates = triples
-    unique_dates = unique_dates.sort_values(["year", "month", "day"])
-    unique_dates = unique_dates.reset_index()
-    edges = pd.DataFrame(columns=["from_node", "to_node", "from_date", "to_date"])
-    for index, row in unique_dates.iterrows():
-        if(index < unique_dates.shape[0]-1):
-            next_event = unique_dates.ix[index+1]
-            from_date = "{}-{}-{}".format(row.year, 
-                                          str(row.month).zfill(2),
-                                          str(row.day).zfill(2))
-            to_date = "{}-{}-{}".format(next_event.year,
-                                        str(next_event.month).zfill(2),
-                                        str(next_event.day).zfill(2))
-            data = [row.locationID, next_event.locationID, from_date, to_date]
-            tmp = pd.DataFrame([data],
-                columns=["from_node", "to_node", "from_date", "to_date"])
-            edges = edges.append(tmp)
+    events = triples.sort_values(["year", "month", "day"])
+    return _connect_events(events)
+
+
+def build_all_connections(triples):
+    ''' Build the connections for many actors at once.
+        The triples need the columns actorID, locationID, year, month and day.
+        All events are sorted by actor and date in one go, afterwards every
+        event is connected to the following event of the same actor.
+    '''
+    events = triples.sort_values(["actorID", "year", "month", "day"])
+    actors = events.actorID.values
+    same_actor = actors[1:] == actors[:-1]
+
+    edges = _connect_events(events, same_actor)
+    edges["actorID"] = actors[:-1][same_actor]
+
+    return edges
+
+
+def _connect_events(events, mask=None):
+    """Connect every event to its successor. If a mask is given, only the
+    pairs (event i, event i+1) with mask[i] == True are kept."""
+    locations = events.locationID.values
+    dates = format_dates(events).values
+
+    edges = pd.DataFrame({"from_node": locations[:-1],
+                          "to_node": locations[1:],
+                          "from_date": dates[:-1],
+                          "to_date": dates[1:]},
+                         columns=EDGE_COLUMNS)
+    if mask is not None:
+        edges = edges[mask].reset_index(drop=True)
 
     edges.from_node = edges.from_node.astype(int)
     edges.to_node = edges.to_node.astype(int)
@@ -41,6 +63,14 @@ def build_connections(triples):
     return edges
 
 
+def format_dates(events):
+    '''Format the year, month and day columns as yyyy-mm-dd strings,
+    month and day are zero padded.'''
+    return (events.year.astype(str) + "-" +
+            events.month.astype(str).str.zfill(2) + "-" +
+            events.day.astype(str).str.zfill(2))
+
+
 def get_real_dates(client, triples, merge=True):
     """ Transform the date id of the triples into an actual date.
 
@@ -81,9 +111,12 @@ def get_real_dates(client, triples, merge=True):
     return dates
 
 
-def copy_location_nodes(client):
+def copy_location_nodes(client, id_range=None, verbose=True, batch_size=5000):
     """Copy the location nodes from EVENT_TRIPLES.nodes to my own collection.
     Use only nodes which have the location_type 'City'.
+    If id_range=(lo, hi) is given, only the nodeIDs lo <= nodeID < hi
+    are copied. The coordinates of batch_size locations are fetched with
+    a single $in query and inserted with one insert_many.
 
     The inserted triple will have the following schema:
     locationID: Int32 -> nodeId of EVENT_TRIPLES.nodes
@@ -93,35 +126,77 @@ def copy_location_nodes(client):
     label: String -> Wikidata norm_name
     """
 
-    nodes = client["jgreulich"]["nodes"]
+    nodes = client[util.EVENTFLOW_COLLECTION][util.EVENTFLOW_NODES]
     event_nodes = client[util.EVENT_TRIPLES]["nodes"]
     wikidata = client[util.WIKIDATA]["WD_NEs"]
 
-    locations = event_nodes.find({'nodeType':'LOC'},{'_id':0,'nodeID':1,'nodeLabel':1},no_cursor_timeout=True).sort('nodeID',pymongo.ASCENDING)
-    coordinates_proj = {'_id':0,'coordinate':1,'norm_name':1,'id':1}
-    nodeID = 0
+    query = {'nodeType':'LOC'}
+    if id_range is not None:
+        query['nodeID'] = {'$gte': id_range[0], '$lt': id_range[1]}
+    locations = event_nodes.find(query,{'_id':0,'nodeID':1,'nodeLabel':1},no_cursor_timeout=True).sort('nodeID',pymongo.ASCENDING)
+    locations = locations.batch_size(batch_size)
     loc_count = locations.count()
     i = 0
-    for item in locations:
-        coordinates = wikidata.find({'id':int(item["nodeLabel"][1:]),'$and':[{'neClass':'LOC',"location_type":{"$in" : ["City","POI"]},"coordinate": {"$ne": []}}]},coordinates_proj)
-        try:
-            record = coordinates.next()
-            record["locationID"] = item["nodeID"] #Maps to the locationID of the event triples
-            record["lon"] = float(record["coordinate"][0].split(" ")[0])
-            record["lat"] = float(record["coordinate"][0].split(" ")[1])
-            record["label"] = record["norm_name"]
-            record["WDid"] = record["id"] 
-            del record["coordinate"]
-            del record["norm_name"]
-            del record["id"]
-            nodes.insert_one(record)
-        except StopIteration:
-            pass
-        i += 1
-        sys.stdout.write("\rProgress: {0:.2f}%".format(100. * i / loc_count))
-        sys.stdout.flush()
+    for batch in _batches(locations, batch_size):
+        records = join_coordinates(wikidata, pd.DataFrame(batch))
+        if records:
+            nodes.insert_many(records, ordered=False)
+        i += len(batch)
+        if verbose:
+            sys.stdout.write("\rProgress: {0:.2f}%".format(100. * i / loc_count))
+            sys.stdout.flush()
     del locations
 
+
+def join_coordinates(wikidata, locations):
+    """Look up the Wikidata coordinates of many location nodes at once.
+
+    :param wikidata: The WD_NEs collection
+    :type wikidata: pymongo.collection.Collection
+    :param locations: Location nodes with the columns nodeID and nodeLabel
+    :type locations: pandas.DataFrame
+
+    :returns: Records for the nodes collection, locations without
+        coordinates are left out
+    :rtype: list of dict
+    """
+    locations = locations.assign(WDid=locations.nodeLabel.str[1:].astype(int))
+    coordinates_proj = {'_id':0,'coordinate':1,'norm_name':1,'id':1}
+    coordinates = wikidata.find({'id': {'$in': locations.WDid.tolist()},
+                                 'neClass': 'LOC',
+                                 'location_type': {'$in': ["City", "POI"]},
+                                 'coordinate': {'$ne': []}},
+                                coordinates_proj)
+    coordinates = pd.DataFrame(list(coordinates))
+    if coordinates.empty:
+        return []
+    # Same as taking the first match of a query per id
+    coordinates = coordinates.drop_duplicates("id")
+
+    lon_lat = coordinates.coordinate.str[0].str.split(" ", expand=True)
+    coordinates["lon"] = lon_lat[0].astype(float)
+    coordinates["lat"] = lon_lat[1].astype(float)
+
+    merged = locations.merge(coordinates, left_on="WDid", right_on="id")
+    records = pd.DataFrame({"locationID": merged.nodeID.values, #Maps to the locationID of the event triples
+                            "lon": merged.lon.values,
+                            "lat": merged.lat.values,
+                            "label": merged.norm_name.values,
+                            "WDid": merged.id.values},
+                           columns=["locationID", "lon", "lat", "label", "WDid"])
+    return records.to_dict(orient='records')
+
+
+def _batches(cursor, batch_size):
+    batch = []
+    for document in cursor:
+        batch.append(document)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
 def create_edge_collection(client):
     """
     Build an edge collection based on the event triples from EVENT_TRIPLES.triples
@@ -138,8 +213,8 @@ def create_edge_collection(client):
     to_node: Int32 -> Id according to the locationID
     """
 
-    db_edges = client["jgreulich"]["edges"]
-    db_nodes = client["jgreulich"]["nodes"]
+    db_edges = client[util.EVENTFLOW_COLLECTION][util.EVENTFLOW_EDGES]
+    db_nodes = client[util.EVENTFLOW_COLLECTION][util.EVENTFLOW_NODES]
     event_nodes = client[util.EVENT_TRIPLES]["nodes"]
     event_triples = client[util.EVENT_TRIPLES]["triples"]
     actors = event_nodes.find({"nodeType":"ACT"},no_cursor_timeout=True).sort("nodeID",pymongo.ASCENDING)
@@ -163,11 +238,363 @@ def create_edge_collection(client):
         sys.stdout.flush()
     del actors
 
-@util.adrastea()
+def load_dates(client):
+    """Load all date nodes of EVENT_TRIPLES into a lookup table.
+    Only full dates are kept, because the others can not be connected.
+
+    :param client: mongodb client.
+    :type client:
+
+    :returns: pandas.DataFrame -- index=dateID, columns=[year, month, day]
+    """
+    nodes = client[util.EVENT_TRIPLES]["nodes"]
+    dates = pd.DataFrame(list(nodes.find({"nodeType": "DAT"},
+                                         {"_id": 0, "nodeID": 1,
+                                          "nodeLabel": 1})))
+    years, months, days = util.date_parser(dates.nodeLabel)
+    dates = pd.DataFrame({"year": years.values,
+                          "month": months.values,
+                          "day": days.values},
+                         index=pd.Index(dates.nodeID.values, name="dateID"),
+                         columns=["year", "month", "day"])
+    return dates[(dates.month != 0) & (dates.day != 0)]
+
+
+def load_location_ids(client):
+    """Sorted array of all locationIDs created with copy_location_nodes."""
+    db_nodes = client[util.EVENTFLOW_COLLECTION][util.EVENTFLOW_NODES]
+    locations = db_nodes.find({}, {"_id": 0, "locationID": 1})
+    return np.unique(np.array([l["locationID"] for l in locations],
+                              dtype=np.int64))
+
+
+def create_edge_collection_bulk(client, chunk_size=500000, batch_size=10000,
+                                actor_range=None, dates=None, locations=None,
+                                verbose=True):
+    """
+    Same result as create_edge_collection, but all triples are streamed
+    once, sorted by actorID. Dates and valid locations are joined from
+    in-memory lookup tables and the edges of a whole chunk of actors are
+    built in a single pass with build_all_connections.
+
+    :param client: mongodb client.
+    :type client:
+    :param chunk_size: Minimum number of triples processed at once.
+        An actor is never split across two chunks.
+    :type chunk_size: int
+    :param batch_size: Number of edges per insert_many call and cursor batch
+    :type batch_size: int
+    :param actor_range: Only process the actorIDs lo <= actorID < hi
+    :type actor_range: (int, int)
+    :param dates: Result of load_dates, loaded if not given
+    :type dates: pandas.DataFrame
+    :param locations: Result of load_location_ids, loaded if not given
+    :type locations: numpy.ndarray
+    """
+    db_edges = client[util.EVENTFLOW_COLLECTION][util.EVENTFLOW_EDGES]
+    event_triples = client[util.EVENT_TRIPLES]["triples"]
+
+    if dates is None:
+        dates = load_dates(client)
+    if locations is None:
+        locations = load_location_ids(client)
+
+    # Without an index, the sort of all triples exceeds the memory limit
+    # of MongoDB for sorts. It is built in the foreground, a background
+    # build could not be used by the sort yet
+    event_triples.create_index([("actorID", pymongo.ASCENDING)])
+
+    query = {}
+    if actor_range is not None:
+        query["actorID"] = {"$gte": actor_range[0], "$lt": actor_range[1]}
+    triples = event_triples.find(query, {"_id": 0, "actorID": 1,
+                                         "locationID": 1, "dateID": 1},
+                                 no_cursor_timeout=True)
+    triples = triples.sort("actorID", pymongo.ASCENDING).batch_size(batch_size)
+    triple_count = triples.count()
+    processed = 0
+    for chunk in _actor_chunks(triples, chunk_size):
+        processed += len(chunk)
+        chunk = chunk.join(dates, on="dateID", how="inner")
+        chunk = chunk[chunk.locationID.isin(locations)]
+        if chunk.size > 0:
+            edges = build_all_connections(chunk)
+            for start in range(0, len(edges), batch_size):
+                records = edges.iloc[start:start+batch_size]
+                db_edges.insert_many(records.to_dict(orient='records'),
+                                     ordered=False)
+        if verbose:
+            sys.stdout.write("\rProgress: {0:.2f}%".format(
+                100. * processed / max(triple_count, 1)))
+            sys.stdout.flush()
+    del triples
+
+
+def _actor_chunks(cursor, chunk_size):
+    """Collect the documents of a cursor, which is sorted by actorID,
+    into data frames of at least chunk_size rows. The triples of one actor
+    always end up in the same data frame."""
+    chunk = []
+    for triple in cursor:
+        if (len(chunk) >= chunk_size and
+                triple["actorID"] != chunk[-1]["actorID"]):
+            yield pd.DataFrame(chunk)
+            chunk = []
+        chunk.append(triple)
+    if chunk:
+        yield pd.DataFrame(chunk)
+
+
+class Checkpoint:
+    """Manifest of the finished partitions of every stage.
+    It is rewritten atomically after each finished partition, so a restart
+    of run_pipeline skips everything which is already done.
+    """
+    def __init__(self, filename=None):
+        """
+        :param filename: Json file, nothing is stored if None
+        :type filename: string
+        """
+        self.filename = filename
+        self.finished = {stage: [] for stage in PIPELINE_STAGES}
+        if filename and os.path.isfile(filename):
+            with open(filename, "r") as f:
+                self.finished.update(json.load(f))
+
+    def is_finished(self, stage, id_range):
+        return list(id_range) in self.finished[stage]
+
+    def mark_finished(self, stage, id_range):
+        self.finished[stage].append(list(id_range))
+        if self.filename:
+            tmp_filename = self.filename + ".tmp"
+            with open(tmp_filename, "w") as f:
+                json.dump(self.finished, f)
+            os.replace(tmp_filename, self.filename)
+
+
+def partition(ids, size):
+    """Split ids into half-open ranges [lo, hi), each containing
+    at most size distinct ids.
+
+    :returns: list of (lo, hi)
+    """
+    ids = np.unique(ids)
+    if not len(ids):
+        return []
+    bounds = ids[::size].tolist() + [int(ids[-1]) + 1]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def run_pipeline(client, checkpoint=None, processes=None,
+                 partition_size=10000, client_factory=None):
+    """Run copy_location_nodes and create_edge_collection_bulk on ranges
+    of location and actor ids. The ranges are processed by a process pool
+    and every finished range is recorded in the checkpoint.
+    Documents of an unfinished range are deleted before it is processed
+    again, so an interrupted run can simply be restarted.
+
+    :param client: mongodb client, used to list the ids (and to do
+        all the work if processes <= 1)
+    :type client:
+    :param checkpoint: Filename of the checkpoint manifest
+    :type checkpoint: string
+    :param processes: Number of worker processes, defaults to the cpu count.
+        With processes <= 1 everything runs in this process with client,
+        which also works with mongomock.
+    :type processes: int
+    :param partition_size: Number of ids per partition
+    :type partition_size: int
+    :param client_factory: Picklable function without arguments, which
+        returns a new client inside a worker process
+    :type client_factory: function
+    """
+    checkpoint = Checkpoint(checkpoint)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if client_factory is None:
+        client_factory = worker_client
+
+    event_nodes = client[util.EVENT_TRIPLES]["nodes"]
+    for stage, node_type in zip(PIPELINE_STAGES, ["LOC", "ACT"]):
+        ids = [n["nodeID"] for n in event_nodes.find({"nodeType": node_type},
+                                                     {"_id": 0, "nodeID": 1})]
+        todo = [id_range for id_range in partition(ids, partition_size)
+                if not checkpoint.is_finished(stage, id_range)]
+        tasks = [(stage, id_range) for id_range in todo]
+
+        if processes <= 1:
+            _init_worker(lambda: client)
+            results = map(_run_partition, tasks)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(processes, _init_worker,
+                                        (client_factory,))
+            results = pool.imap_unordered(_run_partition, tasks)
+
+        try:
+            for i, (finished_stage, id_range) in enumerate(results):
+                checkpoint.mark_finished(finished_stage, id_range)
+                sys.stdout.write("\r{}: {}/{} partitions".format(
+                    stage, i + 1, len(tasks)))
+                sys.stdout.flush()
+        finally:
+            if pool is not None:
+                pool.terminate()
+        sys.stdout.write("\n")
+
+
+def worker_client():
+    """Connect to the MongoDB through the port forwarding,
+    which was established by the parent process."""
+    return util.ConnectionManager(tunnel=False).client
+
+_worker = dict()
+
+def _init_worker(client_factory):
+    _worker.clear()
+    _worker["client"] = client_factory()
+
+
+def _run_partition(task):
+    stage, id_range = task
+    client = _worker["client"]
+    query = {"$gte": id_range[0], "$lt": id_range[1]}
+    if stage == "locations":
+        client[util.EVENTFLOW_COLLECTION][util.EVENTFLOW_NODES].delete_many({"locationID": query})
+        copy_location_nodes(client, id_range, verbose=False)
+    else:
+        if "dates" not in _worker:
+            _worker["dates"] = load_dates(client)
+            _worker["locations"] = load_location_ids(client)
+        client[util.EVENTFLOW_COLLECTION][util.EVENTFLOW_EDGES].delete_many({"actorID": query})
+        create_edge_collection_bulk(client, actor_range=id_range,
+                                    dates=_worker["dates"],
+                                    locations=_worker["locations"],
+                                    verbose=False)
+    return task
+
+
+def index_specs():
+    """The indexes, which support the queries of eventflow.db_queries.
+    The names of the databases are read from util on every call, like the
+    setup steps do, so the indexes end up where the collections are.
+
+    :returns: (database, collection, keys) of every index
+    :rtype: list
+    """
+    return [
+        (util.EVENTFLOW_COLLECTION, util.EVENTFLOW_EDGES,
+         [("actorID", pymongo.ASCENDING), ("from_date", pymongo.ASCENDING)]),
+        (util.EVENTFLOW_COLLECTION, util.EVENTFLOW_NODES,
+         [("locationID", pymongo.ASCENDING)]),
+        (util.EVENT_TRIPLES, "nodes",
+         [("nodeType", pymongo.ASCENDING), ("nodeID", pymongo.ASCENDING)]),
+        (util.EVENT_TRIPLES, "nodes", [("nodeLabel", pymongo.ASCENDING)]),
+        (util.EVENT_TRIPLES, "nodes", [("WDlabel", pymongo.ASCENDING)]),
+        (util.EVENT_TRIPLES, "triples", [("actorID", pymongo.ASCENDING)]),
+    ]
+
+def create_indexes(client, verbose=True):
+    """Create the indexes of index_specs, existing indexes are left
+    untouched.
+
+    :returns: Names of the indexes
+    :rtype: list
+    """
+    names = []
+    for database, collection, keys in index_specs():
+        name = client[database][collection].create_index(keys, background=True)
+        names.append(name)
+        if verbose:
+            print("{}.{}: {}".format(database, collection, name))
+    return names
+
+
+def check_query_plans(client, verbose=True):
+    """Explain the queries of eventflow.db_queries with a sample actor and
+    flag the ones, which scan a whole collection.
+
+    :returns: (query, stages of the winning plan, collection scan)
+    :rtype: list
+    """
+    event_nodes = client[util.EVENT_TRIPLES]["nodes"]
+    eventflow = client[util.EVENTFLOW_COLLECTION]
+    actor = event_nodes.find_one({"nodeType": "ACT"})
+    location = eventflow[util.EVENTFLOW_NODES].find_one()
+    if actor is None or location is None:
+        raise ValueError("Run the setup before checking the query plans")
+
+    queries = [
+        ("edges by actorID", eventflow[util.EVENTFLOW_EDGES],
+         {"actorID": {"$in": [actor["nodeID"]]}}),
+        ("nodes by locationID", eventflow[util.EVENTFLOW_NODES],
+         {"locationID": {"$in": [location["locationID"]]}}),
+        ("actor_by_id", event_nodes,
+         {"nodeType": "ACT", "$and": [{"nodeID": actor["nodeID"]}]}),
+        ("actor_by_WDid", event_nodes, {"nodeLabel": actor["nodeLabel"]}),
+        ("actor_by_name", event_nodes, {"WDlabel": actor.get("WDlabel")}),
+    ]
+
+    report = []
+    for name, collection, query in queries:
+        plan = collection.find(query).explain()["queryPlanner"]["winningPlan"]
+        stages = _plan_stages(plan)
+        collscan = "COLLSCAN" in stages
+        report.append((name, stages, collscan))
+        if verbose:
+            print("{:<20} {:<40} {}".format(
+                name, " <- ".join(stages),
+                "COLLECTION SCAN" if collscan else "ok"))
+    return report
+
+
+def _plan_stages(plan):
+    """Stages of a query plan, from the root to the leaves."""
+    stages = [plan["stage"]]
+    children = plan.get("inputStages", [])
+    if "inputStage" in plan:
+        children = [plan["inputStage"]] + children
+    for child in children:
+        stages += _plan_stages(child)
+    return stages
+
+
+def parse_args(parser):
+    parser.add_argument("--bulk", action="store_true",
+                        help="Build all edges in one pass over the triples")
+    parser.add_argument("--checkpoint",
+                        help="Run the partitioned pipeline and keep track of "
+                             "the finished partitions in this file")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="Number of worker processes of the pipeline")
+    parser.add_argument("--partition-size", type=int, default=10000,
+                        help="Number of ids per partition of the pipeline")
+    parser.add_argument("--create-indexes", action="store_true",
+                        help="Only create the indexes for the queries")
+    parser.add_argument("--explain", action="store_true",
+                        help="Only check the query plans for collection scans")
+    return parser.parse_args()
+
+@util.adrastea(extra_args=parse_args)
 def main(env):
     client = env['client']
-    copy_location_nodes(client)
-    create_edge_collection(client)
+    if env["create_indexes"] or env["explain"]:
+        if env["create_indexes"]:
+            create_indexes(client)
+        if env["explain"]:
+            check_query_plans(client)
+        return
+    if env["checkpoint"]:
+        run_pipeline(client, env["checkpoint"], env["processes"],
+                     env["partition_size"])
+    else:
+        copy_location_nodes(client)
+        if env["bulk"]:
+            create_edge_collection_bulk(client)
+        else:
+            create_edge_collection(client)
+    create_indexes(client)
 
 if __name__ == "__main__":
     main()
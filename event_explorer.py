@@ -1,10 +1,12 @@
 import sys
 import os
 import math
+from collections import OrderedDict
 from itertools import chain
 import itertools
 import datetime
 import tarfile
+import threading
 
 import matplotlib
 matplotlib.use("Qt5Agg")
@@ -14,20 +16,33 @@ from matplotlib.figure import Figure
 import matplotlib.pyplot as plt
 
 
-from PyQt5.QtCore import Qt, pyqtSignal, QDate
+from PyQt5.QtCore import Qt, pyqtSignal, pyqtSlot, QDate
 from PyQt5 import QtCore
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QMenu, QVBoxLayout, 
     QWidget, QGridLayout, QHBoxLayout, QPushButton, QLineEdit, QListWidget, 
     QListWidgetItem, QDockWidget, QTextEdit, QStatusBar, QAction, 
-    QAbstractItemView, QDateTimeEdit, QFileDialog)
-from PyQt5.QtGui import QGuiApplication, QPainter, QLinearGradient, QColor, QBrush
+    QAbstractItemView, QDateTimeEdit, QFileDialog, QSlider, QCompleter)
+from PyQt5.QtGui import (QPainter, QLinearGradient, QColor, QBrush,
+    QStandardItemModel, QStandardItem)
 
 import pandas as pd
 from mpl_toolkits.basemap import Basemap
 
 import eventflow 
+from eventflow import dateparse
+from eventflow import instrument
+from eventflow import session
 from eventflow.util import adrastea
-from eventflow.drawing import GraphLayer
+from eventflow.drawing import GraphLayer, Playback, render_data
+from eventflow.invalidation import Invalidator
+from eventflow.search import ActorIndex
+
+class TracedCanvas(FigureCanvas):
+    """Canvas, which records its draws as span, also the deferred ones
+    of draw_idle."""
+    @instrument.traced("FigureCanvas.draw")
+    def draw(self):
+        super().draw()
 
 class MyNavigationToolbar(NavigationToolbar):
     def __init__(self, canvas, parent, coordinates=True):
@@ -69,20 +84,92 @@ class TimeBar(QWidget):
         text_field.translate(0,self.rect().height()*0.6)
         painter.setPen(QColor())
         painter.drawText(text_field, Qt.AlignLeft, self.start_time)
-        middle_time = (datetime.date(*[int(x) for x in self.end_time.split("-")]) 
-                        - datetime.date(*[int(x) for x in self.start_time.split("-")]))
-        middle_time = datetime.date(*[int(x) for x in self.start_time.split("-")])+middle_time/2
+        start_time = dateparse.parse_date(self.start_time)
+        middle_time = dateparse.parse_date(self.end_time) - start_time
+        middle_time = start_time + middle_time/2
         painter.drawText(text_field, Qt.AlignCenter, middle_time.isoformat())
         painter.drawText(text_field, Qt.AlignRight, self.end_time)
         
         painter.end()
 
 
+class DrawWorker(QtCore.QObject):
+    """Fetches, builds and colors the graphs of the active actors outside of
+    the GUI thread. The results are handed back as render data, which the
+    GraphLayer can draw without touching any DataFrame.
+    Every signal carries the generation of the redraw it belongs to."""
+
+    graph_ready = pyqtSignal(int, object, object)
+    flows_ready = pyqtSignal(int, object)
+    progress = pyqtSignal(int, float)
+    finished = pyqtSignal(int)
+
+    def __init__(self, gc, actor_states, start_date, end_date, generation,
+                 flows=False):
+        super(DrawWorker, self).__init__()
+        self.gc = gc
+        self.actor_states = actor_states
+        self.start_date = start_date
+        self.end_date = end_date
+        self.generation = generation
+        self.flows = flows
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @pyqtSlot()
+    def run(self):
+        num_actors = max(self.gc.num_actors, 1)
+        processed = 0.
+        for actor, graph in self.gc.graphs():
+            if self._cancelled.is_set():
+                break
+            if self.actor_states.get(actor.id, 0) == 2:
+                graph.build(self.start_date, self.end_date)
+                # Sized here, so the cache panel does not do it in the GUI
+                graph.memory_usage()
+                data = render_data(graph)
+                if data is not None:
+                    self.graph_ready.emit(self.generation, actor.id, data)
+            processed += 1.
+            self.progress.emit(self.generation, processed/num_actors)
+        if self.flows and not self._cancelled.is_set():
+            self.flows_ready.emit(self.generation, self.gc.od_flows(
+                self.start_date, self.end_date))
+        self.finished.emit(self.generation)
+
+
+class ActorIndexWorker(QtCore.QObject):
+    """Builds the actor index from the client outside of the GUI thread
+    and stores it in filename. The scan of all actors takes a while
+    through the tunnel."""
+
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, client, filename):
+        super(ActorIndexWorker, self).__init__()
+        self.client = client
+        self.filename = filename
+
+    @pyqtSlot()
+    def run(self):
+        try:
+            index = ActorIndex.from_client(self.client)
+            index.save(self.filename)
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        self.finished.emit(index)
+
+
 class WorldMap(QWidget):
 
     node_details = pyqtSignal(pd.Series)
     actor_inserted = pyqtSignal(eventflow.Actor)
     processing = pyqtSignal(float)
+    drawn = pyqtSignal()
 
     def __init__( self, parent = None, client = None):        
         super( WorldMap, self ).__init__( parent)
@@ -99,7 +186,7 @@ class WorldMap(QWidget):
         self.widgetPlot.setObjectName("widgetPlot")        
         self.figure = Figure()        
         self.axes = self.figure.add_subplot(111)
-        self.canvas = FigureCanvas( self.figure )
+        self.canvas = TracedCanvas( self.figure )
         
         self.canvas.setFocusPolicy( QtCore.Qt.ClickFocus )
         self.canvas.setFocus()
@@ -120,6 +207,11 @@ class WorldMap(QWidget):
         self.m.drawmapboundary(fill_color='#4c4c4c')
 
         self.graph_layer = GraphLayer(axes = self.axes)
+        self.playback = None
+
+        self._generation = 0
+        self._worker = None
+        self._workers = dict()
         
         self.figure.subplots_adjust(left=0,right=1,bottom=0,top=1)
         self.axes.axis("tight")
@@ -128,7 +220,7 @@ class WorldMap(QWidget):
 
 
 
-    def draw_network(self, start_date=None, end_date=None):
+    def reset_map(self):
         self.axes.clear()
 
         self.m = Basemap(ax=self.axes)
@@ -137,22 +229,101 @@ class WorldMap(QWidget):
         self.m.drawmapboundary(fill_color='#4c4c4c')
         self.canvas.draw()
 
-        self.graph_layer = GraphLayer(axes = self.axes)
-        num_actors = self.gc.num_actors
-        processed = 0.
+    def actor_states(self):
         actor_states = dict()
         for i in range(self.parent().parent().actor_overview.count()):
             a = self.parent().parent().actor_overview.item(i)
             actor_states[a.data(32)] = a.checkState()
+        return actor_states
 
-        for actor, graph in self.gc.graphs():
-            if actor_states.get(actor.id, 0) == 2: #TODO: Check if the actor is active
-                graph = graph.build(start_date, end_date)
-                self.graph_layer.update(graph, actor.id)
-                self.graph_layer.plot()
-                QGuiApplication.processEvents()
-            processed += 1.
-            self.processing.emit(processed/num_actors)
+    def draw_network(self, start_date=None, end_date=None, flows=False):
+        """Redraw all active actors. Fetching and building the graphs is done
+        by a DrawWorker in a background thread, the finished render data is
+        drawn in draw_graph as soon as it arrives. With flows, the worker
+        also sums up the flows of all actors for draw_flows."""
+        self.cancel_draw()
+        self.reset_map()
+
+        self.graph_layer.unfollow()
+        self.graph_layer = GraphLayer(axes = self.axes)
+        self.playback = None
+
+        self._generation += 1
+        worker = DrawWorker(self.gc, self.actor_states(), start_date, end_date,
+                            self._generation, flows)
+        thread = QtCore.QThread(self)
+        worker.moveToThread(thread)
+        thread.started.connect(worker.run)
+        worker.graph_ready.connect(self.draw_graph)
+        worker.flows_ready.connect(self.draw_flows)
+        worker.progress.connect(self.draw_progress)
+        worker.finished.connect(self.draw_finished)
+        worker.finished.connect(thread.quit)
+        thread.finished.connect(lambda: self._workers.pop(thread, None))
+        thread.finished.connect(thread.deleteLater)
+
+        self._workers[thread] = worker
+        self._worker = worker
+        thread.start()
+
+    def cancel_draw(self):
+        """Cancel a running redraw. Results which are still in the
+        queue are dropped, because their generation is outdated."""
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+            self._generation += 1
+
+    @pyqtSlot(int, object, object)
+    @instrument.traced("WorldMap.draw_graph")
+    def draw_graph(self, generation, actorID, data):
+        if generation != self._generation:
+            return
+        self.graph_layer.update(data, actorID)
+        self.graph_layer.plot()
+        graph = self.gc.get_cache_entry(actorID)
+        if graph is not None:
+            self.graph_layer.follow(graph, actorID)
+
+    @pyqtSlot(int, object)
+    def draw_flows(self, generation, flows):
+        if generation == self._generation:
+            self.graph_layer.show_flows(flows)
+
+    @pyqtSlot(int, float)
+    def draw_progress(self, generation, progress):
+        if generation == self._generation:
+            self.processing.emit(progress)
+
+    @pyqtSlot(int)
+    def draw_finished(self, generation):
+        if generation == self._generation:
+            self._worker = None
+            self.drawn.emit()
+
+    def start_playback(self, window, step):
+        """Replace the static network by an animated playback over the
+        complete timeline of all active actors.
+
+        :returns: Number of frames
+        """
+        self.reset_map()
+        self.graph_layer.unfollow()
+        self.graph_layer = GraphLayer(axes = self.axes)
+
+        actor_states = self.actor_states()
+        graphs = [(actor.id, graph) for actor, graph in self.gc.graphs()
+                  if actor_states.get(actor.id, 0) == 2]
+        self.playback = Playback(self.axes, graphs, window, step)
+        return self.playback.num_frames
+
+    def show_frame(self, frame):
+        return self.playback.show_frame(frame)
+
+    def stop_playback(self):
+        if self.playback is not None:
+            self.playback.remove()
+            self.playback = None
 
     def find_cooccurence(self, actor1, actor2):
         graph = self.gc.get_cache_entry(actor1)
@@ -172,6 +343,16 @@ class WorldMap(QWidget):
             self.graph_layer.update(graph, actorID)  
             self.graph_layer.plot()          
 
+    def show_flows(self, start_date, end_date):
+        """Draw the flows of the cached actors of the collection in the time
+        window on top of the individual actors. Nothing is fetched, this
+        runs in the GUI thread."""
+        self.graph_layer.show_flows(
+            self.gc.od_flows(start_date, end_date, fetch=False))
+
+    def hide_flows(self):
+        self.graph_layer.hide_flows()
+
     def hide_actor(self,actorID):
         self.graph_layer.hide_by_actor(actorID)
 
@@ -186,16 +367,47 @@ class WorldMap(QWidget):
 
 
 class MainWindow(QMainWindow):
+
+    # Emitted from the invalidator thread with the affected actorIDs
+    data_changed = pyqtSignal(object)
+
+    # Frames per window width and milliseconds between two frames
+    PLAYBACK_STEPS_PER_WINDOW = 10
+    PLAYBACK_INTERVAL = 50
+
+    ACTOR_INDEX_FILE = os.path.join(os.path.expanduser("~"), ".eventflow_actors.npz")
+    # Minimum length of a name, before actors are suggested
+    COMPLETION_MIN_LENGTH = 2
+
     def __init__(self,client):
         super().__init__()
         self.client = client
         self.redrawing = False
+        self._redraw_mark = None
 
 
         self.initUI()
         #self.worker = Worker(self)
         #self.map_explorer.draw_network()
 
+        self.data_changed.connect(self.show_data_changed)
+        # Patched graphs would notify the GraphLayer outside of the GUI
+        # thread, so changed graphs are only dropped
+        self.invalidator = Invalidator(self.map_explorer.gc, client,
+                                       patch=False,
+                                       callback=self.data_changed.emit)
+        self.invalidator.start()
+
+    def closeEvent(self, event):
+        self.invalidator.stop()
+        super().closeEvent(event)
+
+    def show_data_changed(self, actor_ids):
+        names = [self.map_explorer.gc.get_actor(actor_id) for actor_id in actor_ids]
+        names = [actor.name for actor in names if actor is not None]
+        self.status_bar.showMessage("Data of {} changed. Refresh to redraw.".format(
+            ", ".join(names) or "{} actors".format(len(actor_ids))))
+
     def initUI(self):
         mainWidget = QWidget(self)
         self.setCentralWidget(mainWidget)
@@ -228,6 +440,9 @@ class MainWindow(QMainWindow):
         hLayout.addWidget(self.end_date)
 
         self.actor_select = QLineEdit()
+        self.actor_index = None
+        self.actor_completions = QStandardItemModel(self)
+        self.load_actor_index()
         hLayout.addWidget(self.actor_select)
 
         self.fetch_data = QPushButton("Fetch Data")
@@ -238,6 +453,11 @@ class MainWindow(QMainWindow):
         self.refresh.clicked.connect(self.redraw)
         hLayout.addWidget(self.refresh)
 
+        self.play = QPushButton("Play")
+        self.play.setCheckable(True)
+        self.play.toggled.connect(self.toggle_playback)
+        hLayout.addWidget(self.play)
+
         extra_navigation.setLayout(hLayout)
                 
         vLayout.addWidget(extra_navigation) 
@@ -245,6 +465,14 @@ class MainWindow(QMainWindow):
         self.time_bar = TimeBar(self)
         vLayout.addWidget(self.time_bar) 
 
+        self.time_slider = QSlider(Qt.Horizontal)
+        self.time_slider.setEnabled(False)
+        self.time_slider.valueChanged.connect(self.scrub)
+        vLayout.addWidget(self.time_slider)
+
+        self.playback_timer = QtCore.QTimer(self)
+        self.playback_timer.timeout.connect(self.advance_playback)
+
         layout_widget.setLayout(vLayout)
 
         grid.addWidget(layout_widget)
@@ -255,11 +483,26 @@ class MainWindow(QMainWindow):
         self.loadAction = QAction('&Load state',self)
         self.loadAction.triggered.connect(self.load_state)
 
+        self.traceAction = QAction('&Record trace',self)
+        self.traceAction.setCheckable(True)
+        self.traceAction.setChecked(instrument.is_enabled())
+        self.traceAction.toggled.connect(self.toggle_trace)
+        self.exportTraceAction = QAction('&Export trace',self)
+        self.exportTraceAction.triggered.connect(self.export_trace)
+        self.flowsAction = QAction('&Aggregate flows',self)
+        self.flowsAction.setCheckable(True)
+        self.flowsAction.toggled.connect(self.toggle_flows)
+
         menubar = self.menuBar()
         menubar.setNativeMenuBar(False)
         fileMenu = menubar.addMenu('&File')
         fileMenu.addAction(self.saveAction)
         fileMenu.addAction(self.loadAction)
+        fileMenu.addSeparator()
+        fileMenu.addAction(self.traceAction)
+        fileMenu.addAction(self.exportTraceAction)
+        viewMenu = menubar.addMenu('&View')
+        viewMenu.addAction(self.flowsAction)
 
 
         # Dock widgets
@@ -297,41 +540,206 @@ class MainWindow(QMainWindow):
         dock.setMinimumSize(150,0)
         self.addDockWidget(Qt.RightDockWidgetArea, dock)
 
+        dock = QDockWidget("Cache", self)
+        dock.setAllowedAreas(Qt.RightDockWidgetArea)
+
+        self.cache_detail = QTextEdit(dock)
+        self.cache_detail.setReadOnly(True)
+        dock.setWidget(self.cache_detail)
+        dock.setMinimumSize(150,0)
+        self.addDockWidget(Qt.RightDockWidgetArea, dock)
+
         # Slots
         self.actor_overview.itemChanged.connect(lambda x:self.change_visible_actors(x))
         self.actor_overview.customContextMenuRequested.connect(lambda x: self.actor_context_menu(x))
         self.map_explorer.node_details.connect(lambda x: self.display_node_details(x))
         self.map_explorer.processing.connect(lambda x:self.update_status_bar(x))
+        self.map_explorer.drawn.connect(self.redraw_finished)
+        self.start_date.dateTimeChanged.connect(self.cancel_redraw)
+        self.end_date.dateTimeChanged.connect(self.cancel_redraw)
 
         self.show()
 
     def redraw(self):
-        self.status_bar.showMessage("Redrawing...")
-        self.redrawing = True
-        start_date = self.start_date.dateTime().toString("yyyy-MM-dd")
-        end_date = self.end_date.dateTime().toString("yyyy-MM-dd")
-        #self.actor_overview.clear()
+        if self.play.isChecked():
+            # Stopping the playback triggers a redraw on its own
+            self.play.setChecked(False)
+            return
+        with instrument.span("MainWindow.redraw"):
+            self.status_bar.showMessage("Redrawing...")
+            self.redrawing = True
+            self._redraw_mark = instrument.mark()
+            start_date = self.start_date.dateTime().toString("yyyy-MM-dd")
+            end_date = self.end_date.dateTime().toString("yyyy-MM-dd")
+            #self.actor_overview.clear()
 
-        self.time_bar.start_time = start_date
-        self.time_bar.end_time = end_date
-        self.time_bar.repaint()
+            self.time_bar.start_time = start_date
+            self.time_bar.end_time = end_date
+            self.time_bar.repaint()
 
-        active_actors = []
-        for i in range(self.actor_overview.count()):
-            active_actors.append(self.actor_overview.item(i).data(32))
+            active_actors = []
+            for i in range(self.actor_overview.count()):
+                active_actors.append(self.actor_overview.item(i).data(32))
         
-        for actor in self.map_explorer.gc.actors:
-            if actor.id not in active_actors:
-                item = QListWidgetItem(actor.name)
-                item.setCheckState(Qt.Checked)
-                item.setData(32, actor.id)
-                self.actor_overview.addItem(item)
+            for actor in self.map_explorer.gc.actors:
+                if actor.id not in active_actors:
+                    item = QListWidgetItem(actor.name)
+                    item.setCheckState(Qt.Checked)
+                    item.setData(32, actor.id)
+                    self.actor_overview.addItem(item)
+
+            self.map_explorer.draw_network(start_date, end_date,
+                                           self.flowsAction.isChecked())
 
-        self.map_explorer.draw_network(start_date, end_date)
+    def redraw_finished(self):
         self.redrawing = False
-        self.status_bar.showMessage("Finished.")
+        self.update_cache_panel()
+        if instrument.is_enabled():
+            totals = instrument.summary(self._redraw_mark)
+            self.status_bar.showMessage("Finished. {}".format(
+                instrument.format_summary(totals)))
+        else:
+            self.status_bar.showMessage("Finished.")
+
+    def update_cache_panel(self):
+        stats = self.map_explorer.gc.cache_statistics()
+        content = "<b>Cached graphs:</b> {}<br>".format(stats["graphs"])
+        content += "<b>Memory:</b> {:.1f} MB<br>".format(stats["total_memory"] / 2.**20)
+        content += "<b>Hits / misses:</b> {} / {} ({:.0%})<br>".format(
+            stats["hits"], stats["misses"], stats["hit_ratio"])
+        content += "<b>Load time:</b> {:.2f}s<br>".format(stats["load_time"])
+        lower = 0.
+        for upper, count in stats["load_histogram"]:
+            content += "{:g}s -- {:g}s: {}<br>".format(lower, upper, count)
+            lower = upper
+
+        largest = sorted(stats["memory"].items(), key=lambda m: -m[1])[:5]
+        if largest:
+            content += "<b>Largest graphs:</b><br>"
+        for actor_id, size in largest:
+            actor = self.map_explorer.gc.get_actor(actor_id)
+            content += "{}: {:.1f} MB<br>".format(
+                actor.name if actor else actor_id, size / 2.**20)
+
+        self.cache_detail.setHtml(content)
+
+    def toggle_flows(self, checked):
+        if checked:
+            start_date = self.start_date.dateTime().toString("yyyy-MM-dd")
+            end_date = self.end_date.dateTime().toString("yyyy-MM-dd")
+            self.map_explorer.show_flows(start_date, end_date)
+        else:
+            self.map_explorer.hide_flows()
+
+    def toggle_trace(self, checked):
+        if checked:
+            instrument.enable()
+        else:
+            instrument.disable()
+
+    def export_trace(self):
+        filename = QFileDialog.getSaveFileName(self, 'Export trace')[0]
+        if filename:
+            instrument.export_chrome_trace(filename)
 
         
+    def toggle_playback(self, checked):
+        """Start or stop the animated playback. The width of the time window
+        is taken from the start and end date."""
+        if checked:
+            window = max(self.start_date.date().daysTo(self.end_date.date()), 1)
+            step = max(window // self.PLAYBACK_STEPS_PER_WINDOW, 1)
+            num_frames = self.map_explorer.start_playback(window, step)
+
+            self.time_slider.blockSignals(True)
+            self.time_slider.setRange(0, num_frames - 1)
+            self.time_slider.setValue(0)
+            self.time_slider.blockSignals(False)
+            self.time_slider.setEnabled(True)
+            self.scrub(0)
+
+            self.play.setText("Stop")
+            self.playback_timer.start(self.PLAYBACK_INTERVAL)
+        else:
+            self.playback_timer.stop()
+            self.time_slider.setEnabled(False)
+            self.map_explorer.stop_playback()
+            self.play.setText("Play")
+            self.redraw()
+
+    def advance_playback(self):
+        frame = self.time_slider.value() + 1
+        if frame > self.time_slider.maximum():
+            self.playback_timer.stop()
+        else:
+            self.time_slider.setValue(frame)
+
+    def scrub(self, frame):
+        if self.map_explorer.playback is None:
+            return
+        start_date, end_date = self.map_explorer.show_frame(frame)
+        self.time_bar.start_time = start_date.isoformat()
+        self.time_bar.end_time = end_date.isoformat()
+        self.time_bar.update()
+
+    def cancel_redraw(self):
+        if self.redrawing:
+            self.map_explorer.cancel_draw()
+            self.redrawing = False
+            self.status_bar.showMessage("Redraw cancelled.")
+
+    def load_actor_index(self):
+        """Load the actor index or build it in the background, the
+        completion of actor names is available afterwards."""
+        if os.path.isfile(self.ACTOR_INDEX_FILE):
+            self.set_actor_index(ActorIndex.load(self.ACTOR_INDEX_FILE))
+            return
+        self.status_bar.showMessage("Building the actor index.")
+        worker = ActorIndexWorker(self.client, self.ACTOR_INDEX_FILE)
+        thread = QtCore.QThread(self)
+        worker.moveToThread(thread)
+        thread.started.connect(worker.run)
+        worker.finished.connect(self.set_actor_index)
+        worker.failed.connect(self.actor_index_failed)
+        worker.finished.connect(thread.quit)
+        worker.failed.connect(thread.quit)
+        thread.finished.connect(thread.deleteLater)
+        self._index_worker = (thread, worker)
+        thread.start()
+
+    @pyqtSlot(object)
+    def set_actor_index(self, index):
+        self.actor_index = index
+        self._index_worker = None
+        completer = QCompleter(self.actor_completions, self)
+        completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        completer.setCompletionRole(Qt.UserRole)
+        self.actor_select.setCompleter(completer)
+        self.actor_select.textEdited.connect(self.complete_actor)
+        self.status_bar.clearMessage()
+
+    @pyqtSlot(str)
+    def actor_index_failed(self, message):
+        self._index_worker = None
+        self.status_bar.showMessage(
+            "The actor index could not be built: {}".format(message))
+
+    def complete_actor(self, text):
+        """Suggest actors for the last name of the comma separated list.
+        A chosen suggestion is replaced by its Q-id."""
+        head, _, query = text.rpartition(",")
+        query = query.strip()
+        self.actor_completions.clear()
+        if len(query) < self.COMPLETION_MIN_LENGTH:
+            return
+        if head:
+            head += ","
+        for actor_id, WDid, label in self.actor_index.search(query):
+            item = QStandardItem("{} ({})".format(label, WDid))
+            item.setData(head + WDid, Qt.UserRole)
+            self.actor_completions.appendRow(item)
+        self.actor_select.completer().complete()
+
     #TODO: Loading additional data, causes the old actors to remain visible (edges at least)
     def reload_data(self):
         if os.path.isfile(self.actor_select.text()):
@@ -355,31 +763,22 @@ class MainWindow(QMainWindow):
         
         nodeID = node.name
         self.node_detail.clear()
+        start_date = self.start_date.dateTime().toString("yyyy-MM-dd")
+        end_date = self.end_date.dateTime().toString("yyyy-MM-dd")
         content = "<b>Who was when in {} </b><br>".format(node.label)
-        for actor, graph in self.map_explorer.gc.graphs():
-            edges = graph.edges
-            if edges.empty:
-                continue            
-            
-            relevant_edges_from = edges[edges["from_node"]==nodeID]
-            relevant_edges_to = edges[edges["to_node"]==nodeID]
 
-            relevant_edges = edges[(edges["from_node"]==nodeID) | (edges["to_node"]==nodeID)]
-            if relevant_edges.empty:
-                continue
+        stays = OrderedDict()
+        for actor, arrival, departure in self.map_explorer.gc.visits(
+                nodeID, start_date, end_date):
+            stays.setdefault(actor, []).append((arrival, departure))
 
+        for actor, actor_stays in stays.items():
             content += "<span>{}:<span><br>".format(actor.name)
-            index = relevant_edges.index.values
-            if len(index)==1:
-                if relevant_edges.ix[index[0]].to_node == nodeID:
-                    content += "Came in {}<br>".format(relevant_edges.ix[index[0]].to_date)
+            for arrival, departure in actor_stays:
+                if arrival == departure:
+                    content += "{}<br>".format(arrival)
                 else:
-                    content += "Left in {}<br>".format(relevant_edges.ix[index[0]].from_date)                     
-                continue
-
-            for i in range(len(index)-1):
-                content += "{} -- {}<br>".format(relevant_edges.ix[index[i]].to_date, relevant_edges.ix[index[i+1]].from_date)
-           
+                    content += "{} -- {}<br>".format(arrival, departure)
 
         self.node_detail.insertHtml(content)
 
@@ -423,9 +822,23 @@ class MainWindow(QMainWindow):
         for actors in itertools.combinations(selected_actors, 2):
             self.map_explorer.find_cooccurence(*actors)
 
+    # File filter of save_state, which bundles the cached graphs
+    SESSION_FILTER = "Session with graphs (*.npz)"
+
     def save_state(self):
-        filename = QFileDialog.getSaveFileName(self, 'Save File')[0]
-        if filename:
+        filename, selected = QFileDialog.getSaveFileName(self, 'Save File', "",
+            "{};;Session (*.csv)".format(self.SESSION_FILTER))
+        if filename and (selected == self.SESSION_FILTER or filename.endswith(".npz")):
+            if not filename.endswith(".npz"):
+                filename = filename+".npz"
+            states = [[self.actor_overview.item(i).data(32),
+                       int(self.actor_overview.item(i).checkState())]
+                      for i in range(self.actor_overview.count())]
+            session.save(filename, self.map_explorer.gc, {
+                "start_date": self.start_date.dateTime().toString("yyyy-MM-dd"),
+                "end_date": self.end_date.dateTime().toString("yyyy-MM-dd"),
+                "actors": states})
+        elif filename:
             with open(filename, "w") as f:
                 f.write("Start_date,")
                 f.write(self.start_date.dateTime().toString("yyyy-MM-dd"))
@@ -440,16 +853,34 @@ class MainWindow(QMainWindow):
                     f.write("\n")
 
     def load_state(self):
-        filename = QFileDialog.getOpenFileName(self, 'Load File')[0]
-        if filename:
+        filename = QFileDialog.getOpenFileName(self, 'Load File', "",
+            "{};;Session (*.csv);;All files (*)".format(self.SESSION_FILTER))[0]
+        if filename.endswith(".npz"):
+            # Restore the actors and graphs without the database
+            self.status_bar.showMessage("Loading session...")
+            self.actor_overview.clear()
+            self.map_explorer.gc.clear()
+            _, meta = session.load(filename, self.map_explorer.gc)
+            self.set_dates(meta["start_date"], meta["end_date"])
+            # The saved check states, redraw adds the items of other
+            # actors checked. Nothing is drawn before the redraw
+            states = {actor_id: state
+                      for actor_id, state in meta.get("actors", [])}
+            self.actor_overview.blockSignals(True)
+            for actor in self.map_explorer.gc.actors:
+                item = QListWidgetItem(actor.name)
+                item.setCheckState(Qt.CheckState(
+                    states.get(actor.id, int(Qt.Checked))))
+                item.setData(32, actor.id)
+                self.actor_overview.addItem(item)
+            self.actor_overview.blockSignals(False)
+            self.redraw()
+        elif filename:
             actors = []
             with open(filename, "r") as f:
                 start_date = f.readline().split(",")[1]
-                start_date = QDate(*[int(d) for d in start_date.split("-")])
-                self.start_date.setDate(start_date)
                 end_date = f.readline().split(",")[1]
-                end_date = QDate(*[int(d) for d in end_date.split("-")])
-                self.end_date.setDate(end_date)
+                self.set_dates(start_date, end_date)
                 f.readline()
                 for line in f.readlines():
                     actor_id, state = line.strip().split(",")
@@ -459,6 +890,11 @@ class MainWindow(QMainWindow):
             self.map_explorer.gc.update_actor_list(actors)
             self.redraw()
 
+    def set_dates(self, start_date, end_date):
+        for edit, date in [(self.start_date, start_date), (self.end_date, end_date)]:
+            date = dateparse.parse_date(date)
+            edit.setDate(QDate(date.year, date.month, date.day))
+
     def import_graph(self):
         pass
 
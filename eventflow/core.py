@@ -1,14 +1,25 @@
-from collections import Iterator
+from collections import Iterator, OrderedDict
+import bisect
 import datetime
+import hashlib
+import numbers
 import os
+import re
+import threading
+import time
+import weakref
 
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.colors as clr
 
+from . import dateparse
+from . import flows
+from . import instrument
 from . import util
 from . import db_queries
+from . import storage
 
 NODES_SCHEMA = {"columns": ["label", "WDid", "lat", "lon"],
                 "index": pd.Int64Index([], name="locationID"),
@@ -25,6 +36,33 @@ EDGES_SCHEMA = {"columns": ["actorID", "from_node", "from_date",
 
 EDGES_ESSENTIAL_COLUMNS = ["from_node", "from_date", "to_node", "to_date"]
 
+# Number of entries in the actor cache, every actor takes up to three
+ACTOR_CACHE_SIZE = 30000
+
+_INT_PATTERN = re.compile(r"^\s*[+-]?\d+\s*$")
+_WDID_PATTERN = re.compile(r"^Q\d+$")
+
+# Number of transition matrices (time windows), which every graph caches
+TRANSITION_CACHE_SIZE = 8
+
+# Upper bounds in seconds of the load time histogram, the last bucket is open
+LOAD_TIME_BUCKETS = [0.01, 0.1, 1., 10.]
+
+STAYS_COLUMNS = ["locationID", "arrival", "departure", "duration"]
+STAYS_AGGREGATES = ["visits", "total_time", "last_visit"]
+
+# Typed arrays of EventGraph.columns, the node columns come first. The
+# masks are True for labels and Wikidata ids, which are missing
+GRAPH_NODE_COLUMNS = ["locationID", "label", "WDid", "lat", "lon",
+                      "label_missing", "WDid_missing"]
+GRAPH_EDGE_COLUMNS = ["actorID", "from_node", "to_node", "from_day", "to_day"]
+
+# Bytes of the digest of EventGraph.fingerprint
+FINGERPRINT_SIZE = 16
+# Columns, which == compares with a tolerance, e.g. after a round trip
+# through a text file
+APPROXIMATE_COLUMNS = ["lat", "lon"]
+
 
 class EventGraphError(Exception):
     """Basic EventGraph exception."""
@@ -37,7 +75,13 @@ class InputEventGraphWarning(EventGraphError):
 
 
 class Actor:
-    """Convenience class to enable an easy Actor manipulation and querying."""
+    """Convenience class to enable an easy Actor manipulation and querying.
+    Resolved actors are kept in a process wide cache per client, so the
+    same actor is only queried once, no matter if it is given by id, Q-id
+    or name.
+    """
+    __slots__ = ("id", "WDid", "name")
+
     def __init__(self, actor_id, client=None):
         """If no client is given, nothing will happen.
 
@@ -77,43 +121,48 @@ class Actor:
                 setattr(self, key, val)
 
     def _parse_input(self, actor_string, client):
+        queries = _queries(client)
 
         if(self._is_int(actor_string)):
-            query_function = db_queries.actor_by_id
+            query_function = queries.actor_by_id
             aid = int(actor_string)
+            key = ("id", aid)
         elif(self._is_WDid(actor_string)):
-            query_function = db_queries.actor_by_WDid
+            query_function = queries.actor_by_WDid
             aid = actor_string
+            key = ("WDid", aid)
         else:
-            query_function = db_queries.actor_by_name
+            query_function = queries.actor_by_name
             aid = actor_string
+            key = ("name", aid)
 
-        self._query_actor(aid, query_function, client)
+        actor = _actor_cache.get(client, key)
+        if actor is None:
+            self._query_actor(aid, query_function, client, key)
+        else:
+            self._set_properties(actor)
 
     def _set_properties(self, actor_dict):
         for key, val in actor_dict.items():
             setattr(self, key, val)
 
-    def _query_actor(self, actor_id, query_function, client):
+    def _query_actor(self, actor_id, query_function, client, key=None):
         actor = query_function(client, actor_id)
         self._set_properties(actor)
+        _actor_cache.put(client, actor, key)
+
+    @staticmethod
+    def clear_cache():
+        """Forget all resolved actors."""
+        _actor_cache.clear()
 
     def _is_int(self, val):
-        try:
-            int(val)
-            return True
-        except:
-            return False
+        # Like int(val), numbers are truncated, but "1.5" is a name
+        return isinstance(val, numbers.Real) or (
+            isinstance(val, str) and _INT_PATTERN.match(val) is not None)
 
     def _is_WDid(self, val):
-        try:
-            if(val[0] == "Q"):
-                int(val[1:])
-                return True
-            else:
-                return False
-        except:
-            return False
+        return isinstance(val, str) and _WDID_PATTERN.match(val) is not None
 
     def __repr__(self):
         try:
@@ -125,27 +174,153 @@ class Actor:
             return self.__class__
 
 
+class _ActorCache:
+    """Bounded LRU cache of actor dicts. The keys contain the id of the
+    client, so stores and databases do not share their actors. Clients
+    need not be hashable and are not kept alive, the actors of a client
+    are dropped, when it is collected. Every actor is stored under its
+    id, its Q-id and its name. Names are ambiguous, only a lookup by name
+    replaces the actor of a cached name, so the cache resolves a name
+    like the query of the client did."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        # id of a client -> finalizer, which drops its actors
+        self._clients = dict()
+        # Reentrant, a client may be collected while the lock is held
+        self._lock = threading.RLock()
+
+    def get(self, client, key):
+        with self._lock:
+            key = (self._client_id(client),) + key
+            actor = self._entries.get(key)
+            if actor is not None:
+                self._entries.move_to_end(key)
+            return actor
+
+    def put(self, client, actor, key=None):
+        """Store an actor dict, which was queried from client with key."""
+        if actor.get("id", -1) == -1:
+            return
+        with self._lock:
+            client_id = self._client_id(client)
+            name = (client_id, "name", actor["name"])
+            keys = [(client_id, "id", actor["id"]),
+                    (client_id, "WDid", "Q{}".format(actor["WDid"]))]
+            if (key is not None and key[0] == "name" or
+                    name not in self._entries):
+                keys.append(name)
+            for key in keys:
+                self._entries[key] = actor
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _client_id(self, client):
+        client_id = id(client)
+        if client_id not in self._clients:
+            try:
+                self._clients[client_id] = weakref.finalize(
+                    client, self._drop, client_id)
+            except TypeError:
+                # No weak references to None and the like, which live
+                # as long as the process anyway
+                self._clients[client_id] = None
+        return client_id
+
+    def _drop(self, client_id):
+        """Forget the actors of a collected client."""
+        with self._lock:
+            self._clients.pop(client_id, None)
+            for key in [key for key in self._entries if key[0] == client_id]:
+                del self._entries[key]
+
+
+_actor_cache = _ActorCache(ACTOR_CACHE_SIZE)
+
+
+class CacheStatistics:
+    """Hit and miss counters and load times of a GraphCollection."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.hits = 0
+        self.misses = 0
+        self.load_time = 0.
+        self.load_counts = [0] * (len(LOAD_TIME_BUCKETS) + 1)
+
+    def hit(self):
+        self.hits += 1
+
+    def miss(self, seconds):
+        """Count a graph, which had to be loaded.
+
+        :param seconds: Time it took to load the graph
+        :type seconds: float
+        """
+        self.misses += 1
+        self.load_time += seconds
+        self.load_counts[bisect.bisect_left(LOAD_TIME_BUCKETS, seconds)] += 1
+
+    @property
+    def hit_ratio(self):
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0.
+
+    @property
+    def load_histogram(self):
+        """(upper bound in seconds, number of loads) per bucket,
+        the upper bound of the last bucket is infinite."""
+        return list(zip(LOAD_TIME_BUCKETS + [float("inf")], self.load_counts))
+
+
 class GraphCollection:
     """
     Manages the actors and their resepective EventGraph's.
     Queries the data from the database and stores them in a cache.
     """
 
-    def __init__(self, actor_list, client, load_function=db_queries.get_graph):
+    def __init__(self, actor_list, client, load_function=None):
         """
         :param actor_list: List of actors, for which to fetch the EventGraph
         :type actor_list: list of either actor ids, wikidata ids
             or string labels
         :param client: The client for the database access
-        :type client: pymongo.MongoClient
-        :param load_function: Function which queries for the nodes and edges
+        :type client: pymongo.MongoClient or eventflow.storage.Store
+        :param load_function: Function which queries for the nodes and edges,
+            defaults to the get_graph of db_queries or of the storage module,
+            if the client is a store.
         :type load_function: function -> load_function(client, actorID):
             return nodes, edges
         """
+        if load_function is None:
+            load_function = _queries(client).get_graph
         self._actors = dict()
         self._cache = dict()
+        # Inverted index: locationID -> (sorted arrivals, stays)
+        # and actorID -> visited locationIDs
+        self._visits = dict()
+        self._visited = dict()
         self.client = client
         self.load_function = load_function
+        self.statistics = CacheStatistics()
+        # Created by the first call of od_flows
+        self._flows = None
+        # (index, start, end) -> sum of the transition matrices, replaced
+        # by an empty dictionary whenever the graphs change
+        self._transitions = OrderedDict()
+        # Guards the cache and the indices, which are changed by
+        # invalidate from other threads. Counts the invalidations,
+        # so a graph loaded meanwhile is not cached.
+        self._lock = threading.RLock()
+        self._invalidations = 0
 
         self.update_actor_list(actor_list)
 
@@ -155,40 +330,120 @@ class GraphCollection:
         If an EventGraph is not stored in the cache,
         it is fetched with _query_graph.
         """
-        for index, actor in self._actors.items():
-            if actor.id in self._cache:
-                yield (actor, self._cache[actor.id])
+        # Iterate over a snapshot, the actor list may change meanwhile
+        for index, actor in list(self._actors.items()):
+            with self._lock:
+                graph = self._cache.get(actor.id, None)
+                invalidations = self._invalidations
+            if graph is not None:
+                self.statistics.hit()
+                yield (actor, graph)
             else:
+                start = time.perf_counter()
                 graph = self._query_graph(actor_id=actor.id)
+                self.statistics.miss(time.perf_counter() - start)
                 if graph:
-                    self._cache[actor.id] = graph
+                    with self._lock:
+                        if invalidations == self._invalidations:
+                            self._cache[actor.id] = graph
+                            self._index_graph(actor.id, graph)
                     yield (actor, graph)
 
     def clear(self):
         """ Clear everything. Empties the cache and the saved actors."""
-        for graph in self._cache.values():
-            del graph
-        for actor in self._actors.values():
-            del actor
-        self._actors = dict()
-        self._cache = dict()
+        with self._lock:
+            for graph in self._cache.values():
+                del graph
+            for actor in self._actors.values():
+                del actor
+            self._actors = dict()
+            self._cache = dict()
+            self._visits = dict()
+            self._visited = dict()
+            self._flows = None
+            self._transitions = OrderedDict()
+            self._invalidations += 1
+
+    def invalidate(self, actor_ids=None):
+        """Drop cached graphs, which are outdated. The actors stay in the
+        collection, their graphs are fetched again by graphs().
+
+        :param actor_ids: Ids of the actors, defaults to all cached graphs
+        :type actor_ids: iterable
+
+        :returns: Ids of the dropped graphs
+        :rtype: list
+        """
+        with self._lock:
+            if actor_ids is None:
+                actor_ids = list(self._cache)
+            dropped = []
+            for actor_id in actor_ids:
+                if self._cache.pop(actor_id, None) is not None:
+                    dropped.append(actor_id)
+                self._unindex_graph(actor_id)
+                if self._flows is not None:
+                    self._flows.remove(actor_id)
+            self._transitions = OrderedDict()
+            self._invalidations += 1
+        return dropped
+
+    @property
+    def cached_actor_ids(self):
+        """Ids of the actors with a cached graph."""
+        with self._lock:
+            return list(self._cache)
+
+    def visitors(self, location_ids):
+        """Ids of the actors, whose cached graphs visit the locations.
+
+        :param location_ids: locationIDs
+        :type location_ids: iterable
+
+        :rtype: set
+        """
+        with self._lock:
+            return {stay[2] for location_id in location_ids
+                    for stay in self._visits.get(location_id, ([], []))[1]}
+
+    def visited_locations(self):
+        """locationIDs of all cached graphs.
+
+        :rtype: set
+        """
+        with self._lock:
+            return set().union(*self._visited.values())
+
+    def fingerprints(self):
+        """Fingerprints of the cached graphs, see EventGraph.fingerprint.
+
+        :returns: actorID -> fingerprint
+        :rtype: dict
+        """
+        with self._lock:
+            graphs = list(self._cache.items())
+        return {actor_id: graph.fingerprint for actor_id, graph in graphs}
 
     def update_actor_list(self, actor_list):
         """
         Update the internal list of actors.
 
-        :param actor_list: Single actorID or list of actorIDs
-        :type actor_list: int or list
+        :param actor_list: Single actorID or list of actorIDs, resolved
+            actors are taken as they are
+        :type actor_list: int, eventflow.core.Actor or list
         """
         if not isinstance(actor_list, list):
             actor_list = [actor_list]
 
         for a in actor_list:
-            if not isinstance(a, Actor):
+            if isinstance(a, Actor):
+                actor = a
+            else:
                 actor = str(a).strip()
                 actor = Actor(actor, self.client)
-                if (actor.id not in self._actors and actor.id != -1):
-                    self._actors[actor.id] = actor
+            if (actor.id not in self._actors and actor.id != -1):
+                self._actors[actor.id] = actor
+                self._transitions = OrderedDict()
 
     def remove_actor(self, actor_id):
         """Remove an actor from the collection, if a cached graph
@@ -202,11 +457,16 @@ class GraphCollection:
             del actor
         except:
             pass
-        try:
-            graph = self._cache.pop(actor_id)
-            del graph
-        except:
-            pass
+        with self._lock:
+            try:
+                graph = self._cache.pop(actor_id)
+                del graph
+            except:
+                pass
+            self._unindex_graph(actor_id)
+            if self._flows is not None:
+                self._flows.remove(actor_id)
+            self._transitions = OrderedDict()
 
     def get_actor(self, actor_id):
         """Get an actor by its id.
@@ -226,6 +486,7 @@ class GraphCollection:
 
     def add(self, actor, graph):
         """Add a graph with its associated actor to the graph collection.
+        A cached graph of the actor is replaced.
 
         :param actor: Associated actor
         :type actor: eventflow.core.Actor
@@ -242,7 +503,168 @@ class GraphCollection:
                                                         EventGraph.__name__))
 
         self._actors[actor.id] = actor
-        self._cache[actor.id] = graph
+        with self._lock:
+            self._cache[actor.id] = graph
+            self._unindex_graph(actor.id)
+            self._index_graph(actor.id, graph)
+            if self._flows is not None:
+                self._flows.add(actor.id, graph)
+            self._transitions = OrderedDict()
+
+    def append(self, actor_id, nodes, edges):
+        """Append new events to the cached graph of an actor, see
+        EventGraph.append. If the graph is not cached, nothing is done,
+        it is fetched completely by graphs() later on.
+
+        :param actor_id: Id of the actor
+        :type actor_id: int
+        :param nodes: Nodes of the new edges
+        :type nodes: pandas.DataFrame
+        :param edges: New edges
+        :type edges: pandas.DataFrame
+
+        :returns: The new edges of the active set, None if the graph
+            is not cached
+        :rtype: pandas.DataFrame
+        """
+        with self._lock:
+            graph = self._cache.get(actor_id, None)
+            if graph is None:
+                return None
+            added = graph.append(nodes, edges)
+            self._unindex_graph(actor_id)
+            self._index_graph(actor_id, graph)
+            if self._flows is not None:
+                self._flows.add(actor_id, graph)
+            self._transitions = OrderedDict()
+        return added
+
+    def visits(self, location_id, start_date=None, end_date=None):
+        """Who was when at a location. Only cached graphs are considered,
+        nothing is fetched from the database.
+
+        :param location_id: Id of the location
+        :type location_id: int
+        :param start_date: Only stays which end at or after this date
+        :type start_date: datetime.date or yyyy-mm-dd (ISO 8601)
+        :param end_date: Only stays which begin at or before this date
+        :type end_date: datetime.date or yyyy-mm-dd (ISO 8601)
+
+        :returns: (actor, arrival, departure) ordered by arrival
+        :rtype: list
+        """
+        arrivals, stays = self._visits.get(location_id, ([], []))
+        if end_date:
+            end = dateparse.parse_date(end_date).toordinal()
+            stays = stays[:bisect.bisect_right(arrivals, end)]
+        if start_date:
+            start = dateparse.parse_date(start_date).toordinal()
+            stays = [s for s in stays if s[1] >= start]
+        return [(self._actors[actor_id],
+                 datetime.date.fromordinal(arrival),
+                 datetime.date.fromordinal(departure))
+                for arrival, departure, actor_id in stays
+                if actor_id in self._actors]
+
+    def cache_statistics(self):
+        """Size of the cache and how often graphs() had to load a graph.
+
+        :returns: Dictionary with the number of cached graphs, the bytes
+            per cached graph (actorID -> bytes), their total, the hits,
+            misses, hit ratio, total load time in seconds and the load time
+            histogram (see CacheStatistics.load_histogram)
+        :rtype: dict
+        """
+        memory = {actor_id: graph.memory_usage()["total"]
+                  for actor_id, graph in list(self._cache.items())}
+        return {"graphs": len(memory),
+                "memory": memory,
+                "total_memory": sum(memory.values()),
+                "hits": self.statistics.hits,
+                "misses": self.statistics.misses,
+                "hit_ratio": self.statistics.hit_ratio,
+                "load_time": self.statistics.load_time,
+                "load_histogram": self.statistics.load_histogram}
+
+    def od_flows(self, start_date=None, end_date=None, fetch=True):
+        """Flows between the locations summed over all actors, see
+        eventflow.flows.ODFlows.flows. Missing graphs are fetched. The
+        flows are updated incrementally, when actors are added or removed.
+
+        :param start_date: Only edges, which begin at or after this date
+        :type start_date: datetime.date or yyyy-mm-dd (ISO 8601)
+        :param end_date: Only edges, which end at or before this date
+        :type end_date: datetime.date or yyyy-mm-dd (ISO 8601)
+        :param fetch: Whether to fetch missing graphs, otherwise only the
+            cached graphs are summed up
+        :type fetch: bool
+
+        :returns: Data frame with the eventflow.flows.FLOWS_COLUMNS
+        :rtype: pandas.DataFrame
+        """
+        if self._flows is None:
+            self._flows = flows.ODFlows()
+        if fetch:
+            graphs = ((actor.id, graph) for actor, graph in self.graphs())
+        else:
+            with self._lock:
+                graphs = list(self._cache.items())
+        for actor_id, graph in graphs:
+            if actor_id not in self._flows:
+                self._flows.add(actor_id, graph)
+        return self._flows.flows(start_date, end_date)
+
+    def map_reduce(self, func, reduce=None, initial=None, processes=None,
+                   start_date=None, end_date=None):
+        """Apply func(actorID, graph) to every graph in a process pool and
+        reduce the results, see eventflow.parallel.map_reduce. Missing
+        graphs are fetched first.
+
+        :returns: The reduced result or, without reduce, actorID -> result
+        """
+        # parallel rebuilds the graphs with this module
+        from . import parallel
+        return parallel.map_reduce(
+            ((actor.id, graph) for actor, graph in self.graphs()), func,
+            reduce, initial, processes, start_date, end_date)
+
+    def transition_matrix(self, start_date=None, end_date=None,
+                          normalize=False, index=None):
+        """Sum of the transition matrices of all graphs, see
+        EventGraph.transition_matrix. Missing graphs are fetched. The sums
+        of the last TRANSITION_CACHE_SIZE windows are cached, until a
+        graph or the actors change.
+
+        :param normalize: Scale the rows to a sum of 1
+        :type normalize: bool
+        :param index: Mapping of the locations, defaults to
+            eventflow.flows.locations
+        :type index: eventflow.flows.LocationIndex
+
+        :rtype: scipy.sparse.csr_matrix
+        """
+        if index is None:
+            index = flows.locations
+        start = dateparse.parse_date(start_date).toordinal() if start_date else None
+        end = dateparse.parse_date(end_date).toordinal() if end_date else None
+        key = (index, start, end)
+
+        # A sum of outdated graphs ends up in the replaced dictionary
+        with self._lock:
+            cache = self._transitions
+            matrix = cache.get(key)
+        if matrix is None:
+            matrices = [graph.transition_matrix(start_date, end_date, index)
+                        for _, graph in self.graphs()]
+            matrix = flows.total(matrices, len(index))
+            with self._lock:
+                cache[key] = matrix
+                if len(cache) > TRANSITION_CACHE_SIZE:
+                    cache.popitem(last=False)
+        matrix = flows.resize(matrix, len(index))
+        if normalize:
+            matrix = flows.normalize(matrix)
+        return matrix
 
     @property
     def actors(self):
@@ -253,9 +675,32 @@ class GraphCollection:
     def num_actors(self):
         return len(self._actors)
 
+    def _index_graph(self, actor_id, graph):
+        visited = self._visited.setdefault(actor_id, set())
+        table = graph.all_stays
+        for location_id, arrival, departure in zip(
+                table.locationID.values.tolist(),
+                table.arrival.values.tolist(),
+                table.departure.values.tolist()):
+            arrivals, stays = self._visits.setdefault(location_id, ([], []))
+            position = bisect.bisect_right(arrivals, arrival)
+            arrivals.insert(position, arrival)
+            stays.insert(position, (arrival, departure, actor_id))
+            visited.add(location_id)
+
+    def _unindex_graph(self, actor_id):
+        for location_id in self._visited.pop(actor_id, ()):
+            arrivals, stays = self._visits.pop(location_id)
+            remaining = [s for s in stays if s[2] != actor_id]
+            if remaining:
+                self._visits[location_id] = ([s[0] for s in remaining],
+                                             remaining)
+
     def _query_graph(self, actor_id):
         if actor_id != -1:
-            nodes, edges = self.load_function(self.client, actor_id)
+            with instrument.span("load_function", actorID=actor_id):
+                nodes, edges = self.load_function(self.client, actor_id)
+            instrument.count("graphs_loaded")
             if nodes.empty or edges.empty:
                 return None
             graph = EventGraph(nodes, edges)
@@ -269,6 +714,7 @@ class EventGraph:
     """Base class for a single event graph.
     It manages the nodes andd edges for one specific actor.
     """
+    @instrument.traced("EventGraph.__init__")
     def __init__(self, nodes, edges):
         """
         :param nodes: Data frame which represents the set of nodes,
@@ -300,20 +746,71 @@ class EventGraph:
         if self._nodes.index.name != NODES_SCHEMA["index"].name:
             self._nodes = self._nodes.set_index(NODES_SCHEMA["index"].name)
 
-        try:
-            self._edges.from_date = self._edges.from_date.apply(
-                lambda x: datetime.date(*[int(d) for d in x.split("-")]))
-            self._edges.to_date = self._edges.to_date.apply(
-                lambda x: datetime.date(*[int(d) for d in x.split("-")]))
-        except AttributeError:
-            pass
-
-        self._edges.sort_values("from_date", inplace=True)
-
+        # Dates as proleptic Gregorian ordinals, aligned with self._edges
+        with instrument.span("dateparse"):
+            from_days = dateparse.ordinals(self._edges.from_date.values)
+            to_days = dateparse.ordinals(self._edges.to_date.values)
+            self._edges.from_date = dateparse.from_ordinals(from_days)
+            self._edges.to_date = dateparse.from_ordinals(to_days)
+
+        order = np.argsort(from_days, kind="mergesort")
+        self._edges = self._edges.iloc[order]
+        self._from_days = from_days[order]
+        self._to_days = to_days[order]
+        self._stays = _stays_table(self._edges.from_node.values,
+                                   self._edges.to_node.values,
+                                   self._from_days, self._to_days)
+        self._setup()
+
+    @classmethod
+    @instrument.traced("EventGraph._from_sorted")
+    def _from_sorted(cls, nodes, edges, from_days, to_days, stays=None):
+        """Create an EventGraph from data in the internal form, which is
+        neither checked, parsed nor sorted again.
+
+        :param nodes: Nodes indexed by their locationID
+        :type nodes: pandas.DataFrame
+        :param edges: Edges sorted by their from date, the dates are
+            datetime.date or dateparse.HistoricDate objects
+        :type edges: pandas.DataFrame
+        :param from_days: Ordinals of the from dates of the edges
+        :type from_days: numpy.ndarray
+        :param to_days: Ordinals of the to dates of the edges
+        :type to_days: numpy.ndarray
+        :param stays: Stays of the edges, computed if None
+        :type stays: pandas.DataFrame
+
+        :rtype: eventflow.EventGraph
+        """
+        graph = cls.__new__(cls)
+        graph._nodes = nodes
+        graph._edges = edges
+        graph._from_days = from_days
+        graph._to_days = to_days
+        if stays is None:
+            stays = _stays_table(edges.from_node.values, edges.to_node.values,
+                                 from_days, to_days)
+        graph._stays = stays
+        graph._setup()
+        return graph
+
+    def _setup(self):
+        """Create the caches and build the complete graph."""
         self._cmap = plt.get_cmap('viridis')
+        # (index, start, end) -> transition matrix
+        self._transitions = OrderedDict()
+        # Called with (graph, edges, refreshed) after every append
+        self._subscribers = []
+        # Content hashes of all columns and without the
+        # APPROXIMATE_COLUMNS, computed on demand
+        self._fingerprint = None
+        self._exact_fingerprint = None
+        # Result of memory_usage, until the data changes
+        self._memory_usage = None
 
         self.build(color_nodes=False, color_edges=False)
 
+    @instrument.traced("EventGraph.build")
     def build(self,
               start_date=None,
               end_date=None,
@@ -335,33 +832,191 @@ class EventGraph:
         :type color_nodes: bool
         """
 
+        # An open time frame grows with appended edges
+        self._open_start = not start_date
+        self._open_end = not end_date
+        self._colors = (color_edges, color_nodes)
+
         if not start_date:
             self._start_date = self._edges.from_date.min()
-        elif isinstance(start_date, datetime.date):
-            self._start_date = start_date
         else:
-            self._start_date = datetime.date(
-                *[int(x) for x in start_date.split("-")])
+            self._start_date = dateparse.parse_date(start_date)
 
         if not end_date:
             self._end_date = self._edges.to_date.max()
-        elif isinstance(end_date, datetime.date):
-            self._end_date = end_date
         else:
-            self._end_date = datetime.date(
-                *[int(x) for x in end_date.split("-")])
+            self._end_date = dateparse.parse_date(end_date)
+
+        return self._refresh()
+
+    @instrument.traced("EventGraph.append")
+    def append(self, nodes, edges):
+        """Add new events to the graph without building it again. The new
+        edges are merged into the date ordered edges, the stays and the
+        active set are updated. An open time frame (build without start
+        or end date) is extended to the new edges.
+        Edges, which are appended after all known edges, are added to the
+        active set directly, otherwise the active set is reduced again.
+        Afterwards the subscribers are notified, see subscribe.
+
+        :param nodes: Nodes of the new edges, known nodes are ignored
+        :type nodes: pandas.DataFrame
+        :param edges: New edges, at least with the EDGES_ESSENTIAL_COLUMNS
+        :type edges: pandas.DataFrame
+
+        :returns: The new edges of the active set
+        :rtype: pandas.DataFrame
+        """
+        if not (isinstance(nodes, pd.DataFrame) and
+                isinstance(edges, pd.DataFrame)):
+
+            raise EventGraphError("""Input types for EventGraph
+                need to be pandas.DataFrame""")
+
+        if not set(EDGES_ESSENTIAL_COLUMNS) <= set(edges.columns):
+            raise EventGraphError("""Missing essential columns for the edges.
+                Need at least: {}""".format(EDGES_ESSENTIAL_COLUMNS))
+
+        if edges.empty:
+            return self._reduced_edges.iloc[:0]
+
+        if nodes.index.name != NODES_SCHEMA["index"].name:
+            nodes = nodes.set_index(NODES_SCHEMA["index"].name)
+        nodes = nodes[~nodes.index.isin(self._nodes.index) &
+                      ~nodes.index.duplicated()]
+        if not nodes.empty:
+            self._nodes = _concat(self._nodes, nodes)
+
+        edges = edges.copy()
+        from_days = dateparse.ordinals(edges.from_date.values)
+        to_days = dateparse.ordinals(edges.to_date.values)
+        edges.from_date = dateparse.from_ordinals(from_days)
+        edges.to_date = dateparse.from_ordinals(to_days)
+        order = np.argsort(from_days, kind="mergesort")
+        edges = edges.iloc[order]
+        from_days = from_days[order]
+        to_days = to_days[order]
+        # The index identifies the edges of an actor, see render_data
+        first_id = self._edges.index.max() + 1 if len(self._edges) else 0
+        edges.index = pd.Index(first_id + np.arange(len(edges)))
+
+        num_known = len(self._from_days)
+        at_end = not num_known or from_days[0] >= self._from_days[-1]
+        self._edges = _concat(self._edges, edges)
+        self._from_days = np.concatenate([self._from_days, from_days])
+        self._to_days = np.concatenate([self._to_days, to_days])
+        if at_end:
+            self._stays = _append_stays(self._stays, _stays_table(
+                edges.from_node.values, edges.to_node.values,
+                from_days, to_days))
+        else:
+            # Merge both sorted sequences, new edges after known edges
+            # of the same day, like a stable sort of all edges
+            positions = np.empty(len(self._from_days), dtype=np.int64)
+            positions[np.arange(num_known) + np.searchsorted(
+                from_days, self._from_days[:num_known], side="left")] = \
+                np.arange(num_known)
+            positions[np.arange(len(edges)) + np.searchsorted(
+                self._from_days[:num_known], from_days, side="right")] = \
+                num_known + np.arange(len(edges))
+            self._edges = self._edges.iloc[positions]
+            self._from_days = self._from_days[positions]
+            self._to_days = self._to_days[positions]
+            self._stays = _stays_table(self._edges.from_node.values,
+                                       self._edges.to_node.values,
+                                       self._from_days, self._to_days)
+        self._transitions.clear()
+        self._fingerprint = None
+        self._exact_fingerprint = None
+        self._memory_usage = None
+
+        frame = (self._start_date, self._end_date)
+        if self._open_start:
+            self._start_date = self._edges.from_date.min()
+        if self._open_end:
+            self._end_date = self._edges.to_date.max()
+
+        refreshed = (not at_end or self._reduced_edges.empty or
+                     frame != (self._start_date, self._end_date))
+        if refreshed:
+            self._refresh()
+            added = self._reduced_edges
+        else:
+            added = self._extend_reduced_graph(edges, from_days, to_days)
+
+        for callback in list(self._subscribers):
+            callback(self, added, refreshed)
+        return added
 
-        self._reduce_graph()
+    def subscribe(self, callback):
+        """Register a function, which is called after every append as
+        callback(graph, edges, refreshed) in the thread, which appended.
+        edges are the new edges of the active set. If refreshed is True,
+        the complete active set was reduced again and edges is all of it.
+
+        :param callback: Function to call
+        :type callback: function
+        """
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """Remove a function registered with subscribe."""
+        try:
+            self._subscribers.remove(callback)
+        except ValueError:
+            pass
+
+    def _refresh(self):
+        """Reduce the graph to the time frame and color it."""
+        self._memory_usage = None
+        with instrument.span("EventGraph._reduce_graph"):
+            self._reduce_graph()
         if self._reduced_edges.empty:
             return empty_graph_data()
 
+        color_edges, color_nodes = self._colors
         if color_edges:
-            self._edge_color()
+            with instrument.span("EventGraph._edge_color"):
+                self._edge_color()
         if color_nodes:
-            self._node_color()
+            with instrument.span("EventGraph._node_color"):
+                self._node_color()
 
         return self
 
+    def _extend_reduced_graph(self, edges, from_days, to_days):
+        """Add the appended edges, which are within the time frame,
+        to the active set. The time frame must not have changed.
+
+        :returns: The added edges
+        :rtype: pandas.DataFrame
+        """
+        start = self._start_date.toordinal()
+        end = self._end_date.toordinal()
+        in_frame = (from_days >= start) & (to_days <= end)
+        edges = edges[in_frame].copy()
+        days = to_days[in_frame]
+
+        color_edges, color_nodes = self._colors
+        if color_edges:
+            edges["color"] = [clr.rgb2hex(c)
+                              for c in self._cmap(self._scaled_days(days))]
+        self._reduced_edges = _concat(self._reduced_edges, edges)
+        self._reduced_days = np.concatenate([self._reduced_days, days])
+        self._reduced_stays = self._clip_stays(start, end)
+
+        reduced_nodes = self._reduced_nodes
+        if color_nodes:
+            reduced_nodes = reduced_nodes.drop("color", 1)
+        node_ids = np.unique(edges[["from_node", "to_node"]].values).astype(int)
+        node_ids = node_ids[~np.in1d(node_ids, reduced_nodes.index.values)]
+        if len(node_ids):
+            reduced_nodes = _concat(reduced_nodes, self._nodes.reindex(node_ids))
+        self._reduced_nodes = reduced_nodes
+        if color_nodes:
+            self._node_color()
+        return edges
+
     def coocurrence(self, graph):
         result = self._reduced_edges.merge(graph.edges, left_on=["from_node", "from_date"], right_on=["from_node", "from_date"], how="inner", suffixes=["","_x"])
         #cols = [x for x in result.columns if x.endswith("_x")]
@@ -376,9 +1031,10 @@ class EventGraph:
 
     def intersect(self, graph):
         result = self._reduced_edges.merge(graph.edges, left_on=["from_node", "from_date", "to_node", "to_date"], right_on=["from_node", "from_date", "to_node", "to_date"], how="inner", suffixes=["","_x"])
-        edges = result[["_id","from_node","to_node","from_date","to_date"]]
-        nodes = pd.concat([self._reduced_nodes.ix[edges.from_node],self._reduced_nodes.ix[edges.to_node]]).drop_duplicates()
-        nodes = nodes.drop(["color", "population"], 1)
+        edges = result[[c for c in self._reduced_edges.columns if c != "color"]]
+        nodes = pd.concat([self._reduced_nodes.ix[edges.from_node],self._reduced_nodes.ix[edges.to_node]])
+        nodes = nodes[~nodes.index.duplicated()]
+        nodes = nodes.drop([c for c in ["color", "population"] if c in nodes.columns], 1)
         return EventGraph(nodes.reset_index(), edges)
 
     def to_csv(self, directory=os.getcwd(), prefix="", suffix=""):
@@ -408,6 +1064,233 @@ class EventGraph:
         """Active set of edges."""
         return self._reduced_edges
 
+    @property
+    def all_nodes(self):
+        """Complete set of nodes, independent of the active time frame."""
+        return self._nodes
+
+    @property
+    def all_edges(self):
+        """Complete set of edges, independent of the active time frame."""
+        return self._edges
+
+    @property
+    def stays(self):
+        """Stays of the actor in the active time frame. Consecutive events
+        at the same location are merged into one stay. The columns are
+        locationID, arrival, departure and duration. Dates are proleptic
+        Gregorian ordinals (see datetime.date.fromordinal), the duration
+        is given in days."""
+        return self._reduced_stays
+
+    @property
+    def all_stays(self):
+        """Complete set of stays, independent of the active time frame."""
+        return self._stays
+
+    def stay_statistics(self):
+        """Aggregate the stays in the active time frame per location.
+
+        :returns: Data frame indexed by locationID with the columns visits,
+            total_time (days) and last_visit (day ordinal)
+        :rtype: pandas.DataFrame
+        """
+        stays = self._reduced_stays
+        locations, inverse = np.unique(stays.locationID.values,
+                                       return_inverse=True)
+        visits = np.bincount(inverse, minlength=len(locations))
+        total_time = np.zeros(len(locations), dtype=np.int64)
+        np.add.at(total_time, inverse, stays.duration.values)
+        last_visit = np.zeros(len(locations), dtype=np.int64)
+        np.maximum.at(last_visit, inverse, stays.departure.values)
+
+        return pd.DataFrame({"visits": visits,
+                             "total_time": total_time,
+                             "last_visit": last_visit},
+                            index=pd.Index(locations,
+                                           name=NODES_SCHEMA["index"].name),
+                            columns=STAYS_AGGREGATES)
+
+    def transition_matrix(self, start_date=None, end_date=None, index=None):
+        """Number of transitions between the locations of the edges, which
+        lie within the time window. The matrices of the last
+        TRANSITION_CACHE_SIZE windows are cached.
+
+        :param start_date: Only edges, which begin at or after this date
+        :type start_date: datetime.date or yyyy-mm-dd (ISO 8601)
+        :param end_date: Only edges, which end at or before this date
+        :type end_date: datetime.date or yyyy-mm-dd (ISO 8601)
+        :param index: Mapping of the locations, defaults to
+            eventflow.flows.locations
+        :type index: eventflow.flows.LocationIndex
+
+        :returns: Square matrix with the number of transitions
+            from row to column
+        :rtype: scipy.sparse.csr_matrix
+        """
+        if index is None:
+            index = flows.locations
+        start = dateparse.parse_date(start_date).toordinal() if start_date else None
+        end = dateparse.parse_date(end_date).toordinal() if end_date else None
+        key = (index, start, end)
+
+        matrix = self._transitions.get(key)
+        if matrix is None:
+            # The edges are sorted by their from date
+            lower = (np.searchsorted(self._from_days, start, side="left")
+                     if start is not None else 0)
+            from_nodes = self._edges.from_node.values[lower:]
+            to_nodes = self._edges.to_node.values[lower:]
+            if end is not None:
+                in_frame = self._to_days[lower:] <= end
+                from_nodes, to_nodes = from_nodes[in_frame], to_nodes[in_frame]
+            matrix = flows.transition_counts(from_nodes, to_nodes, index)
+            self._transitions[key] = matrix
+            self._memory_usage = None
+            if len(self._transitions) > TRANSITION_CACHE_SIZE:
+                self._transitions.popitem(last=False)
+        return flows.resize(matrix, len(index))
+
+    def columns(self):
+        """The complete graph as typed arrays, which can be stored or shared
+        without pickling, see from_columns. Labels and Wikidata ids of the
+        nodes become strings, missing ones empty strings with a True in
+        their mask. Dates are day ordinals and the edges keep only the
+        GRAPH_EDGE_COLUMNS.
+
+        :returns: name -> array of the GRAPH_NODE_COLUMNS and the
+            GRAPH_EDGE_COLUMNS
+        :rtype: collections.OrderedDict
+        """
+        nodes = self._nodes
+        edges = self._edges
+        if "actorID" in edges:
+            actor_ids = edges.actorID.values.astype(np.int64)
+        else:
+            actor_ids = np.full(len(edges), -1, dtype=np.int64)
+        label, label_missing = _strings(nodes.label.values)
+        WDid, WDid_missing = _strings(nodes.WDid.values)
+        return OrderedDict([
+            ("locationID", nodes.index.values.astype(np.int64)),
+            ("label", label),
+            ("WDid", WDid),
+            ("lat", nodes.lat.values.astype(np.float64)),
+            ("lon", nodes.lon.values.astype(np.float64)),
+            ("label_missing", label_missing),
+            ("WDid_missing", WDid_missing),
+            ("actorID", actor_ids),
+            ("from_node", edges.from_node.values.astype(np.int64)),
+            ("to_node", edges.to_node.values.astype(np.int64)),
+            ("from_day", self._from_days),
+            ("to_day", self._to_days)])
+
+    @classmethod
+    def from_columns(cls, columns, digests=None):
+        """Create an EventGraph from the arrays of columns. The edges get
+        the columns of db_queries.EDGES_COLUMNS. Edges, which are sorted
+        by their from day like the ones of columns, are taken as they are.
+
+        :param columns: name -> array, at least the GRAPH_NODE_COLUMNS
+            and GRAPH_EDGE_COLUMNS, the masks are optional
+        :type columns: dict
+        :param digests: Fingerprints of the columns, which were already
+            computed by _column_digests
+        :type digests: (string, string)
+
+        :rtype: eventflow.EventGraph
+        """
+        index = pd.Index(np.asarray(columns["locationID"], dtype=np.int64),
+                         name=NODES_SCHEMA["index"].name)
+        lat = np.asarray(columns["lat"], dtype=np.float64)
+        lon = np.asarray(columns["lon"], dtype=np.float64)
+        strings = dict()
+        for name in ["label", "WDid"]:
+            values = np.asarray(columns[name]).astype(object)
+            missing = columns.get(name + "_missing")
+            if missing is not None:
+                values[np.asarray(missing, dtype=bool)] = None
+            strings[name] = values
+        nodes = pd.DataFrame(OrderedDict([
+            ("label", strings["label"]), ("WDid", strings["WDid"]),
+            ("lat", lat), ("lon", lon)]), index=index)
+
+        from_node = np.asarray(columns["from_node"], dtype=np.int64)
+        to_node = np.asarray(columns["to_node"], dtype=np.int64)
+        from_days = np.array(columns["from_day"], dtype=np.int64)
+        to_days = np.array(columns["to_day"], dtype=np.int64)
+        from_position = index.get_indexer(from_node)
+        to_position = index.get_indexer(to_node)
+        edges = pd.DataFrame(OrderedDict([
+            ("actorID", np.asarray(columns["actorID"], dtype=np.int64)),
+            ("from_node", from_node),
+            ("from_date", dateparse.from_ordinals(from_days)),
+            ("to_node", to_node),
+            ("to_date", dateparse.from_ordinals(to_days)),
+            ("from_lat", lat[from_position]), ("from_lon", lon[from_position]),
+            ("to_lat", lat[to_position]), ("to_lon", lon[to_position])]))
+
+        if (len(from_days) and len(index) and
+                (from_days[1:] >= from_days[:-1]).all()):
+            graph = cls._from_sorted(nodes, edges, from_days, to_days)
+        else:
+            graph = cls(nodes, edges)
+        if digests is not None:
+            graph._fingerprint, graph._exact_fingerprint = digests
+        return graph
+
+    @property
+    def fingerprint(self):
+        """Content hash of the complete graph, a hex string. It is computed
+        once from the columns (see columns) with the nodes ordered by
+        their locationID, so it does not depend on the order of the
+        nodes, see _column_digests. Equal graphs have equal fingerprints,
+        which can be used as keys of caches. The time frame is not part
+        of it. append computes it again.
+
+        :rtype: string
+        """
+        if self._fingerprint is None:
+            self._fingerprint, self._exact_fingerprint = \
+                _column_digests(self.columns())
+        return self._fingerprint
+
+    def _sorted_columns(self):
+        """columns with the nodes ordered by their locationID."""
+        columns = self.columns()
+        order = np.argsort(columns["locationID"], kind="mergesort")
+        for name in GRAPH_NODE_COLUMNS:
+            columns[name] = columns[name][order]
+        return columns
+
+    def memory_usage(self):
+        """Deep size in bytes of the data of the graph, including the
+        reduced copies of the active time frame and the cached transition
+        matrices. A reduced frame, which is the complete frame itself, is
+        not counted twice. The sizes are kept until the graph is built
+        or appended to again.
+
+        :returns: Bytes per part and the total
+        :rtype: collections.OrderedDict
+        """
+        if self._memory_usage is not None:
+            return OrderedDict(self._memory_usage)
+        usage = OrderedDict()
+        usage["nodes"] = _frame_bytes(self._nodes)
+        usage["edges"] = _frame_bytes(self._edges)
+        usage["stays"] = _frame_bytes(self._stays)
+        usage["reduced_nodes"] = _frame_bytes(self._reduced_nodes, self._nodes)
+        usage["reduced_edges"] = _frame_bytes(self._reduced_edges, self._edges)
+        usage["reduced_stays"] = _frame_bytes(self._reduced_stays, self._stays)
+        usage["days"] = (self._from_days.nbytes + self._to_days.nbytes +
+                         (self._reduced_days.nbytes
+                          if self._reduced_days is not self._to_days else 0))
+        usage["transitions"] = sum(m.data.nbytes + m.indices.nbytes +
+                                   m.indptr.nbytes
+                                   for m in list(self._transitions.values()))
+        usage["total"] = sum(usage.values())
+        self._memory_usage = usage
+        return OrderedDict(usage)
+
     @property
     def min_date(self):
         """Total minimum date."""
@@ -425,32 +1308,64 @@ class EventGraph:
 
     def _reduce_graph(self):
         """
-        Limit the active set of nodes and edges to the current time frame,
-        given by self._start_date and self._end_date
+        Limit the active set of nodes, edges and stays to the current
+        time frame, given by self._start_date and self._end_date
 
-        Internally sets self._reduced_edges and self._reduced_nodes
+        Internally sets self._reduced_edges, self._reduced_nodes
+        and self._reduced_stays
         """
-        if self._start_date and self._end_date:
-            self._reduced_edges = self._edges[
-                (self._edges.from_date >= self._start_date) &
-                (self._edges.to_date <= self._end_date)]
+        if self._edges.empty:
+            # The open time frame of an empty graph is NaN, the active set
+            # is empty as well
+            self._reduced_days = self._to_days
+            self._reduced_edges = self._edges.copy()
+            self._reduced_stays = self._stays
+        elif self._start_date and self._end_date and not (
+                self._start_date.toordinal() <= self._from_days[0] and
+                self._end_date.toordinal() >= self._to_days.max()):
+            start = self._start_date.toordinal()
+            end = self._end_date.toordinal()
+            in_frame = (self._from_days >= start) & (self._to_days <= end)
+            self._reduced_days = self._to_days[in_frame]
+            self._reduced_edges = self._edges[in_frame].copy()
+            self._reduced_stays = self._clip_stays(start, end)
         else:
-            self._reduced_edges = self._edges
-
-        self._reduced_edges = self._reduced_edges.sort_values("from_date")
-
-        legit_nodes = self._reduced_edges[["from_node", "to_node"]].values
-        legit_nodes = np.unique(legit_nodes).astype(int)
-        self._reduced_nodes = self._nodes.ix[legit_nodes]
+            # The time frame covers all edges
+            self._reduced_days = self._to_days
+            # A copy, the colors must not end up in the complete edges
+            self._reduced_edges = self._edges.copy()
+            self._reduced_stays = self._stays
+
+        legit_nodes = np.unique(np.concatenate([
+            self._reduced_edges.from_node.values,
+            self._reduced_edges.to_node.values])).astype(int)
+        index = self._nodes.index
+        if (len(index) == len(legit_nodes) and index.is_monotonic_increasing
+                and (index.values == legit_nodes).all()):
+            self._reduced_nodes = self._nodes.copy()
+        else:
+            self._reduced_nodes = self._nodes.reindex(legit_nodes)
+
+    def _clip_stays(self, start, end):
+        """Stays, which overlap the days start to end, clipped to them."""
+        stays = self._stays
+        overlap = ((stays.arrival.values <= end) &
+                   (stays.departure.values >= start))
+        arrival = np.maximum(stays.arrival.values[overlap], start)
+        departure = np.minimum(stays.departure.values[overlap], end)
+        return pd.DataFrame({"locationID": stays.locationID.values[overlap],
+                             "arrival": arrival, "departure": departure,
+                             "duration": departure - arrival},
+                            index=stays.index[overlap], columns=STAYS_COLUMNS)
 
     def _edge_color(self):
-        self._reduced_edges["color"] = self._reduced_edges.to_date.apply(
-            lambda x: self._get_hex_color(x))
+        rgb = self._cmap(self._scaled_days(self._reduced_days))
+        self._reduced_edges["color"] = [clr.rgb2hex(c) for c in rgb]
 
     def _node_color(self):
-        last_visit = self._reduced_edges.groupby("to_node")["to_date"].max()
-        color = last_visit.apply(lambda x: self._get_scaled_time_point(x))
-        color.name = "color"
+        stats = self.stay_statistics()
+        color = pd.Series(self._scaled_days(stats.last_visit.values),
+                          index=stats.index, name="color")
 
         self._reduced_nodes = self._reduced_nodes.merge(
             color.to_frame(), left_index=True, right_index=True,
@@ -461,48 +1376,46 @@ class EventGraph:
 
     # TODO: Population is not that good
     def _node_population(self):
-        last_stop = self._reduced_edges["to_date"].max()
-        idx = self._reduced_edges.to_date == last_stop
-        last_node = self._reduced_edges[idx].to_node.iloc[0]
         self._reduced_nodes["population"] = 0
+        if self._reduced_stays.empty:
+            return
+        last_stop = self._reduced_stays.departure.values.argmax()
+        last_node = self._reduced_stays.locationID.values[last_stop]
         self._reduced_nodes.loc[last_node, "population"] = 1
 
-    def _get_scaled_time_point(self, date):
-        scale = date
-        scale -= self._start_date
-        try:
-            scale = 1.*scale.days/(self._end_date-self._start_date).days
-        except:
-            scale = 0
-        return scale
-
-    def _get_hex_color(self, date):
-        """ Compute the color on the set color map for a date in
-        the set timeframe.
-        Granularity is days.
-
-        :param date: Zeitstempel
-        :type start_date: datetime.date
-        """
-        scale = date
-        scale -= self._start_date
-        try:
-            scale = 1.*scale.days/(self._end_date-self._start_date).days
-        except:
-            scale = 0
-        rgb = self._cmap(scale)
-
-        return clr.rgb2hex(rgb)
+    def _scaled_days(self, days):
+        """ Scale day ordinals to [0, 1] for the set timeframe."""
+        span = self._end_date.toordinal() - self._start_date.toordinal()
+        if span <= 0:
+            return np.zeros(len(days))
+        return 1.*(days - self._start_date.toordinal())/span
 
     def __eq__(self, other):
+        """Graphs are equal, if they are built for the same time frame and
+        colors and have the same complete nodes and edges, so their active
+        sets are the same as well. The APPROXIMATE_COLUMNS are compared
+        with numpy.allclose. Graphs, whose fingerprints without the
+        APPROXIMATE_COLUMNS differ, are not equal without a comparison."""
         if not isinstance(other, self.__class__):
             return NotImplemented
-        try:
-            pd.util.testing.assert_frame_equal(self.nodes, other.nodes)
-            pd.util.testing.assert_frame_equal(self.edges, other.edges)
+        if self is other:
             return True
-        except:
+        if ((self._start_date, self._end_date, self._colors) !=
+                (other._start_date, other._end_date, other._colors)):
+            return False
+        if (self.fingerprint != other.fingerprint and
+                self._exact_fingerprint != other._exact_fingerprint):
             return False
+        columns = self._sorted_columns()
+        other_columns = other._sorted_columns()
+        for name, values in columns.items():
+            if name in APPROXIMATE_COLUMNS:
+                if not np.allclose(values, other_columns[name],
+                                   equal_nan=True):
+                    return False
+            elif not np.array_equal(values, other_columns[name]):
+                return False
+        return True
 
     def __ne__(self, other):
         if isinstance(other, self.__class__):
@@ -510,6 +1423,116 @@ class EventGraph:
         return NotImplemented
 
 
+def _queries(client):
+    """The module with the query functions for the client."""
+    if isinstance(client, storage.Store):
+        return storage
+    return db_queries
+
+
+def _frame_bytes(frame, parent=None):
+    """Deep size of a data frame, 0 if it is the parent frame itself."""
+    if frame is parent:
+        return 0
+    return int(frame.memory_usage(index=True, deep=True).sum())
+
+
+def _stays_table(from_nodes, to_nodes, from_days, to_days):
+    """Reconstruct the stays of one actor from its edges, which have to be
+    sorted by date. Consecutive events at the same location are merged
+    into a single stay.
+
+    :returns: Data frame with the STAYS_COLUMNS
+    :rtype: pandas.DataFrame
+    """
+    num_events = 2 * len(from_nodes)
+    locations = np.empty(num_events, dtype=np.int64)
+    locations[0::2] = from_nodes
+    locations[1::2] = to_nodes
+    days = np.empty(num_events, dtype=np.int64)
+    days[0::2] = from_days
+    days[1::2] = to_days
+
+    new_stay = np.ones(num_events, dtype=bool)
+    new_stay[1:] = locations[1:] != locations[:-1]
+    first = np.flatnonzero(new_stay)
+    last = np.empty_like(first)
+    last[:-1] = first[1:] - 1
+    last[-1:] = num_events - 1
+
+    # One int block, which is much faster to create than four columns
+    table = np.empty((len(first), len(STAYS_COLUMNS)), dtype=np.int64)
+    table[:, 0] = locations[first]
+    table[:, 1] = days[first]
+    table[:, 2] = days[last]
+    table[:, 3] = days[last] - days[first]
+    return pd.DataFrame(table, columns=STAYS_COLUMNS)
+
+
+def _strings(values):
+    """Strings of an object column and the mask of the missing ones.
+
+    :rtype: numpy.ndarray (str), numpy.ndarray (bool)
+    """
+    missing = pd.isnull(values)
+    if missing.any():
+        values = np.where(missing, "", values)
+    return values.astype(str), missing
+
+
+def _column_digests(columns):
+    """Fingerprint of the columns of a graph (see EventGraph.columns) and
+    the one without the APPROXIMATE_COLUMNS. Strings are hashed as text,
+    so the width of their arrays does not matter.
+
+    :returns: Both hex digests
+    :rtype: string, string
+    """
+    location_ids = np.asarray(columns["locationID"])
+    order = None
+    if (location_ids[1:] < location_ids[:-1]).any():
+        order = np.argsort(location_ids, kind="mergesort")
+    digest = hashlib.blake2b(digest_size=FINGERPRINT_SIZE)
+    exact = hashlib.blake2b(digest_size=FINGERPRINT_SIZE)
+    for name in GRAPH_NODE_COLUMNS + GRAPH_EDGE_COLUMNS:
+        values = np.asarray(columns[name])
+        if order is not None and name in GRAPH_NODE_COLUMNS:
+            values = values[order]
+        if values.dtype.kind in "OU":
+            data = "\0".join(values.tolist()).encode("utf-8")
+            dtype = "str"
+        else:
+            data = np.ascontiguousarray(values).tobytes()
+            dtype = values.dtype.str
+        for part in [digest] if name in APPROXIMATE_COLUMNS else \
+                [digest, exact]:
+            part.update("{}:{}:{};".format(name, dtype, len(values)).encode())
+            part.update(data)
+    return digest.hexdigest(), exact.hexdigest()
+
+
+def _concat(first, second):
+    """Concatenate two data frames, keeping the column order of the first."""
+    if list(first.columns) == list(second.columns):
+        return pd.concat([first, second])
+    columns = list(first.columns) + [c for c in second.columns
+                                     if c not in first.columns]
+    return pd.concat([first, second])[columns]
+
+
+def _append_stays(stays, new_stays):
+    """Concatenate two stay tables of consecutive edges. The first new stay
+    is merged into the last stay, if both are at the same location."""
+    if stays.empty or new_stays.empty:
+        return pd.concat([stays, new_stays], ignore_index=True)
+    if new_stays.locationID.values[0] == stays.locationID.values[-1]:
+        new_stays = new_stays.copy()
+        new_stays.loc[new_stays.index[0], "arrival"] = stays.arrival.values[-1]
+        new_stays["duration"] = new_stays.departure - new_stays.arrival
+        stays = stays.iloc[:-1]
+    return pd.concat([stays, new_stays], ignore_index=True)
+
+
 def empty_graph_data():
     """Build an empty event graph, based on the NODES and EDGES SCHEMA."""
 
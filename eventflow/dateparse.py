@@ -0,0 +1,254 @@
+"""Column wise parsing of (partial) ISO 8601 dates.
+
+The event triples know three granularities: yyyy, yyyy-mm and yyyy-mm-dd.
+Every function in here works on a whole column at once. Missing months and
+days are reported as 0 and treated as the first month/day for the ordinals.
+Ordinals are proleptic Gregorian ordinals like datetime.date.toordinal.
+Dates outside of the range of datetime.date, e.g. with negative years,
+become HistoricDate objects, which compare with datetime.date.
+"""
+import datetime
+
+import numpy as np
+import pandas as pd
+
+# Ordinal of 1970-01-01, the epoch of numpy.datetime64
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+_ISO_PATTERN = r"^(-?\d+)(?:-(\d{1,2}))?(?:-(\d{1,2}))?$"
+_FULL_LENGTH = 10
+_ZERO = ord("0")
+_DASH = ord("-")
+
+# Ordinals of the dates, which datetime.date can represent
+_MIN_ORDINAL = datetime.date.min.toordinal()
+_MAX_ORDINAL = datetime.date.max.toordinal()
+
+
+class HistoricDate:
+    """A date, which datetime.date can not represent, like 0300 BC.
+    It has the year, month, day, toordinal and isoformat of a
+    datetime.date and is ordered together with them by the ordinal.
+    Years are astronomical, i.e. 1 BC is the year 0.
+    """
+    __slots__ = ("year", "month", "day", "_ordinal")
+
+    def __init__(self, year, month, day):
+        self.year = year
+        self.month = month
+        self.day = day
+        self._ordinal = int(to_ordinals([year], [month], [day])[0])
+
+    @classmethod
+    def fromordinal(cls, ordinal):
+        years, months, days = to_civil([ordinal])
+        return cls(int(years[0]), int(months[0]), int(days[0]))
+
+    def toordinal(self):
+        return self._ordinal
+
+    def isoformat(self):
+        return "{}{:04d}-{:02d}-{:02d}".format(
+            "-" if self.year < 0 else "", abs(self.year), self.month, self.day)
+
+    def __repr__(self):
+        return "{}({}, {}, {})".format(self.__class__.__name__, self.year,
+                                       self.month, self.day)
+
+    __str__ = isoformat
+
+    def __hash__(self):
+        return hash(self._ordinal)
+
+    def __eq__(self, other):
+        if not hasattr(other, "toordinal"):
+            return NotImplemented
+        return self._ordinal == other.toordinal()
+
+    def __ne__(self, other):
+        if not hasattr(other, "toordinal"):
+            return NotImplemented
+        return self._ordinal != other.toordinal()
+
+    def __lt__(self, other):
+        if not hasattr(other, "toordinal"):
+            return NotImplemented
+        return self._ordinal < other.toordinal()
+
+    def __le__(self, other):
+        if not hasattr(other, "toordinal"):
+            return NotImplemented
+        return self._ordinal <= other.toordinal()
+
+    def __gt__(self, other):
+        if not hasattr(other, "toordinal"):
+            return NotImplemented
+        return self._ordinal > other.toordinal()
+
+    def __ge__(self, other):
+        if not hasattr(other, "toordinal"):
+            return NotImplemented
+        return self._ordinal >= other.toordinal()
+
+
+def parse(values):
+    """Parse a column of (partial) ISO dates.
+
+    :param values: Dates as yyyy, yyyy-mm or yyyy-mm-dd strings
+    :type values: pandas.Series, numpy.ndarray or list
+
+    :returns: years, months, days, ordinals
+    :rtype: tuple of numpy.ndarray (int64)
+    """
+    strings = np.asarray(values, dtype=object)
+    if not len(strings):
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, empty, empty
+
+    parsed = _parse_full(strings)
+    if parsed is None:
+        parsed = _parse_partial(strings)
+    years, months, days = parsed
+
+    return years, months, days, to_ordinals(years, months, days)
+
+
+def ordinals(values):
+    """Ordinals of a column of dates.
+
+    :param values: datetime.date or HistoricDate objects or (partial)
+        ISO date strings
+    :type values: pandas.Series, numpy.ndarray or list
+
+    :rtype: numpy.ndarray (int64)
+    """
+    values = np.asarray(values, dtype=object)
+    if len(values) and isinstance(values[0], (datetime.date, HistoricDate)):
+        try:
+            days = values.astype("datetime64[D]").astype(np.int64)
+        except (TypeError, ValueError):
+            # HistoricDate objects
+            return np.array([value.toordinal() for value in values],
+                            dtype=np.int64)
+        return days + EPOCH_ORDINAL
+    return parse(values)[3]
+
+
+def to_ordinals(years, months, days):
+    """Vectorized datetime.date(year, month, day).toordinal().
+    Months and days equal to 0 are treated as 1. Works for all years,
+    including negative ones.
+    """
+    years = np.asarray(years, dtype=np.int64)
+    months = np.maximum(np.asarray(months, dtype=np.int64), 1)
+    days = np.maximum(np.asarray(days, dtype=np.int64), 1)
+
+    # Days from civil, with years starting in March
+    years = years - (months <= 2)
+    era = np.floor_divide(years, 400)
+    year_of_era = years - era * 400
+    day_of_year = (153 * ((months + 9) % 12) + 2) // 5 + days - 1
+    day_of_era = (year_of_era * 365 + year_of_era // 4 - year_of_era // 100 +
+                  day_of_year)
+    return era * 146097 + day_of_era - 719468 + EPOCH_ORDINAL
+
+
+def to_civil(ordinals):
+    """Vectorized inverse of to_ordinals for all years.
+
+    :returns: years, months, days
+    :rtype: tuple of numpy.ndarray (int64)
+    """
+    days = np.asarray(ordinals, dtype=np.int64) - EPOCH_ORDINAL + 719468
+    era = np.floor_divide(days, 146097)
+    day_of_era = days - era * 146097
+    year_of_era = (day_of_era - day_of_era // 1460 + day_of_era // 36524 -
+                   day_of_era // 146096) // 365
+    day_of_year = day_of_era - (365 * year_of_era + year_of_era // 4 -
+                                year_of_era // 100)
+    month_of_year = (5 * day_of_year + 2) // 153
+    days = day_of_year - (153 * month_of_year + 2) // 5 + 1
+    months = np.where(month_of_year < 10, month_of_year + 3,
+                      month_of_year - 9)
+    years = year_of_era + era * 400 + (months <= 2)
+    return years, months, days
+
+
+def from_ordinals(ordinals):
+    """Convert ordinals back to datetime.date objects. Dates out of their
+    range become HistoricDate objects.
+
+    :rtype: numpy.ndarray (object)
+    """
+    ordinals = np.asarray(ordinals, dtype=np.int64)
+    historic = (ordinals < _MIN_ORDINAL) | (ordinals > _MAX_ORDINAL)
+    if not historic.any():
+        return (ordinals - EPOCH_ORDINAL).astype("datetime64[D]").astype(object)
+
+    dates = np.empty(len(ordinals), dtype=object)
+    dates[~historic] = (ordinals[~historic] - EPOCH_ORDINAL).astype(
+        "datetime64[D]").astype(object)
+    years, months, days = to_civil(ordinals[historic])
+    dates[historic] = [HistoricDate(*date) for date in
+                       zip(years.tolist(), months.tolist(), days.tolist())]
+    return dates
+
+
+def parse_date(value):
+    """Parse a single (partial) ISO date.
+
+    :param value: The date, which is returned as is, if it is already
+        a datetime.date
+    :type value: str or datetime.date
+
+    :rtype: datetime.date or HistoricDate
+    """
+    if isinstance(value, (datetime.date, HistoricDate)):
+        return value
+    years, months, days, _ = parse([value])
+    year, month, day = (int(years[0]), max(int(months[0]), 1),
+                        max(int(days[0]), 1))
+    if datetime.MINYEAR <= year <= datetime.MAXYEAR:
+        return datetime.date(year, month, day)
+    return HistoricDate(year, month, day)
+
+
+def _parse_full(strings):
+    """Fast path for columns, which only contain yyyy-mm-dd dates.
+    The digits are read directly from a byte view of the strings.
+
+    :returns: None if the column contains anything else
+    """
+    try:
+        raw = strings.astype("S")
+    except (UnicodeEncodeError, ValueError, TypeError):
+        return None
+    if (raw.dtype.itemsize != _FULL_LENGTH or
+            np.char.str_len(raw).min() != _FULL_LENGTH):
+        return None
+
+    chars = raw.view(np.uint8).reshape(-1, _FULL_LENGTH)
+    if not ((chars[:, 4] == _DASH).all() and (chars[:, 7] == _DASH).all()):
+        return None
+    digits = chars[:, [0, 1, 2, 3, 5, 6, 8, 9]].astype(np.int64) - _ZERO
+    if digits.min() < 0 or digits.max() > 9:
+        return None
+
+    years = digits[:, :4].dot([1000, 100, 10, 1])
+    months = digits[:, 4:6].dot([10, 1])
+    days = digits[:, 6:].dot([10, 1])
+    return years, months, days
+
+
+def _parse_partial(strings):
+    parts = pd.Series(strings).astype(str).str.strip().str.extract(
+        _ISO_PATTERN, expand=True)
+    invalid = parts[0].isnull()
+    if invalid.any():
+        raise ValueError("Invalid ISO date: {}".format(
+            strings[invalid.values][0]))
+
+    years = parts[0].astype(np.int64).values
+    months = parts[1].fillna(0).astype(np.int64).values
+    days = parts[2].fillna(0).astype(np.int64).values
+    return years, months, days
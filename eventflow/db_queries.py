@@ -1,6 +1,7 @@
 """This module enables a high-level access to all database queries, 
 which are needed in the core module. 
 """
+import itertools
 import os
 import sys
 
@@ -9,6 +10,17 @@ import numpy as np
 import pymongo
 
 from . import util
+
+# Number of documents, which are read from a cursor at once
+BATCH_SIZE = 10000
+
+NODES_COLUMNS = [("locationID", np.int64), ("label", object), ("WDid", object),
+                 ("lat", np.float64), ("lon", np.float64)]
+EDGES_COLUMNS = [("actorID", np.int64), ("from_node", np.int64),
+                 ("from_date", object), ("to_node", np.int64),
+                 ("to_date", object), ("from_lat", np.float64),
+                 ("from_lon", np.float64), ("to_lat", np.float64),
+                 ("to_lon", np.float64)]
     
 def get_graph(client, actorID):
     """Query the eventflow collection which is specified in conig.ini.
@@ -17,47 +29,118 @@ def get_graph(client, actorID):
     :param actorID: actorID which can be used to identify the edges of one actor
     :type actorID: list, string or file
 
-    :result: nodes, edges with all properties found in the database
+    :result: nodes, edges with the NODES_COLUMNS and EDGES_COLUMNS. Only
+        these fields are transferred, the coordinates of the edges are
+        joined on the server and edges without known nodes are dropped.
     :type result: pd.DataFrame, pd.DataFrame
     """
 
-    eventflow_nodes = client[util.EVENTFLOW_COLLECTION][util.EVENTFLOW_NODES]
     eventflow_edges = client[util.EVENTFLOW_COLLECTION][util.EVENTFLOW_EDGES]
     
-    if isinstance(actorID,list):
-        ids = actorID
-    elif os.path.isfile(actorID):
-        f = open(actorID, 'r')
-        ids = [x.split(",")[0].strip() for x in f.readlines()]
-    else:
-        ids = [actorID]
+    ids = actor_ids(actorID)
+
+    edges = _read_columns(eventflow_edges.aggregate(
+        _edges_pipeline(ids), batchSize=BATCH_SIZE), EDGES_COLUMNS)
+    if edges.empty:
+        return pd.DataFrame(), edges
 
+    locationIDs = np.unique(edges[["from_node","to_node"]].values).tolist()
+    nodes = get_nodes(client, locationIDs)
+
+    if nodes.empty:
+        return nodes,pd.DataFrame()
+
+    return nodes, edges
+
+
+def get_nodes(client, locationIDs):
+    """Query the nodes with the given locationIDs.
+
+    :param client: mongodb client.
+    :type client: pymongo.MongoClient
+    :param locationIDs: Ids of the nodes
+    :type locationIDs: list
+
+    :result: nodes with the NODES_COLUMNS
+    :type result: pd.DataFrame
+    """
+    eventflow_nodes = client[util.EVENTFLOW_COLLECTION][util.EVENTFLOW_NODES]
     pipeline = [
-        {"$match": {"actorID": {"$in": ids}}}
+        {"$match": {"locationID": {"$in": [int(i) for i in locationIDs]}}},
+        {"$project": dict(_id=0, **{name: 1 for name, _ in NODES_COLUMNS})}
     ]
+    return _read_columns(eventflow_nodes.aggregate(
+        pipeline, batchSize=BATCH_SIZE), NODES_COLUMNS)
+
+
+def actor_ids(actorID):
+    """The list of actorIDs of the actorID argument of get_graph."""
+    if isinstance(actorID,list):
+        return actorID
+    elif isinstance(actorID, str) and os.path.isfile(actorID):
+        f = open(actorID, 'r')
+        return [x.split(",")[0].strip() for x in f.readlines()]
+    else:
+        return [actorID]
 
-    result = eventflow_edges.aggregate(pipeline)
-    result = list(result)
-    edges = pd.DataFrame(result)
-    if edges.empty:
-        return pd.DataFrame(), edges
 
-    locationIDs = np.unique(edges[["from_node","to_node"]].values.flatten()).tolist()
+def _edges_pipeline(ids):
+    """Edges of the actors with the coordinates of both nodes.
+    The coordinates are joined on the server, edges without
+    a known node are dropped by the $unwind."""
+    projection = {name: 1 for name, _ in EDGES_COLUMNS[:5]}
     pipeline = [
-        {"$match": {"locationID": {"$in": locationIDs}}}
+        {"$match": {"actorID": {"$in": ids}}},
+        {"$project": dict(_id=0, **projection)}
     ]
-    nodes = pd.DataFrame(list(eventflow_nodes.aggregate(pipeline)))
-    
-    if nodes.empty:
-        return nodes,pd.DataFrame()        
-    
-    edges = edges.merge(nodes[["locationID","lat","lon"]].add_prefix("from_"),left_on="from_node",right_on="from_locationID",how="left")
-    edges = edges.merge(nodes[["locationID","lat","lon"]].add_prefix("to_"),left_on="to_node",right_on="to_locationID",how="left")
-    edges = edges.drop(["to_locationID","from_locationID"],1)
-    edges = edges.dropna()
+    for prefix in ["from", "to"]:
+        pipeline += [
+            {"$lookup": {"from": util.EVENTFLOW_NODES,
+                         "localField": prefix + "_node",
+                         "foreignField": "locationID",
+                         "as": prefix}},
+            {"$unwind": "$" + prefix}
+        ]
+        projection[prefix + "_lat"] = "$" + prefix + ".lat"
+        projection[prefix + "_lon"] = "$" + prefix + ".lon"
+    pipeline.append({"$project": projection})
+    return pipeline
+
+
+def _read_columns(cursor, columns, batch_size=BATCH_SIZE):
+    """Read the documents of a cursor batch by batch into typed columns.
+
+    :param cursor: Cursor of documents. Missing fields become NaN, integer
+        columns with missing fields become float columns.
+    :type cursor: pymongo.command_cursor.CommandCursor
+    :param columns: (name, dtype) of each column
+    :type columns: list
+
+    :rtype: pandas.DataFrame
+    """
+    chunks = [[] for _ in columns]
+    while True:
+        batch = list(itertools.islice(cursor, batch_size))
+        if not batch:
+            break
+        for chunk, (name, dtype) in zip(chunks, columns):
+            values = [doc.get(name, np.nan) for doc in batch]
+            if dtype is object:
+                chunk.append(np.array(values, dtype=object))
+            else:
+                try:
+                    chunk.append(np.fromiter(values, dtype=dtype,
+                                             count=len(batch)))
+                except ValueError:
+                    # NaN in an integer column
+                    chunk.append(np.array(values, dtype=np.float64))
+
+    if not chunks[0]:
+        return pd.DataFrame()
+    data = {name: np.concatenate(chunk)
+            for chunk, (name, _) in zip(chunks, columns)}
+    return pd.DataFrame(data, columns=[name for name, _ in columns])
 
-    return nodes, edges
-    
 
 def actor_by_id(client, actor_id):
     event_nodes = client[util.EVENT_TRIPLES]["nodes"]
@@ -4,13 +4,16 @@ import math
 import matplotlib.pyplot as plt
 import matplotlib.colors as clr
 import matplotlib.patches as mpatches
+from matplotlib.collections import LineCollection
 from matplotlib.offsetbox import TextArea, AnnotationBbox
+import numpy as np
 import pandas as pd
 from geopandas import GeoDataFrame
 from shapely.geometry import Point
 from shapely.ops import nearest_points
 
-from eventflow.util import do_profile
+from eventflow import dateparse
+from eventflow import instrument
 
 class GraphLayer:
     """Manages all active graphs and the created matplotlib artists.
@@ -24,6 +27,9 @@ class GraphLayer:
         """
         self._edges = dict()
         self._actors = dict()
+        self._flows = None
+        # (graph, callback) of the graphs followed for appended edges
+        self._followed = []
         self._axes = axes
         self._last_node = None
         self._cmap = plt.get_cmap('viridis')
@@ -32,41 +38,78 @@ class GraphLayer:
         self._spatial_index = GeoDataFrame(node_structure, crs = self.crs, geometry = [])
         self.multi_point = self._spatial_index.geometry.unary_union
 
+    @instrument.traced("GraphLayer.update")
     def update(self, graph, actorID = None):
         """ Update the graph layer, by adding an additional graph.
 
-        :param graph: Event graph
-        :type graph: eventflow.EventGraph
+        :param graph: Event graph or its precomputed render data
+        :type graph: eventflow.EventGraph or dict (see render_data)
         :param actorID: associated actor
         :type actorID: int
         """
-        if graph.empty:
+        if not isinstance(graph, dict):
+            graph = render_data(graph)
+        if graph is None:
             return
 
         if actorID is not None:
-            self._actors[actorID] = []
-
-        
-        for key, edge in graph.edges.iterrows():
-            try:
-                ec = clr.hex2color(edge.color)
-            except:
-                ec = "b"
-            from_node = graph.nodes.ix[edge.from_node]
-            to_node = graph.nodes.ix[edge.to_node]
-            edge_patch = Edge(from_node = from_node, to_node = to_node, facecolor=ec, edgecolor=ec, zorder = 1)
+            self._actors.setdefault(actorID, [])
+
+        node_ids = graph["node_ids"]
+        lat = graph["lat"]
+        lon = graph["lon"]
+        from_idx = np.searchsorted(node_ids, graph["from_nodes"])
+        to_idx = np.searchsorted(node_ids, graph["to_nodes"])
+        for i, edge_id in enumerate(graph["edge_ids"]):
+            f = from_idx[i]
+            t = to_idx[i]
+            ec = graph["edge_colors"][i]
+            edge_patch = Edge(from_node = (node_ids[f], lat[f], lon[f]),
+                              to_node = (node_ids[t], lat[t], lon[t]),
+                              facecolor=ec, edgecolor=ec, zorder = 1)
             eid = self._axes.add_artist(edge_patch)
-            self._edges[edge._id] = eid
+            self._edges[edge_id] = eid
             if actorID:
-                self._actors[actorID].append(edge._id)
+                self._actors[actorID].append(edge_id)
 
-            self._add_node(from_node, actorID)
-            self._add_node(to_node, actorID)
-        
-        # A little bit hacky, because I rely on the fact the the edges are ordered and the reference to the last edge still exists
-        self._spatial_index.loc[edge.to_node, "radius"] += 1
+        self._add_nodes(graph, np.concatenate([from_idx, to_idx]))
+
+        # The edges are ordered, so the last edge ends at the final stop
+        self._spatial_index.loc[node_ids[to_idx[-1]], "radius"] += 1
         self.multi_point = self._spatial_index.geometry.unary_union
 
+    def follow(self, graph, actorID):
+        """Draw the edges, which are appended to the graph later on
+        (see EventGraph.append). Only the new edges are added to the axes,
+        unless the graph had to be reduced completely again.
+
+        :param graph: Event graph, which is already drawn
+        :type graph: eventflow.EventGraph
+        :param actorID: associated actor
+        :type actorID: int
+        """
+        def appended(graph, edges, refreshed):
+            if actorID not in self._actors:
+                # The actor is hidden
+                return
+            if refreshed:
+                self.hide_by_actor(actorID)
+                data = render_data(graph)
+            else:
+                data = render_data(graph, edges)
+            if data is not None:
+                self.update(data, actorID)
+            self.plot()
+
+        graph.subscribe(appended)
+        self._followed.append((graph, appended))
+
+    def unfollow(self):
+        """Stop following all graphs, see follow."""
+        for graph, callback in self._followed:
+            graph.unsubscribe(callback)
+        self._followed = []
+
     def hide_by_actor(self, actorID):
         """ Remove the actor and the associated graph from the axes.
 
@@ -84,6 +127,45 @@ class GraphLayer:
         self._spatial_index = self._spatial_index[self._spatial_index.degree > 0]
         self.plot()
 
+    @instrument.traced("GraphLayer.show_flows")
+    def show_flows(self, flows, max_width = 6., min_weight = 1):
+        """Draw weighted flows between locations as a single line collection,
+        which replaces previously shown flows. Line width and color scale
+        with the weight, heavier flows are drawn on top.
+
+        :param flows: Flows as returned by GraphCollection.od_flows
+        :type flows: pandas.DataFrame
+        :param max_width: Line width of the heaviest flow
+        :type max_width: float
+        :param min_weight: Flows with a smaller weight are not drawn
+        :type min_weight: int
+        """
+        self.hide_flows()
+        coordinates = flows[["from_lat", "from_lon", "to_lat", "to_lon"]].values
+        weights = flows.weight.values
+        shown = (weights >= min_weight) & ~np.isnan(coordinates).any(axis = 1)
+        if not shown.any():
+            return
+        coordinates = coordinates[shown]
+        weights = weights[shown]
+        order = np.argsort(weights, kind = "mergesort")
+        scaled = 1. * weights[order] / weights.max()
+
+        self._flows = LineCollection(coordinates[order].reshape(-1, 2, 2),
+                                     linewidths = 0.5 + (max_width - 0.5) * scaled,
+                                     colors = self._cmap(scaled),
+                                     zorder = 1)
+        self._axes.add_collection(self._flows)
+        self._axes.figure.canvas.draw_idle()
+
+    def hide_flows(self):
+        """Remove the flows drawn by show_flows."""
+        if self._flows is not None:
+            self._flows.remove()
+            self._flows = None
+            self._axes.figure.canvas.draw_idle()
+
+    @instrument.traced("GraphLayer.plot")
     def plot(self):
         """Plot the axes."""
         try:
@@ -155,18 +237,37 @@ class GraphLayer:
         return None
 
 
-    def _add_node(self, node, actorID):
-        if node.name in self._spatial_index.index:
+    def _add_nodes(self, graph, node_idx):
+        """Insert the nodes referenced by node_idx (positions in the render
+        data) into the spatial index, or raise the degree of known nodes."""
+        degree = np.bincount(node_idx, minlength = len(graph["node_ids"]))
+        used = degree > 0
+        node_ids = graph["node_ids"][used]
+        degree = degree[used]
+        color = graph["node_colors"][used]
+
+        known = np.in1d(node_ids, self._spatial_index.index.values)
+        if known.any():
             #TODO: Currently the color is not overridden
             # I have to check what color represents the last visit
-            self._spatial_index.loc[node.name, "degree"] += 1
-            if self._spatial_index.loc[node.name, "color"] < node.color:
-                self._spatial_index.loc[node.name, "color"] = node.color
-                
-        else:
-            row = GeoDataFrame([[node.label, node.WDid, 1, 1, node.color]], index = [node.name], columns = ["label", "WDid", "radius", "degree", "color"],
-                geometry = [Point(node.lat, node.lon)], crs = self.crs)
-            self._spatial_index = self._spatial_index.append(row)
+            ids = node_ids[known]
+            self._spatial_index.loc[ids, "degree"] += degree[known]
+            self._spatial_index.loc[ids, "color"] = np.maximum(
+                self._spatial_index.loc[ids, "color"].values, color[known])
+
+        new = ~known
+        if new.any():
+            rows = GeoDataFrame({"label": graph["labels"][used][new],
+                                 "WDid": graph["WDids"][used][new],
+                                 "radius": 1,
+                                 "degree": degree[new],
+                                 "color": color[new]},
+                index = node_ids[new],
+                columns = ["label", "WDid", "radius", "degree", "color"],
+                geometry = [Point(x, y) for x, y in zip(graph["lat"][used][new],
+                                                        graph["lon"][used][new])],
+                crs = self.crs)
+            self._spatial_index = self._spatial_index.append(rows)
 
     def _setup_annotation(self, nodeID):
         node = self._spatial_index.ix[nodeID]
@@ -199,6 +300,216 @@ class GraphLayer:
         result = s - ((s - 2)*math.exp(-k*x))
         return result
 
+class Playback:
+    """Animates a sliding time window over the complete travel history of
+    several actors. All edges are merged into one timeline, which is sorted by
+    the starting date. This way the visible edges of every frame are found with
+    a binary search and between two frames only the artists which enter or
+    leave the window are added to or removed from the axes.
+    """
+    def __init__(self, axes, graphs, window, step = 1):
+        """
+        :param axes: Matplotlib axes
+        :type axes: matplotlib.axes.Axes
+        :param graphs: Pairs of actorID and the associated event graph
+        :type graphs: iterable of (int, eventflow.EventGraph)
+        :param window: Width of the visible time window in days
+        :type window: int
+        :param step: Number of days between two frames
+        :type step: int
+        """
+        self._axes = axes
+        self._cmap = plt.get_cmap('viridis')
+        self._window = max(int(window), 1)
+        self._step = max(int(step), 1)
+        self._artists = dict()
+        self._shown = np.array([], dtype = int)
+
+        self._build_timeline(graphs)
+        self._nids = self._axes.scatter([], [], marker = "o", zorder = 2)
+
+    @property
+    def num_frames(self):
+        """Number of frames needed to cover the complete timeline."""
+        return len(self._starts)
+
+    def show_frame(self, frame):
+        """Display the edges, which lie completely inside the time window
+        of the given frame.
+
+        :param frame: Index of the frame, clipped to [0, num_frames-1]
+        :type frame: int
+
+        :returns: start and end date of the displayed time window
+        :rtype: (datetime.date, datetime.date)
+        """
+        frame = min(max(int(frame), 0), self.num_frames - 1)
+        start = self._starts[frame]
+        end = start + self._window
+
+        visible = self._visible(frame)
+        entering = np.setdiff1d(visible, self._shown, assume_unique = True)
+        leaving = np.setdiff1d(self._shown, visible, assume_unique = True)
+        for i in leaving:
+            self._artists[i].remove()
+        for i in entering:
+            if i not in self._artists:
+                self._artists[i] = self._create_edge(i)
+            self._axes.add_artist(self._artists[i])
+        self._shown = visible
+
+        self._plot_nodes(visible, start)
+        self._axes.figure.canvas.draw_idle()
+
+        return (datetime.date.fromordinal(int(start)),
+                datetime.date.fromordinal(int(end)))
+
+    def remove(self):
+        """Remove all artists of the playback from the axes."""
+        for i in self._shown:
+            self._artists[i].remove()
+        self._shown = np.array([], dtype = int)
+        self._nids.remove()
+        self._axes.figure.canvas.draw_idle()
+
+    def _build_timeline(self, graphs):
+        from_days, to_days, from_ids, to_ids, nodes = [], [], [], [], []
+        for actorID, graph in graphs:
+            edges = graph.all_edges
+            if edges.empty:
+                continue
+            from_days.append(dateparse.ordinals(edges.from_date.values))
+            to_days.append(dateparse.ordinals(edges.to_date.values))
+            from_ids.append(edges.from_node.values.astype(int))
+            to_ids.append(edges.to_node.values.astype(int))
+            nodes.append(graph.all_nodes[["lat", "lon"]])
+
+        if nodes:
+            nodes = pd.concat(nodes)
+            nodes = nodes[~nodes.index.duplicated()].sort_index()
+            from_days = np.concatenate(from_days)
+            to_days = np.concatenate(to_days)
+            from_ids = np.concatenate(from_ids)
+            to_ids = np.concatenate(to_ids)
+        else:
+            nodes = pd.DataFrame(columns = ["lat", "lon"], dtype = float)
+            from_days = to_days = from_ids = to_ids = np.array([], dtype = int)
+
+        self._node_ids = nodes.index.values.astype(int)
+        self._node_xy = nodes.values.astype(float)
+
+        # Edges whose nodes have no coordinates can not be drawn
+        known = (np.in1d(from_ids, self._node_ids) &
+                 np.in1d(to_ids, self._node_ids))
+        order = np.argsort(from_days[known], kind = "mergesort")
+        self._from_days = from_days[known][order]
+        self._to_days = to_days[known][order]
+        self._from_idx = np.searchsorted(self._node_ids, from_ids[known][order])
+        self._to_idx = np.searchsorted(self._node_ids, to_ids[known][order])
+
+        if len(self._from_days):
+            first_day = self._from_days[0]
+            last_day = self._to_days.max()
+        else:
+            first_day = last_day = datetime.date.today().toordinal()
+        span = max(last_day - first_day, 1)
+        self._colors = self._cmap(1. * (self._to_days - first_day) / span)
+
+        num_frames = int(math.ceil(
+            1. * max(last_day - first_day - self._window, 0) / self._step)) + 1
+        self._starts = first_day + self._step * np.arange(num_frames)
+        self._lower = np.searchsorted(self._from_days, self._starts,
+                                      side = "left")
+        self._upper = np.searchsorted(self._from_days,
+                                      self._starts + self._window,
+                                      side = "right")
+
+    def _visible(self, frame):
+        lower = self._lower[frame]
+        upper = self._upper[frame]
+        end = self._starts[frame] + self._window
+        return lower + np.flatnonzero(self._to_days[lower:upper] <= end)
+
+    def _create_edge(self, i):
+        from_idx = self._from_idx[i]
+        to_idx = self._to_idx[i]
+        from_node = (self._node_ids[from_idx],) + tuple(self._node_xy[from_idx])
+        to_node = (self._node_ids[to_idx],) + tuple(self._node_xy[to_idx])
+        ec = self._colors[i]
+        return Edge(from_node = from_node, to_node = to_node,
+                    facecolor = ec, edgecolor = ec, zorder = 1)
+
+    def _plot_nodes(self, visible, start):
+        num_nodes = len(self._node_ids)
+        from_idx = self._from_idx[visible]
+        to_idx = self._to_idx[visible]
+        degree = np.bincount(np.concatenate([from_idx, to_idx]),
+                             minlength = num_nodes)
+        last_visit = np.zeros(num_nodes, dtype = self._to_days.dtype) + start
+        np.maximum.at(last_visit, to_idx, self._to_days[visible])
+
+        active = degree > 0
+        s, k = 15, 0.1
+        self._nids.set_offsets(self._node_xy[active])
+        self._nids.set_sizes(s - ((s - 2)*np.exp(-k*degree[active])))
+        self._nids.set_facecolors(
+            self._cmap(1. * (last_visit[active] - start) / self._window))
+
+
+@instrument.traced("render_data")
+def render_data(graph, edges = None):
+    """Extract everything GraphLayer.update needs from the active set of an
+    event graph into plain arrays. Nothing in here touches matplotlib, so the
+    render data can be computed outside of the GUI thread.
+
+    :param graph: Event graph
+    :type graph: eventflow.EventGraph
+    :param edges: Only these edges of the active set, defaults to all
+    :type edges: pandas.DataFrame
+
+    :returns: None if the graph is empty. Otherwise a dict with the edge
+        columns edge_ids, from_nodes, to_nodes, edge_colors and the node
+        columns node_ids (sorted), labels, WDids, lat, lon, node_colors.
+    :rtype: dict
+    """
+    if graph.empty:
+        return None
+
+    if edges is None:
+        edges = graph.edges
+    if edges.empty:
+        return None
+    nodes = graph.nodes.sort_index()
+
+    if "color" in edges:
+        edge_colors = [clr.hex2color(c) for c in edges.color]
+    else:
+        edge_colors = ["b"] * len(edges)
+    if "color" in nodes:
+        node_colors = nodes.color.values.astype(float)
+    else:
+        node_colors = np.zeros(len(nodes))
+    if "_id" in edges:
+        edge_ids = edges._id.values
+    elif "actorID" in edges:
+        # The index is only unique within the edges of one actor
+        edge_ids = list(zip(edges.actorID.values.tolist(),
+                            edges.index.values.tolist()))
+    else:
+        edge_ids = edges.index.values
+
+    return {"edge_ids": edge_ids,
+            "from_nodes": edges.from_node.values.astype(int),
+            "to_nodes": edges.to_node.values.astype(int),
+            "edge_colors": edge_colors,
+            "node_ids": nodes.index.values.astype(int),
+            "labels": nodes.label.values,
+            "WDids": nodes.WDid.values,
+            "lat": nodes.lat.values.astype(float),
+            "lon": nodes.lon.values.astype(float),
+            "node_colors": node_colors}
+
+
 class Edge(mpatches.FancyArrowPatch):
     """Wrapper class for the matplotlib.patches.FancyArrowPatch.
     The edge will be styled to display a nice directed edge.
@@ -208,9 +519,9 @@ class Edge(mpatches.FancyArrowPatch):
     def __init__(self, **kwargs):
         """
         :param from_node: Starting node
-        :type from_node: pandas.Series
+        :type from_node: pandas.Series or tuple (locationID, lat, lon)
         :param to_node: End node
-        :type to_node: pandas.Series
+        :type to_node: pandas.Series or tuple (locationID, lat, lon)
         
         All other kwargs are passed to matplotlib.patches.FancyArrowPatch
         """
@@ -218,13 +529,18 @@ class Edge(mpatches.FancyArrowPatch):
         from_node = kwargs.pop("from_node")
         to_node = kwargs.pop("to_node")
 
-        self.from_node = from_node.name
-        self.to_node = to_node.name
-
         arrow_style = mpatches.ArrowStyle("-|>", head_length=3, head_width=3)
         kwargs["arrowstyle"] = arrow_style
-        kwargs["posA"] = tuple(from_node[["lat","lon"]])
-        kwargs["posB"] = tuple(to_node[["lat","lon"]])
+        if isinstance(from_node, pd.Series):
+            self.from_node = from_node.name
+            self.to_node = to_node.name
+            kwargs["posA"] = tuple(from_node[["lat","lon"]])
+            kwargs["posB"] = tuple(to_node[["lat","lon"]])
+        else:
+            self.from_node = from_node[0]
+            self.to_node = to_node[0]
+            kwargs["posA"] = tuple(from_node[1:])
+            kwargs["posB"] = tuple(to_node[1:])
         
         super(Edge,self).__init__(**kwargs) 
 
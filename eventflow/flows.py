@@ -0,0 +1,384 @@
+"""Sparse transition matrices and origin-destination flows of event graphs.
+
+Row and column i of every matrix belong to the same location, the mapping
+locationID -> i is held by a LocationIndex. The index only grows, so a
+matrix stays valid when new locations are added later on, it only has to
+be resized (see resize). The matrices need scipy::
+
+    matrix = graph.transition_matrix(start_date="1800-01-01")
+    total = gc.transition_matrix(normalize=True)
+    reachable = flows.reachability(total, steps=3)
+
+ODFlows sums the edges of many actors into weighted location pairs::
+
+    flows = gc.od_flows("1800-01-01", "1850-12-31")
+"""
+from collections import OrderedDict
+import threading
+
+import numpy as np
+import pandas as pd
+
+try:
+    import scipy.sparse as sp
+except ImportError:
+    sp = None
+
+from . import dateparse
+
+
+class LocationIndex:
+    """Mapping of locationIDs to consecutive matrix positions.
+    New locationIDs get the next free position.
+
+    :param ids: Initial locationIDs
+    :type ids: array like
+    """
+
+    def __init__(self, ids=()):
+        self._lock = threading.Lock()
+        self._ids = np.empty(0, dtype=np.int64)
+        # Sorted locationIDs and their positions for the lookup
+        self._sorted = np.empty(0, dtype=np.int64)
+        self._positions = np.empty(0, dtype=np.int64)
+        self.add(ids)
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def ids(self):
+        """locationIDs, ordered by their position."""
+        return self._ids
+
+    def add(self, ids):
+        """Add locationIDs, which are not in the index yet.
+
+        :param ids: locationIDs
+        :type ids: array like
+        """
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        with self._lock:
+            new = np.setdiff1d(ids, self._sorted, assume_unique=True)
+            if not len(new):
+                return
+            positions = np.arange(len(self._ids), len(self._ids) + len(new))
+            self._ids = np.concatenate([self._ids, new])
+            self._sorted = np.concatenate([self._sorted, new])
+            self._positions = np.concatenate([self._positions, positions])
+            order = np.argsort(self._sorted, kind="mergesort")
+            self._sorted = self._sorted[order]
+            self._positions = self._positions[order]
+
+    def positions(self, ids):
+        """Positions of the locationIDs, -1 for unknown ones.
+
+        :param ids: locationIDs
+        :type ids: array like
+
+        :rtype: numpy.ndarray
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        sorted_ids, positions = self._sorted, self._positions
+        if not len(sorted_ids):
+            return np.full(len(ids), -1, dtype=np.int64)
+        found = np.searchsorted(sorted_ids, ids).clip(max=len(sorted_ids) - 1)
+        return np.where(sorted_ids[found] == ids, positions[found], -1)
+
+
+# Default index, shared by all graphs and collections
+locations = LocationIndex()
+
+FLOWS_COLUMNS = ["from_node", "to_node", "weight", "actors",
+                 "from_lat", "from_lon", "to_lat", "to_lon"]
+
+# Number of time windows, whose flows ODFlows keeps up to date
+FLOWS_CACHE_SIZE = 8
+
+
+class ODFlows:
+    """Origin-destination flows of many actors. The edges of every actor are
+    stored as integer keys of their location pairs, the flows of a time
+    window are group counts over these keys. The flows of the last
+    FLOWS_CACHE_SIZE windows are kept and updated incrementally, when
+    actors are added or removed.
+
+    :param index: Mapping of the locations, defaults to locations
+    :type index: eventflow.flows.LocationIndex
+    :param loops: Whether to count edges, which start and end
+        at the same location
+    :type loops: bool
+    """
+
+    def __init__(self, index=None, loops=False):
+        self.index = locations if index is None else index
+        self.loops = loops
+        self._lock = threading.RLock()
+        # actorID -> (keys, from days, to days), sorted by the from days
+        self._actors = dict()
+        # (start, end) -> (keys, weights, actors)
+        self._windows = OrderedDict()
+        # Coordinates by position in the index
+        self._lat = np.empty(0)
+        self._lon = np.empty(0)
+
+    def __contains__(self, actor_id):
+        return actor_id in self._actors
+
+    def __len__(self):
+        return len(self._actors)
+
+    def add(self, actor_id, graph):
+        """Add the complete edges of a graph, a previous graph of the actor
+        is replaced.
+
+        :param actor_id: Id of the actor
+        :type actor_id: int
+        :param graph: Event graph
+        :type graph: eventflow.EventGraph
+        """
+        edges = graph.all_edges
+        from_nodes = edges.from_node.values.astype(np.int64)
+        to_nodes = edges.to_node.values.astype(np.int64)
+        from_days = dateparse.ordinals(edges.from_date.values)
+        to_days = dateparse.ordinals(edges.to_date.values)
+        if not self.loops:
+            moved = from_nodes != to_nodes
+            from_nodes, to_nodes = from_nodes[moved], to_nodes[moved]
+            from_days, to_days = from_days[moved], to_days[moved]
+
+        with self._lock:
+            self.remove(actor_id)
+            self._add_coordinates(graph.all_nodes)
+            self.index.add(np.concatenate([from_nodes, to_nodes]))
+            keys = _pair_keys(self.index.positions(from_nodes),
+                              self.index.positions(to_nodes))
+            order = np.argsort(from_days, kind="mergesort")
+            arrays = (keys[order], from_days[order], to_days[order])
+            self._actors[actor_id] = arrays
+            for window, table in list(self._windows.items()):
+                self._windows[window] = _merge(
+                    table, _contribution(arrays, *window), 1)
+
+    def remove(self, actor_id):
+        """Remove the edges of an actor, if it was added before.
+
+        :param actor_id: Id of the actor
+        :type actor_id: int
+        """
+        with self._lock:
+            arrays = self._actors.pop(actor_id, None)
+            if arrays is None:
+                return
+            for window, table in list(self._windows.items()):
+                self._windows[window] = _merge(
+                    table, _contribution(arrays, *window), -1)
+
+    def clear(self):
+        with self._lock:
+            self._actors = dict()
+            self._windows = OrderedDict()
+
+    def flows(self, start_date=None, end_date=None):
+        """Number of edges and of distinct actors per location pair. Only
+        edges, which lie completely within the time window, are counted.
+
+        :param start_date: Only edges, which begin at or after this date
+        :type start_date: datetime.date or yyyy-mm-dd (ISO 8601)
+        :param end_date: Only edges, which end at or before this date
+        :type end_date: datetime.date or yyyy-mm-dd (ISO 8601)
+
+        :returns: Data frame with the FLOWS_COLUMNS, ordered by the weight
+        :rtype: pandas.DataFrame
+        """
+        start = dateparse.parse_date(start_date).toordinal() if start_date else None
+        end = dateparse.parse_date(end_date).toordinal() if end_date else None
+        window = (start, end)
+        with self._lock:
+            table = self._windows.get(window)
+            if table is None:
+                table = _merge(_EMPTY_TABLE, _concatenate(
+                    [_contribution(arrays, start, end)
+                     for arrays in self._actors.values()]), 1)
+                self._windows[window] = table
+                if len(self._windows) > FLOWS_CACHE_SIZE:
+                    self._windows.popitem(last=False)
+            lat, lon = self._lat, self._lon
+
+        keys, weights, actors = table
+        order = np.argsort(-weights, kind="mergesort")
+        keys, weights, actors = keys[order], weights[order], actors[order]
+        rows = keys >> 32
+        cols = keys & 0xffffffff
+        ids = self.index.ids
+        return pd.DataFrame({"from_node": ids[rows], "to_node": ids[cols],
+                             "weight": weights, "actors": actors,
+                             "from_lat": lat[rows], "from_lon": lon[rows],
+                             "to_lat": lat[cols], "to_lon": lon[cols]},
+                            columns=FLOWS_COLUMNS)
+
+    def _add_coordinates(self, nodes):
+        self.index.add(nodes.index.values)
+        size = len(self.index)
+        if len(self._lat) < size:
+            self._lat = np.append(self._lat, np.full(size - len(self._lat), np.nan))
+            self._lon = np.append(self._lon, np.full(size - len(self._lon), np.nan))
+        positions = self.index.positions(nodes.index.values)
+        self._lat[positions] = nodes.lat.values
+        self._lon[positions] = nodes.lon.values
+
+
+_EMPTY_TABLE = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64),
+                np.empty(0, dtype=np.int64))
+
+
+def _pair_keys(rows, cols):
+    return (rows.astype(np.int64) << 32) | cols.astype(np.int64)
+
+
+def _contribution(arrays, start, end):
+    """Keys, number of edges and 1 per location pair of one actor
+    within the time window."""
+    keys, from_days, to_days = arrays
+    lower = np.searchsorted(from_days, start, side="left") if start is not None else 0
+    keys = keys[lower:]
+    if end is not None:
+        keys = keys[to_days[lower:] <= end]
+    keys, counts = np.unique(keys, return_counts=True)
+    return keys, counts, np.ones(len(keys), dtype=np.int64)
+
+
+def _concatenate(tables):
+    if not tables:
+        return _EMPTY_TABLE
+    return tuple(np.concatenate(columns) for columns in zip(*tables))
+
+
+def _merge(table, other, sign):
+    """Add (sign 1) or subtract (sign -1) the group counts of other."""
+    keys = np.concatenate([table[0], other[0]])
+    keys, inverse = np.unique(keys, return_inverse=True)
+    weights = np.bincount(inverse, np.concatenate([table[1], sign * other[1]]),
+                          minlength=len(keys)).round().astype(np.int64)
+    actors = np.bincount(inverse, np.concatenate([table[2], sign * other[2]]),
+                         minlength=len(keys)).round().astype(np.int64)
+    remaining = actors > 0
+    return keys[remaining], weights[remaining], actors[remaining]
+
+
+def transition_counts(from_nodes, to_nodes, index):
+    """Count the transitions between locations. Unknown locations are added
+    to the index.
+
+    :param from_nodes: locationIDs of the origins
+    :type from_nodes: numpy.ndarray
+    :param to_nodes: locationIDs of the destinations
+    :type to_nodes: numpy.ndarray
+    :param index: Mapping of the locations
+    :type index: eventflow.flows.LocationIndex
+
+    :returns: Square matrix with the number of transitions from row to column
+    :rtype: scipy.sparse.csr_matrix
+    """
+    _check_scipy()
+    index.add(np.concatenate([from_nodes, to_nodes]))
+    rows = index.positions(from_nodes)
+    cols = index.positions(to_nodes)
+    size = len(index)
+    return sp.coo_matrix((np.ones(len(rows), dtype=np.int64), (rows, cols)),
+                         shape=(size, size)).tocsr()
+
+
+def resize(matrix, size):
+    """Pad a square matrix with empty rows and columns up to size."""
+    _check_scipy()
+    if matrix.shape[0] == size:
+        return matrix
+    matrix = matrix.tocoo()
+    return sp.coo_matrix((matrix.data, (matrix.row, matrix.col)),
+                         shape=(size, size)).tocsr()
+
+
+def total(matrices, size):
+    """Sum of matrices of the same index, which may be of different sizes.
+
+    :param size: Size of the result, usually len(index)
+    :type size: int
+
+    :rtype: scipy.sparse.csr_matrix
+    """
+    _check_scipy()
+    # One conversion of all entries, duplicates are summed up by tocsr
+    data, rows, cols = [np.empty(0, dtype=np.int64)], [], []
+    for matrix in matrices:
+        matrix = matrix.tocoo()
+        data.append(matrix.data)
+        rows.append(matrix.row)
+        cols.append(matrix.col)
+    rows = np.concatenate([np.empty(0, dtype=np.int32)] + rows)
+    cols = np.concatenate([np.empty(0, dtype=np.int32)] + cols)
+    return sp.coo_matrix((np.concatenate(data), (rows, cols)),
+                         shape=(size, size)).tocsr()
+
+
+def normalize(matrix):
+    """Scale the rows to a sum of 1, rows without transitions stay empty.
+
+    :rtype: scipy.sparse.csr_matrix
+    """
+    _check_scipy()
+    sums = np.asarray(matrix.sum(axis=1), dtype=float).ravel()
+    scale = np.zeros(len(sums))
+    scale[sums > 0] = 1. / sums[sums > 0]
+    return sp.diags(scale).dot(matrix).tocsr()
+
+
+def matrix_power(matrix, steps):
+    """matrix ** steps by repeated squaring. For a normalized matrix, entry
+    (i, j) is the probability to get from i to j in exactly steps transitions.
+
+    :rtype: scipy.sparse.csr_matrix
+    """
+    _check_scipy()
+    result = sp.identity(matrix.shape[0], dtype=matrix.dtype, format="csr")
+    base = matrix.tocsr()
+    while steps > 0:
+        if steps & 1:
+            result = result.dot(base)
+        steps >>= 1
+        if steps:
+            base = base.dot(base)
+    return result
+
+
+def reachability(matrix, steps):
+    """Which locations can be reached from which within 1 to steps
+    transitions.
+
+    :returns: Boolean matrix, True if the column is reachable from the row
+    :rtype: scipy.sparse.csr_matrix
+    """
+    _check_scipy()
+    adjacency = _binary(matrix)
+    # Reachable within 0..n steps is (I + A) ** n, the entries are kept
+    # binary after every product, so they can not overflow
+    identity = sp.identity(matrix.shape[0], dtype=np.int64, format="csr")
+    within = identity
+    base = _binary(adjacency + identity)
+    steps -= 1
+    while steps > 0:
+        if steps & 1:
+            within = _binary(within.dot(base))
+        steps >>= 1
+        if steps:
+            base = _binary(base.dot(base))
+    return within.dot(adjacency) > 0
+
+
+def _binary(matrix):
+    return (matrix > 0).astype(np.int64)
+
+
+def _check_scipy():
+    if sp is None:
+        raise ImportError("The transition matrices need scipy")
@@ -0,0 +1,204 @@
+"""Named timing spans and counters for the hot paths.
+
+Recording is off by default and costs a single flag check per span then.
+It is switched on with enable() or by setting the environment variable
+EVENTFLOW_TRACE=1 before the import. Usage::
+
+    from eventflow import instrument
+
+    @instrument.traced("EventGraph.build")
+    def build(self, ...):
+
+    with instrument.span("load_function", actorID=actor_id):
+        ...
+    instrument.count("graphs_loaded")
+
+    instrument.export_chrome_trace("trace.json")
+
+The trace can be opened in chrome://tracing or https://ui.perfetto.dev.
+Only the last MAX_EVENTS spans are kept for it, the totals of summary
+cover all spans.
+"""
+from collections import OrderedDict, deque
+import functools
+import json
+import os
+import threading
+import time
+
+# Number of recorded spans, which are kept for export_chrome_trace
+MAX_EVENTS = 100000
+
+_state = {"enabled": os.environ.get("EVENTFLOW_TRACE", "") not in ("", "0")}
+_lock = threading.Lock()
+# (name, start, duration, thread id, args), times in seconds
+_events = deque(maxlen=MAX_EVENTS)
+# name -> (seconds, calls) of all spans ever recorded
+_totals = dict()
+_counters = OrderedDict()
+_origin = time.perf_counter()
+
+
+def enable():
+    """Start recording."""
+    _state["enabled"] = True
+
+
+def disable():
+    """Stop recording, the recorded events are kept."""
+    _state["enabled"] = False
+
+
+def is_enabled():
+    return _state["enabled"]
+
+
+def reset():
+    """Forget all events and counters."""
+    with _lock:
+        _events.clear()
+        _totals.clear()
+        _counters.clear()
+
+
+class _Span:
+    __slots__ = ("name", "args", "_start")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter()
+        event = (self.name, self._start - _origin, end - self._start,
+                 threading.get_ident(), self.args)
+        with _lock:
+            _events.append(event)
+            seconds, calls = _totals.get(self.name, (0., 0))
+            _totals[self.name] = (seconds + event[2], calls + 1)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, **args):
+    """Context manager, which records the time spent in its block.
+
+    :param name: Name of the span
+    :type name: string
+    :param args: Additional values, which are stored with the span
+    """
+    if not _state["enabled"]:
+        return _NO_SPAN
+    return _Span(name, args)
+
+
+def traced(name=None):
+    """Decorator, which records every call of the function as span.
+
+    :param name: Name of the span, defaults to the qualified function name
+    :type name: string
+    """
+    def inner(func):
+        label = name or func.__qualname__
+
+        @functools.wraps(func)
+        def traced_func(*args, **kwargs):
+            if not _state["enabled"]:
+                return func(*args, **kwargs)
+            with _Span(label, None):
+                return func(*args, **kwargs)
+        return traced_func
+    return inner
+
+
+def count(name, value=1):
+    """Add value to the counter name."""
+    if not _state["enabled"]:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def counters():
+    with _lock:
+        return OrderedDict(_counters)
+
+
+def mark():
+    """The totals so far. Pass them to summary, to only look at the spans,
+    which were recorded afterwards."""
+    with _lock:
+        return dict(_totals)
+
+
+def summary(since=None):
+    """Total time and number of calls per span name, ordered by the
+    total time.
+
+    :param since: Result of mark
+    :type since: dict
+
+    :returns: name -> (seconds, calls)
+    :rtype: collections.OrderedDict
+    """
+    with _lock:
+        totals = dict(_totals)
+    for name, (seconds, calls) in (since or {}).items():
+        total_seconds, total_calls = totals.get(name, (0., 0))
+        if total_calls > calls:
+            totals[name] = (total_seconds - seconds, total_calls - calls)
+        else:
+            totals.pop(name, None)
+    return OrderedDict(sorted(totals.items(), key=lambda t: -t[1][0]))
+
+
+def format_summary(totals, limit=5):
+    """One line breakdown of a summary, e.g. for a status bar."""
+    return ", ".join("{} {:.2f}s".format(name, seconds)
+                     for name, (seconds, _) in list(totals.items())[:limit])
+
+
+def export_chrome_trace(filename):
+    """Write the last MAX_EVENTS events and the final counter values in the
+    Chrome trace event format.
+
+    :param filename: Output file
+    :type filename: string
+    """
+    pid = os.getpid()
+    with _lock:
+        events = list(_events)
+        values = OrderedDict(_counters)
+    trace = [{"name": name, "cat": "eventflow", "ph": "X", "pid": pid,
+              "tid": tid, "ts": start * 1e6, "dur": duration * 1e6,
+              "args": _json_args(args)}
+             for name, start, duration, tid, args in events]
+    end = max([e[1] + e[2] for e in events] or [0.])
+    trace += [{"name": name, "cat": "eventflow", "ph": "C", "pid": pid,
+               "tid": 0, "ts": end * 1e6, "args": {name: value}}
+              for name, value in values.items()]
+    with open(filename, "w") as f:
+        json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+
+
+def _json_args(args):
+    if not args:
+        return {}
+    return {key: value if isinstance(value, (int, float, str, bool))
+            else str(value) for key, value in args.items()}
@@ -0,0 +1,325 @@
+"""Keeps the cache of a GraphCollection in sync with the eventflow database.
+
+An Invalidator follows the change streams of the eventflow edges and nodes
+collections. Only the graphs of the affected actors are dropped from the
+cache, new edges of cached actors are appended to their graphs directly.
+Delete events only carry the _id of the document, so the _ids of the edges
+and nodes of the cached graphs are kept to find the affected actors.
+Change streams need a replica set (MongoDB >= 3.6, pymongo >= 3.6), if they
+are not available, the collections are polled instead::
+
+    invalidator = Invalidator(gc, client)
+    invalidator.start()
+    ...
+    invalidator.stop()
+"""
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+import pymongo.errors
+
+from . import db_queries
+from . import util
+
+# Seconds between two polls, if there are no change streams
+POLL_INTERVAL = 10.
+
+logger = logging.getLogger(__name__)
+
+
+class Invalidator:
+    """Drops or patches the cached graphs of a GraphCollection, whose
+    edges or nodes changed in the database.
+
+    :param gc: Collection, whose cache is kept up to date
+    :type gc: eventflow.GraphCollection
+    :param client: MongoDB client
+    :type client: pymongo.MongoClient
+    :param interval: Seconds between two polls of the fallback
+    :type interval: float
+    :param patch: Append inserted edges to the cached graphs
+        instead of dropping them
+    :type patch: bool
+    :param callback: Called with the set of affected actorIDs after every
+        change, in the thread of the invalidator
+    :type callback: function
+    """
+
+    def __init__(self, gc, client, interval=POLL_INTERVAL, patch=True,
+                 callback=None):
+        self.gc = gc
+        self.client = client
+        self.interval = interval
+        self.patch = patch
+        self.callback = callback
+        self.mode = None
+        self._stopped = threading.Event()
+        # Every change stream is followed by a thread of its own, they
+        # share the tracked _ids
+        self._lock = threading.RLock()
+        self._streams = []
+        self._threads = []
+        # Fingerprints of the last poll, actorID -> edges and
+        # locationID -> node
+        self._edges_state = dict()
+        self._nodes_state = dict()
+        # _ids of the edges of the cached graphs, actorID -> (graph, _ids)
+        # and _id -> actorID, the same for the nodes of the visited
+        # locations, locationID -> _id and _id -> locationID
+        self._actor_edges = dict()
+        self._edge_actors = dict()
+        self._location_nodes = dict()
+        self._node_locations = dict()
+
+    def start(self):
+        """Follow the change streams or start polling, if the server or
+        the driver does not support them.
+
+        :returns: "change_stream" or "polling"
+        :rtype: string
+        """
+        self._stopped.clear()
+        try:
+            self._streams = [(name, self._collection(name).watch(
+                full_document="updateLookup"))
+                for name in [util.EVENTFLOW_EDGES, util.EVENTFLOW_NODES]]
+            self.mode = "change_stream"
+            self._track()
+            targets = [(self._follow, stream) for stream in self._streams]
+        except (TypeError, AttributeError, NotImplementedError,
+                pymongo.errors.PyMongoError):
+            # TypeError: watch is not a method of the collection in old
+            # drivers, OperationFailure: the server is no replica set
+            self._close_streams()
+            self.mode = "polling"
+            self.poll()
+            targets = [(self._poll_loop, None)]
+
+        self._threads = [threading.Thread(target=target, args=(arg,),
+                                          daemon=True)
+                         for target, arg in targets]
+        for thread in self._threads:
+            thread.start()
+        return self.mode
+
+    def stop(self):
+        """Stop following the changes."""
+        self._stopped.set()
+        self._close_streams()
+        for thread in self._threads:
+            thread.join(timeout=1.)
+        self._threads = []
+
+    def process(self, change, collection):
+        """Handle a single change event of a change stream.
+
+        :param change: Change event
+        :type change: dict
+        :param collection: Name of the changed collection
+        :type collection: string
+
+        :returns: actorIDs, whose graphs were dropped or patched
+        :rtype: set
+        """
+        with self._lock:
+            return self._process(change, collection)
+
+    def _process(self, change, collection):
+        operation = change.get("operationType")
+        document = change.get("fullDocument") or {}
+        if operation in ("drop", "rename", "dropDatabase", "invalidate"):
+            return self._affected(self.gc.invalidate())
+        # Before the lookup, the _id of a deleted document is unknown then,
+        # if its graph was only cached afterwards
+        self._track()
+        key = (change.get("documentKey") or {}).get("_id", document.get("_id"))
+
+        if collection == util.EVENTFLOW_EDGES:
+            # An update may move the edge to another actor, the graphs of
+            # the old and the new one are affected. Inserted edges are new
+            owners = set()
+            if "actorID" in document:
+                owners.add(document["actorID"])
+            if operation != "insert" and key in self._edge_actors:
+                owners.add(self._edge_actors[key])
+            if not owners:
+                # The deleted edge may belong to any cached graph
+                return self._affected(self.gc.invalidate())
+            cached = self.gc.cached_actor_ids
+            owners = [actor_id for actor_id in owners if actor_id in cached]
+            if not owners:
+                return set()
+            if operation == "insert" and self.patch and self._append(
+                    owners[0], pd.DataFrame([document])):
+                actor_id = owners[0]
+                if actor_id in self._actor_edges:
+                    self._actor_edges[actor_id][1].add(key)
+                    self._edge_actors[key] = actor_id
+                return self._affected([actor_id])
+            return self._affected(self.gc.invalidate(owners))
+
+        if collection == util.EVENTFLOW_NODES:
+            if operation == "insert":
+                # A new node only completes edges, which were dropped
+                # so far, if any
+                return set()
+            if "locationID" in document:
+                location_id = document["locationID"]
+            elif key in self._node_locations:
+                location_id = self._node_locations[key]
+            else:
+                return self._affected(self.gc.invalidate())
+            return self._affected(self.gc.invalidate(
+                self.gc.visitors([location_id])))
+        return set()
+
+    def poll(self):
+        """Compare the edges of the cached actors and the nodes of their
+        locations with the last poll. The edges are compared by their
+        number, the largest _id and sums of their fields, so updates,
+        which keep all of them, are not noticed.
+
+        :returns: actorIDs, whose graphs were dropped
+        :rtype: set
+        """
+        database = self.client[util.EVENTFLOW_COLLECTION]
+        actor_ids = self.gc.cached_actor_ids
+        edges_state = {doc["_id"]: (doc["count"], doc["last_id"],
+                                    doc["from_nodes"], doc["to_nodes"],
+                                    doc["first_date"], doc["last_date"])
+                       for doc in database[util.EVENTFLOW_EDGES].aggregate([
+                           {"$match": {"actorID": {"$in": actor_ids}}},
+                           {"$group": {"_id": "$actorID",
+                                       "count": {"$sum": 1},
+                                       "last_id": {"$max": "$_id"},
+                                       "from_nodes": {"$sum": "$from_node"},
+                                       "to_nodes": {"$sum": "$to_node"},
+                                       "first_date": {"$min": "$from_date"},
+                                       "last_date": {"$max": "$to_date"}}}])}
+        location_ids = sorted(self.gc.visited_locations())
+        nodes_state = {doc["locationID"]: (doc.get("label"), doc.get("lat"),
+                                           doc.get("lon"))
+                       for doc in database[util.EVENTFLOW_NODES].find(
+                           {"locationID": {"$in": location_ids}},
+                           {"_id": 0, "locationID": 1, "label": 1,
+                            "lat": 1, "lon": 1})}
+
+        changed = {actor_id for actor_id in actor_ids
+                   if actor_id in self._edges_state and
+                   self._edges_state[actor_id] != edges_state.get(actor_id)}
+        moved = [location_id for location_id in location_ids
+                 if location_id in self._nodes_state and
+                 self._nodes_state[location_id] != nodes_state.get(location_id)]
+        changed |= self.gc.visitors(moved)
+
+        self._edges_state = {actor_id: state
+                             for actor_id, state in edges_state.items()
+                             if actor_id not in changed}
+        self._nodes_state = nodes_state
+        if not changed:
+            return set()
+        return self._affected(self.gc.invalidate(changed))
+
+    def _track(self):
+        """Fetch the _ids of the edges of newly cached graphs and of the
+        nodes of newly visited locations. Graphs and locations, which are
+        gone from the cache, are forgotten."""
+        with self._lock:
+            self._track_cached()
+
+    def _track_cached(self):
+        graphs = {actor_id: self.gc.get_cache_entry(actor_id)
+                  for actor_id in self.gc.cached_actor_ids}
+        for actor_id, (graph, ids) in list(self._actor_edges.items()):
+            if graphs.get(actor_id) is not graph:
+                del self._actor_edges[actor_id]
+                for _id in ids:
+                    self._edge_actors.pop(_id, None)
+        new = [actor_id for actor_id, graph in graphs.items()
+               if graph is not None and actor_id not in self._actor_edges]
+        if new:
+            for actor_id in new:
+                self._actor_edges[actor_id] = (graphs[actor_id], set())
+            for doc in self._collection(util.EVENTFLOW_EDGES).find(
+                    {"actorID": {"$in": new}}, {"_id": 1, "actorID": 1}):
+                self._actor_edges[doc["actorID"]][1].add(doc["_id"])
+                self._edge_actors[doc["_id"]] = doc["actorID"]
+
+        visited = self.gc.visited_locations()
+        for location_id in set(self._location_nodes) - visited:
+            self._node_locations.pop(self._location_nodes.pop(location_id),
+                                     None)
+        new = [int(location_id) for location_id in visited
+               if location_id not in self._location_nodes]
+        if new:
+            for doc in self._collection(util.EVENTFLOW_NODES).find(
+                    {"locationID": {"$in": new}}, {"_id": 1, "locationID": 1}):
+                self._location_nodes[doc["locationID"]] = doc["_id"]
+                self._node_locations[doc["_id"]] = doc["locationID"]
+
+    def _follow(self, named_stream):
+        name, stream = named_stream
+        try:
+            for change in stream:
+                if self._stopped.is_set():
+                    break
+                try:
+                    self.process(change, name)
+                except pymongo.errors.PyMongoError:
+                    raise
+                except Exception:
+                    # Keep following the stream, but the cache can not be
+                    # trusted after a change, which was not handled
+                    logger.exception("Could not process the change %r of %s",
+                                     change, name)
+                    self._affected(self.gc.invalidate())
+        except pymongo.errors.PyMongoError:
+            # The stream is closed by stop or lost, the cache can not be
+            # trusted anymore
+            if not self._stopped.is_set():
+                self._affected(self.gc.invalidate())
+
+    def _poll_loop(self, _):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.poll()
+            except pymongo.errors.PyMongoError:
+                pass
+
+    def _append(self, actor_id, edges):
+        """Append inserted edges to a cached graph.
+
+        :returns: False, if the nodes of the edges are unknown
+        :rtype: bool
+        """
+        location_ids = np.unique(edges[["from_node", "to_node"]].values)
+        nodes = db_queries.get_nodes(self.client, location_ids.tolist())
+        if len(nodes) < len(location_ids):
+            return False
+        nodes = nodes.set_index("locationID")
+        for prefix in ["from", "to"]:
+            node_ids = edges[prefix + "_node"].values
+            edges[prefix + "_lat"] = nodes.lat.loc[node_ids].values
+            edges[prefix + "_lon"] = nodes.lon.loc[node_ids].values
+        edges = edges[[name for name, _ in db_queries.EDGES_COLUMNS]]
+        return self.gc.append(actor_id, nodes, edges) is not None
+
+    def _affected(self, actor_ids):
+        """Report the dropped or patched graphs to the callback."""
+        actor_ids = set(actor_ids)
+        if actor_ids and self.callback is not None:
+            self.callback(actor_ids)
+        return actor_ids
+
+    def _collection(self, name):
+        return self.client[util.EVENTFLOW_COLLECTION][name]
+
+    def _close_streams(self):
+        for _, stream in self._streams:
+            try:
+                stream.close()
+            except pymongo.errors.PyMongoError:
+                pass
+        self._streams = []
@@ -0,0 +1,219 @@
+"""Map/reduce over many event graphs in a process pool.
+
+The graphs are not pickled for the workers. The columns (see
+EventGraph.columns) of the graphs of a task are written into one .npy file
+per column, which the worker maps into memory. A task only names its
+directory, the worker rebuilds the graphs from the mapped columns. Every
+task is started as soon as its columns are written::
+
+    def num_stays(actor_id, graph):
+        return len(graph.stays)
+
+    total = gc.map_reduce(num_stays, operator.add, 0)
+
+func and reduce have to be picklable, i.e. functions of a module.
+"""
+import functools
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from . import core
+
+# Number of tasks per worker, more tasks balance unequal graphs better
+TASKS_PER_PROCESS = 4
+
+
+def pack(graphs):
+    """Concatenate the columns of the graphs, see EventGraph.columns.
+    The graph i has the nodes node_offsets[i]:node_offsets[i + 1] and the
+    edges edge_offsets[i]:edge_offsets[i + 1], see read_graph. Locations,
+    which are the same in all graphs, are stored once, the nodes are then
+    the rows node_index of the node columns.
+
+    :param graphs: (actorID, graph) pairs
+    :type graphs: iterable
+
+    :returns: name -> array, the columns, actor_ids and the offsets
+    :rtype: dict
+    """
+    actor_ids = []
+    columns = {name: [] for name in
+               core.GRAPH_NODE_COLUMNS + core.GRAPH_EDGE_COLUMNS}
+    for actor_id, graph in graphs:
+        actor_ids.append(actor_id)
+        for name, values in graph.columns().items():
+            columns[name].append(values)
+
+    node_counts = [len(nodes) for nodes in columns["locationID"]]
+    edge_counts = [len(edges) for edges in columns["from_node"]]
+    arrays = {"actor_ids": np.array(actor_ids, dtype=np.int64),
+              "node_offsets": np.cumsum([0] + node_counts),
+              "edge_offsets": np.cumsum([0] + edge_counts)}
+    for name, values in columns.items():
+        arrays[name] = np.concatenate(values) if values else np.empty(0)
+
+    _, first, node_index = np.unique(arrays["locationID"], return_index=True,
+                                     return_inverse=True)
+    table = {name: arrays[name][first] for name in core.GRAPH_NODE_COLUMNS}
+    if all(_same(arrays[name], values[node_index])
+           for name, values in table.items()):
+        arrays.update(table)
+        arrays["node_index"] = node_index.astype(np.int64)
+    return arrays
+
+
+def _same(values, other):
+    """Whether two arrays are equal, floats bit by bit."""
+    if values.dtype.kind == "f":
+        return np.array_equal(values.view(np.int64), other.view(np.int64))
+    return np.array_equal(values, other)
+
+
+def write_buffers(graphs, directory):
+    """Write the columns of the graphs into directory, one .npy file per
+    column, see pack.
+
+    :param graphs: (actorID, graph) pairs
+    :type graphs: iterable
+    :param directory: Existing directory
+    :type directory: string
+
+    :returns: Number of graphs
+    :rtype: int
+    """
+    arrays = pack(graphs)
+    for name, values in arrays.items():
+        np.save(os.path.join(directory, name + ".npy"), values)
+    return len(arrays["actor_ids"])
+
+
+def open_buffers(directory):
+    """Map the columns of write_buffers into memory.
+
+    :rtype: dict
+    """
+    return {name[:-len(".npy")]: np.load(os.path.join(directory, name),
+                                         mmap_mode="r")
+            for name in os.listdir(directory) if name.endswith(".npy")}
+
+
+def graph_columns(buffers, position):
+    """Columns of the graph at position of pack or write_buffers.
+
+    :returns: actorID, name -> array, see EventGraph.columns
+    :rtype: int, dict
+    """
+    nodes = slice(buffers["node_offsets"][position],
+                  buffers["node_offsets"][position + 1])
+    edges = slice(buffers["edge_offsets"][position],
+                  buffers["edge_offsets"][position + 1])
+    if "node_index" in buffers:
+        nodes = buffers["node_index"][nodes]
+    columns = {name: buffers[name][nodes]
+               for name in core.GRAPH_NODE_COLUMNS if name in buffers}
+    columns.update({name: buffers[name][edges]
+                    for name in core.GRAPH_EDGE_COLUMNS})
+    return int(buffers["actor_ids"][position]), columns
+
+
+def read_graph(buffers, position):
+    """Rebuild the graph at position of pack or write_buffers.
+
+    :returns: actorID, graph
+    :rtype: int, eventflow.EventGraph
+    """
+    actor_id, columns = graph_columns(buffers, position)
+    return actor_id, core.EventGraph.from_columns(columns)
+
+
+def map_reduce(graphs, func, reduce=None, initial=None, processes=None,
+               start_date=None, end_date=None):
+    """Apply func to every graph in a process pool and reduce the results.
+
+    :param graphs: (actorID, graph) pairs
+    :type graphs: iterable
+    :param func: Called as func(actorID, graph) for every graph
+    :type func: function
+    :param reduce: Called as reduce(result, value) to combine two results,
+        if None, all results are returned. Every worker reduces its own
+        results first, so the order of the reduction is not defined.
+    :type reduce: function
+    :param initial: Start value of the reduction, if None the first result
+    :param processes: Number of worker processes, defaults to the number of
+        cores. With 1 everything runs in this process.
+    :type processes: int
+    :param start_date: The graphs are built for this time frame, before
+        they are handed to func
+    :type start_date: datetime.date or yyyy-mm-dd (ISO 8601)
+    :param end_date: See start_date
+    :type end_date: datetime.date or yyyy-mm-dd (ISO 8601)
+
+    :returns: The reduced result or, without reduce, actorID -> result
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
+    graphs = list(graphs)
+    size = max(1, int(math.ceil(
+        1. * len(graphs) / (processes * TASKS_PER_PROCESS))))
+    directory = tempfile.mkdtemp(prefix="eventflow-")
+    try:
+        tasks = _tasks(graphs, size, directory,
+                       (func, reduce, start_date, end_date))
+        if processes == 1:
+            chunks = [_run_task(task) for task in tasks]
+        else:
+            with multiprocessing.Pool(processes) as pool:
+                # The workers start with the first task, while the columns
+                # of the others are still written
+                pending = [pool.apply_async(_run_task, (task,))
+                           for task in tasks]
+                chunks = [result.get() for result in pending]
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    if reduce is None:
+        results = dict()
+        for chunk in chunks:
+            results.update(chunk)
+        return results
+    chunks = [value for has_value, value in chunks if has_value]
+    if initial is not None:
+        chunks = [initial] + chunks
+    if not chunks:
+        return None
+    return functools.reduce(reduce, chunks)
+
+
+def _tasks(graphs, size, directory, arguments):
+    """Write the columns of every size graphs into a directory of their
+    own and yield the tasks of _run_task one after the other."""
+    for number, lo in enumerate(range(0, len(graphs), size)):
+        task_directory = os.path.join(directory, str(number))
+        os.mkdir(task_directory)
+        write_buffers(graphs[lo:lo + size], task_directory)
+        yield (task_directory,) + arguments
+
+
+def _run_task(task):
+    """Apply func to the graphs of a task directory. With reduce, the
+    results are reduced right away and (has value, value) is returned."""
+    directory, func, reduce, start_date, end_date = task
+    buffers = open_buffers(directory)
+    results = []
+    for position in range(len(buffers["actor_ids"])):
+        actor_id, graph = read_graph(buffers, position)
+        if start_date or end_date:
+            graph.build(start_date, end_date, color_edges=False,
+                        color_nodes=False)
+        results.append((actor_id, func(actor_id, graph)))
+
+    if reduce is None:
+        return results
+    if not results:
+        return False, None
+    return True, functools.reduce(reduce, [value for _, value in results])
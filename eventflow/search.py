@@ -0,0 +1,217 @@
+"""Local search index over the actor labels.
+
+The index answers prefix queries with a binary search over the sorted
+words of all labels and fuzzy queries with a trigram index. Strings are
+kept in object arrays, fixed width unicode arrays would pad every label
+to the longest one. The index is built once from the ACT nodes of
+EVENT_TRIPLES and saved to disk::
+
+    index = ActorIndex.from_client(client)
+    index.save("actors.npz")
+    index = ActorIndex.load("actors.npz")
+    index.search("ptolem")
+"""
+import unicodedata
+
+import numpy as np
+
+from . import util
+
+# Saved arrays of an ActorIndex
+INDEX_ARRAYS = ["ids", "WDids", "labels", "keys", "words", "word_rows",
+                "trigrams", "trigram_offsets", "trigram_rows",
+                "trigram_counts"]
+# Arrays of strings, which are saved as one NUL terminated utf-8 buffer
+STRING_ARRAYS = ["WDids", "labels", "keys", "words", "trigrams"]
+
+
+class ActorIndex:
+    """Prefix and fuzzy search over actor labels.
+
+    :param ids: actorIDs
+    :type ids: numpy.ndarray
+    :param WDids: Wikidata ids (Q-ids) of the actors
+    :type WDids: numpy.ndarray
+    :param labels: Labels of the actors
+    :type labels: numpy.ndarray
+    """
+
+    def __init__(self, ids, WDids, labels):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.WDids = _strings([str(WDid) for WDid in WDids])
+        self.labels = _strings([str(label) for label in labels])
+        keys = [_normalize(label) for label in self.labels]
+        self.keys = _strings(keys)
+
+        # Every word and the full label, sorted for the prefix search
+        words, rows = [], []
+        for row, key in enumerate(keys):
+            for word in set(key.split(" ")) | {key}:
+                words.append(word)
+                rows.append(row)
+        words = _strings(words)
+        order = np.argsort(words, kind="mergesort")
+        self.words = words[order]
+        self.word_rows = np.array(rows, dtype=np.int64)[order]
+
+        # Trigram -> rows, stored as sorted trigrams with offsets into rows
+        trigrams, rows = [], []
+        for row, key in enumerate(keys):
+            grams = _trigrams(key)
+            trigrams += grams
+            rows += [row] * len(grams)
+        trigrams = _strings(trigrams)
+        rows = np.array(rows, dtype=np.int64)
+        self.trigram_counts = np.bincount(rows, minlength=len(keys))
+        order = np.argsort(trigrams, kind="mergesort")
+        trigrams, rows = trigrams[order], rows[order]
+        self.trigrams, starts = np.unique(trigrams, return_index=True)
+        self.trigram_offsets = np.append(starts, len(rows))
+        self.trigram_rows = rows
+
+    @classmethod
+    def from_client(cls, client):
+        """Build the index from the ACT nodes of EVENT_TRIPLES.
+
+        :param client: MongoDB client
+        :type client: pymongo.MongoClient
+        """
+        actors = client[util.EVENT_TRIPLES]["nodes"].find(
+            {"nodeType": "ACT"}, {"_id": 0, "nodeID": 1, "nodeLabel": 1,
+                                  "WDlabel": 1})
+        ids, WDids, labels = [], [], []
+        for actor in actors:
+            ids.append(actor["nodeID"])
+            WDids.append(actor["nodeLabel"])
+            labels.append(actor.get("WDlabel") or "")
+        return cls(ids, WDids, labels)
+
+    def save(self, filename):
+        """Save the index as npz file."""
+        arrays = {name: getattr(self, name) for name in INDEX_ARRAYS}
+        for name in STRING_ARRAYS:
+            arrays[name] = _join(arrays[name])
+        np.savez(filename, **arrays)
+
+    @classmethod
+    def load(cls, filename):
+        """Load an index, which was saved with save."""
+        index = cls.__new__(cls)
+        with np.load(filename) as arrays:
+            for name in INDEX_ARRAYS:
+                array = arrays[name]
+                if name in STRING_ARRAYS:
+                    # Indexes of older versions contain unicode arrays
+                    array = (_split(array) if array.dtype == np.uint8
+                             else array.astype(object))
+                setattr(index, name, array)
+        return index
+
+    def __len__(self):
+        return len(self.ids)
+
+    def prefix(self, query, limit=10):
+        """Actors with a label or a word of the label, which starts with the
+        query. Exact matches come first, then labels starting with the query,
+        shorter labels before longer ones.
+
+        :returns: (id, WDid, label) of the candidates
+        :rtype: list
+        """
+        query = _normalize(query)
+        if not query:
+            return []
+        lower = np.searchsorted(self.words, query, side="left")
+        upper = np.searchsorted(self.words, query + "\uffff", side="left")
+        rows = np.unique(self.word_rows[lower:upper])
+        keys = self.keys[rows]
+        ranks = np.lexsort(([len(key) for key in keys],
+                            [not key.startswith(query) for key in keys],
+                            keys != query))
+        return self._candidates(rows[ranks[:limit]])
+
+    def fuzzy(self, query, limit=10, min_similarity=0.3):
+        """Actors with a similar label, ranked by the Jaccard similarity
+        of the trigrams of the labels.
+
+        :returns: (id, WDid, label) of the candidates
+        :rtype: list
+        """
+        grams = np.unique(_strings(_trigrams(_normalize(query))))
+        if not len(grams) or not len(self.trigrams):
+            return []
+        positions = np.searchsorted(self.trigrams, grams)
+        found = positions < len(self.trigrams)
+        positions = positions[found]
+        positions = positions[self.trigrams[positions] == grams[found]]
+        if not len(positions):
+            return []
+        rows = np.concatenate([
+            self.trigram_rows[self.trigram_offsets[p]:self.trigram_offsets[p + 1]]
+            for p in positions])
+        rows, shared = np.unique(rows, return_counts=True)
+        similarity = shared / (len(grams) + self.trigram_counts[rows] - shared)
+        similar = similarity >= min_similarity
+        rows, similarity = rows[similar], similarity[similar]
+        ranks = np.argsort(-similarity, kind="mergesort")
+        return self._candidates(rows[ranks[:limit]])
+
+    def search(self, query, limit=10):
+        """Prefix matches, filled up with fuzzy matches.
+
+        :returns: (id, WDid, label) of the candidates
+        :rtype: list
+        """
+        candidates = self.prefix(query, limit)
+        if len(candidates) < limit:
+            known = set(candidates)
+            candidates += [c for c in self.fuzzy(query, limit)
+                           if c not in known][:limit - len(candidates)]
+        return candidates
+
+    def resolve(self, names):
+        """Best candidate for each name, None if there is none.
+
+        :param names: Actor names
+        :type names: list
+
+        :rtype: list
+        """
+        resolved = []
+        for name in names:
+            candidates = self.search(name, limit=1)
+            resolved.append(candidates[0] if candidates else None)
+        return resolved
+
+    def _candidates(self, rows):
+        return [(int(self.ids[row]), str(self.WDids[row]), str(self.labels[row]))
+                for row in rows]
+
+
+def _strings(values):
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def _join(strings):
+    """NUL terminated utf-8 buffer of strings."""
+    joined = "".join(string + "\0" for string in strings)
+    return np.frombuffer(joined.encode("utf-8"), dtype=np.uint8)
+
+
+def _split(buffer):
+    """Inverse of _join."""
+    return _strings(buffer.tobytes().decode("utf-8").split("\0")[:-1])
+
+
+def _normalize(label):
+    """Lower case label without accents and repeated white space."""
+    label = unicodedata.normalize("NFKD", label)
+    label = "".join(c for c in label if not unicodedata.combining(c))
+    return " ".join(label.lower().split())
+
+
+def _trigrams(key):
+    padded = "  {} ".format(key)
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
@@ -0,0 +1,111 @@
+"""Session files, which bundle the actors of a GraphCollection with their
+cached graphs, so a collection can be restored without the database.
+
+A session is a compressed .npz file. The graphs are stored as their
+columns (see parallel.pack), the actors and any additional meta data as
+JSON::
+
+    from eventflow import session
+
+    session.save("analysis.npz", gc, {"start_date": "1900-01-01"})
+    ...
+    gc, meta = session.load("analysis.npz", gc)
+"""
+import json
+
+import numpy as np
+
+from . import core
+from . import parallel
+
+# Format of the session files, increased on incompatible changes
+SESSION_VERSION = 2
+
+# Name of the JSON document in the .npz file
+META_KEY = "meta"
+
+
+def save(filename, gc, meta=None, graphs=True):
+    """Write the actors and the cached graphs of a collection into a
+    session file. Graphs, which are not cached, are not fetched.
+
+    :param filename: Output filename, usually ending with .npz
+    :type filename: string
+    :param gc: Collection to save
+    :type gc: eventflow.GraphCollection
+    :param meta: Additional JSON serializable data, e.g. the time frame
+    :type meta: dict
+    :param graphs: Whether to include the graphs or only the actors
+    :type graphs: bool
+    """
+    actors = gc.actors
+    cached = []
+    if graphs:
+        cached = [(actor.id, gc.get_cache_entry(actor.id)) for actor in actors]
+        cached = [(actor_id, graph) for actor_id, graph in cached
+                  if graph is not None]
+
+    arrays = parallel.pack(cached)
+    document = {"version": SESSION_VERSION,
+                "actors": [{key: _plain(getattr(actor, key, None))
+                            for key in core.Actor.__slots__}
+                           for actor in actors],
+                "fingerprints": [graph.fingerprint for _, graph in cached],
+                "meta": meta or dict()}
+    arrays[META_KEY] = np.frombuffer(json.dumps(document).encode("utf-8"),
+                                     dtype=np.uint8)
+    with open(filename, "wb") as f:
+        np.savez_compressed(f, **arrays)
+
+
+def load(filename, gc=None, verify=True):
+    """Restore the actors and graphs of a session file into a collection.
+
+    :param filename: Session file of save
+    :type filename: string
+    :param gc: Collection to add to, defaults to a new collection
+        without a client
+    :type gc: eventflow.GraphCollection
+    :param verify: Compare the fingerprints of the restored graphs with
+        the saved ones
+    :type verify: bool
+
+    :returns: The collection and the meta data given to save
+    :rtype: eventflow.GraphCollection, dict
+    """
+    with np.load(filename) as data:
+        arrays = {name: data[name] for name in data.files}
+    document = json.loads(arrays.pop(META_KEY).tobytes().decode("utf-8"))
+    if document.get("version") != SESSION_VERSION:
+        raise core.EventGraphError(
+            "Unsupported session version {} in {}".format(
+                document.get("version"), filename))
+
+    if gc is None:
+        gc = core.GraphCollection([], None)
+    actors = dict()
+    for record in document["actors"]:
+        actor = core.Actor(record["id"])
+        actor._set_properties(record)
+        actors[actor.id] = actor
+
+    gc.update_actor_list(list(actors.values()))
+
+    for position, fingerprint in enumerate(document["fingerprints"]):
+        actor_id, columns = parallel.graph_columns(arrays, position)
+        digests = None
+        if verify:
+            digests = core._column_digests(columns)
+            if digests[0] != fingerprint:
+                raise core.EventGraphError(
+                    "The graph of actor {} in {} is corrupted".format(
+                        actor_id, filename))
+        gc.add(actors[actor_id], core.EventGraph.from_columns(columns, digests))
+    return gc, document["meta"]
+
+
+def _plain(value):
+    """numpy scalars as Python values for JSON."""
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
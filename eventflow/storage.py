@@ -0,0 +1,373 @@
+"""Local copies of the eventflow collections, which serve graphs and actors
+without the MongoDB.
+
+A store is used in place of the client::
+
+    from eventflow import storage
+
+    store = storage.SQLiteStore("eventflow.sqlite")
+    store.copy_from(client)
+    gc = eventflow.GraphCollection(["Q567"], store)
+
+The module level functions have the same interface as the ones in
+db_queries, so they can be used as load_function of a GraphCollection.
+"""
+import os
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+from . import db_queries
+from . import util
+
+ACTORS_COLUMNS = [("actorID", np.int64), ("WDid", object), ("name", object)]
+
+SQLITE_MAX_VARIABLES = 500
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    locationID INTEGER PRIMARY KEY, label TEXT, WDid,
+    lat REAL, lon REAL);
+CREATE TABLE IF NOT EXISTS edges (
+    actorID INTEGER, from_node INTEGER, from_date TEXT,
+    to_node INTEGER, to_date TEXT);
+CREATE INDEX IF NOT EXISTS edges_actorID ON edges (actorID, from_date);
+CREATE TABLE IF NOT EXISTS actors (
+    actorID INTEGER PRIMARY KEY, WDid TEXT, name TEXT);
+CREATE INDEX IF NOT EXISTS actors_WDid ON actors (WDid);
+CREATE INDEX IF NOT EXISTS actors_name ON actors (name);
+"""
+
+
+def get_graph(store, actorID):
+    """Same as db_queries.get_graph, but reads from a store."""
+    return store.get_graph(actorID)
+
+
+def actor_by_id(store, actor_id):
+    return store.actor_by_id(actor_id)
+
+
+def actor_by_WDid(store, actor_WDid):
+    return store.actor_by_WDid(actor_WDid)
+
+
+def actor_by_name(store, actor_name):
+    return store.actor_by_name(actor_name)
+
+
+class Store:
+    """Base class of the stores. Subclasses implement the lookups
+    _edges, _nodes and _actor and the bulk loading in load.
+    """
+
+    def get_graph(self, actorID):
+        """Nodes and edges of one or more actors.
+
+        :param actorID: actorID which can be used to identify the edges
+            of one actor
+        :type actorID: list, string or file
+
+        :result: nodes, edges with the columns of db_queries.NODES_COLUMNS
+            and db_queries.EDGES_COLUMNS
+        :type result: pd.DataFrame, pd.DataFrame
+        """
+        ids = [int(i) for i in db_queries.actor_ids(actorID)]
+        edges = self._edges(ids)
+        if edges.empty:
+            return pd.DataFrame(), edges
+
+        location_ids = np.unique(edges[["from_node", "to_node"]].values)
+        nodes = self._nodes(location_ids)
+        if nodes.empty:
+            return nodes, pd.DataFrame()
+
+        return nodes, edges
+
+    def actor_by_id(self, actor_id):
+        return self._actor("actorID", int(actor_id))
+
+    def actor_by_WDid(self, actor_WDid):
+        return self._actor("WDid", actor_WDid)
+
+    def actor_by_name(self, actor_name):
+        """Get actor by name. This is ambigious, because there might be
+        more then one person with the same name."""
+        return self._actor("name", actor_name)
+
+    def copy_from(self, client):
+        """Copy the eventflow nodes and edges and the actors from the
+        MongoDB into the store.
+
+        :param client: MongoDB client
+        :type client: pymongo.MongoClient
+        """
+        eventflow = client[util.EVENTFLOW_COLLECTION]
+        nodes = db_queries._read_columns(eventflow[util.EVENTFLOW_NODES].aggregate(
+            [{"$project": _projection(db_queries.NODES_COLUMNS)}],
+            batchSize=db_queries.BATCH_SIZE), db_queries.NODES_COLUMNS)
+        edges_columns = db_queries.EDGES_COLUMNS[:5]
+        edges = db_queries._read_columns(eventflow[util.EVENTFLOW_EDGES].aggregate(
+            [{"$project": _projection(edges_columns)}],
+            batchSize=db_queries.BATCH_SIZE), edges_columns)
+        actors = db_queries._read_columns(client[util.EVENT_TRIPLES]["nodes"].aggregate(
+            [{"$match": {"nodeType": "ACT"}},
+             {"$project": {"_id": 0, "actorID": "$nodeID", "WDid": "$nodeLabel",
+                           "name": {"$ifNull": ["$WDlabel", ""]}}}],
+            batchSize=db_queries.BATCH_SIZE), ACTORS_COLUMNS)
+        self.load(nodes, edges, actors)
+
+    def _actor_record(self, actor):
+        """The actor dict of db_queries for a row (actorID, WDid, name)."""
+        if actor is None:
+            return {"id": -1, "WDid": -1, "name": ""}
+        actor_id, WDid, name = actor
+        return {"id": int(actor_id), "WDid": WDid[1:], "name": name}
+
+
+class SQLiteStore(Store):
+    """Store in a single SQLite file. The edges are indexed by actorID,
+    nodes and actors by their ids, actors additionally by Q-id and name.
+    The connection can be shared between threads.
+
+    :param filename: Database file, ":memory:" for a temporary store
+    :type filename: string
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.executescript(SQLITE_SCHEMA)
+
+    def load(self, nodes, edges, actors=None):
+        """Bulk load nodes, edges and actors.
+        Existing nodes and actors with the same id are replaced, so are
+        all edges of the actors in edges. Loading again does not
+        duplicate anything.
+
+        :param nodes: Nodes with the db_queries.NODES_COLUMNS
+        :type nodes: pandas.DataFrame
+        :param edges: Edges with the first five db_queries.EDGES_COLUMNS
+        :type edges: pandas.DataFrame
+        :param actors: Actors with the ACTORS_COLUMNS
+        :type actors: pandas.DataFrame
+        """
+        tables = [("nodes", nodes, db_queries.NODES_COLUMNS, "REPLACE"),
+                  ("edges", edges, db_queries.EDGES_COLUMNS[:5], "ABORT"),
+                  ("actors", actors, ACTORS_COLUMNS, "REPLACE")]
+        with self._lock, self._connection:
+            for table, frame, columns, verb in tables:
+                if frame is None or frame.empty:
+                    continue
+                if table == "edges":
+                    # The edges have no key of their own
+                    actor_ids = [int(i) for i in np.unique(frame.actorID.values)]
+                    for i in range(0, len(actor_ids), SQLITE_MAX_VARIABLES):
+                        chunk = actor_ids[i:i + SQLITE_MAX_VARIABLES]
+                        self._connection.execute(
+                            "DELETE FROM edges WHERE actorID IN ({})".format(
+                                ",".join("?" * len(chunk))), chunk)
+                names = [name for name, _ in columns]
+                self._connection.executemany(
+                    "INSERT OR {} INTO {} ({}) VALUES ({})".format(
+                        verb, table, ",".join(names),
+                        ",".join("?" * len(names))),
+                    _rows(frame, columns))
+
+    def close(self):
+        self._connection.close()
+
+    def _query_in(self, sql, values, columns):
+        """Run a query with an IN ({}) clause for all values. The values are
+        split into chunks, SQLite limits the number of parameters."""
+        rows = []
+        with self._lock:
+            for i in range(0, len(values), SQLITE_MAX_VARIABLES):
+                chunk = values[i:i + SQLITE_MAX_VARIABLES]
+                rows += self._connection.execute(
+                    sql.format(",".join("?" * len(chunk))), chunk).fetchall()
+        return _frame(rows, columns)
+
+    def _edges(self, ids):
+        return self._query_in(
+            """SELECT e.actorID, e.from_node, e.from_date, e.to_node, e.to_date,
+                      f.lat, f.lon, t.lat, t.lon
+               FROM edges e
+               JOIN nodes f ON f.locationID = e.from_node
+               JOIN nodes t ON t.locationID = e.to_node
+               WHERE e.actorID IN ({})""", ids, db_queries.EDGES_COLUMNS)
+
+    def _nodes(self, location_ids):
+        return self._query_in(
+            """SELECT locationID, label, WDid, lat, lon FROM nodes
+               WHERE locationID IN ({})""",
+            [int(i) for i in location_ids], db_queries.NODES_COLUMNS)
+
+    def _actor(self, field, value):
+        with self._lock:
+            actor = self._connection.execute(
+                "SELECT actorID, WDid, name FROM actors WHERE {} = ? "
+                "LIMIT 1".format(field), (value,)).fetchone()
+        return self._actor_record(actor)
+
+
+class ParquetStore(Store):
+    """Store as a directory of Parquet files. The edges are partitioned by
+    actorID modulo num_partitions. Nodes, actors and the partitions, which
+    were used, are held in memory, sorted by their ids. Needs pyarrow.
+
+    :param directory: Directory of the dataset
+    :type directory: string
+    :param num_partitions: Number of edge partitions, only used by load
+    :type num_partitions: int
+    """
+
+    def __init__(self, directory, num_partitions=64):
+        if pq is None:
+            raise ImportError("ParquetStore needs pyarrow")
+        self.directory = directory
+        self.num_partitions = num_partitions
+        self._partitions = dict()
+        self._tables = dict()
+        self._lock = threading.Lock()
+        if os.path.isfile(self._path("meta.txt")):
+            with open(self._path("meta.txt"), "r") as f:
+                self.num_partitions = int(f.read())
+
+    def load(self, nodes, edges, actors=None):
+        """Write the dataset. Unlike SQLiteStore.load this replaces
+        everything, which was loaded before.
+
+        :param nodes: Nodes with the db_queries.NODES_COLUMNS
+        :type nodes: pandas.DataFrame
+        :param edges: Edges with the first five db_queries.EDGES_COLUMNS
+        :type edges: pandas.DataFrame
+        :param actors: Actors with the ACTORS_COLUMNS
+        :type actors: pandas.DataFrame
+        """
+        if actors is None:
+            actors = _frame([], ACTORS_COLUMNS)
+        if not os.path.isdir(self._path("edges")):
+            os.makedirs(self._path("edges"))
+
+        self._write(nodes, db_queries.NODES_COLUMNS, "locationID", "nodes")
+        self._write(actors, ACTORS_COLUMNS, "actorID", "actors")
+        edges_columns = db_queries.EDGES_COLUMNS[:5]
+        buckets = edges.actorID.values % self.num_partitions
+        for bucket in range(self.num_partitions):
+            self._write(edges[buckets == bucket], edges_columns, "actorID",
+                        os.path.join("edges", str(bucket)))
+        with open(self._path("meta.txt"), "w") as f:
+            f.write(str(self.num_partitions))
+
+        with self._lock:
+            self._partitions = dict()
+            self._tables = dict()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _write(self, frame, columns, key, name):
+        frame = _frame(_rows(frame, columns), columns)
+        frame = frame.sort_values(key, kind="mergesort")
+        pq.write_table(pa.Table.from_pandas(frame, preserve_index=False),
+                       self._path(name + ".parquet"))
+
+    def _read(self, name, columns):
+        with self._lock:
+            if name not in self._tables:
+                table = pq.read_table(self._path(name + ".parquet")).to_pandas()
+                # Arrow infers the types of object columns
+                for column, dtype in columns:
+                    table[column] = table[column].values.astype(dtype)
+                self._tables[name] = table.reset_index(drop=True)
+            return self._tables[name]
+
+    def _edges(self, ids):
+        ids = np.unique(ids)
+        parts = []
+        for bucket, bucket_ids in _group(ids, ids % self.num_partitions):
+            edges = self._read(os.path.join("edges", str(bucket)),
+                               db_queries.EDGES_COLUMNS[:5])
+            actors = edges.actorID.values
+            lower = np.searchsorted(actors, bucket_ids, side="left")
+            upper = np.searchsorted(actors, bucket_ids, side="right")
+            parts += [edges.iloc[lo:hi] for lo, hi in zip(lower, upper) if hi > lo]
+        if not parts:
+            return pd.DataFrame()
+        edges = pd.concat(parts, ignore_index=True)
+
+        nodes = self._read("nodes", db_queries.NODES_COLUMNS)
+        locations = nodes.locationID.values
+        for prefix in ["from", "to"]:
+            node_ids = edges[prefix + "_node"].values
+            index = np.minimum(np.searchsorted(locations, node_ids),
+                               len(locations) - 1)
+            known = locations[index] == node_ids if len(locations) else \
+                np.zeros(len(edges), dtype=bool)
+            edges = edges[known].copy()
+            index = index[known]
+            edges[prefix + "_lat"] = nodes.lat.values[index]
+            edges[prefix + "_lon"] = nodes.lon.values[index]
+        if edges.empty:
+            return pd.DataFrame()
+        return edges.reset_index(drop=True)
+
+    def _nodes(self, location_ids):
+        nodes = self._read("nodes", db_queries.NODES_COLUMNS)
+        return nodes[np.in1d(nodes.locationID.values, location_ids)]. \
+            reset_index(drop=True)
+
+    def _actor(self, field, value):
+        actors = self._read("actors", ACTORS_COLUMNS)
+        if field == "actorID":
+            index = np.searchsorted(actors.actorID.values, value)
+            match = actors.iloc[index:index + 1]
+            match = match[match.actorID.values == value]
+        else:
+            match = actors[actors[field].values == value]
+        if match.empty:
+            return self._actor_record(None)
+        return self._actor_record(tuple(match.iloc[0][["actorID", "WDid", "name"]]))
+
+
+def _projection(columns):
+    return dict(_id=0, **{name: 1 for name, _ in columns})
+
+
+def _rows(frame, columns):
+    """Rows of python values for the given columns."""
+    data = [frame[name].values.astype(dtype).tolist() for name, dtype in columns]
+    return list(zip(*data))
+
+
+def _frame(rows, columns):
+    """Typed data frame of rows in the order of the columns."""
+    names = [name for name, _ in columns]
+    if not rows:
+        return pd.DataFrame({name: np.array([], dtype=dtype)
+                             for name, dtype in columns}, columns=names)
+    frame = pd.DataFrame.from_records(rows, columns=names)
+    for name, dtype in columns:
+        frame[name] = frame[name].values.astype(dtype)
+    return frame
+
+
+def _group(values, keys):
+    """Group the sorted values by their keys."""
+    order = np.argsort(keys, kind="mergesort")
+    keys = keys[order]
+    values = values[order]
+    bounds = np.flatnonzero(np.diff(keys)) + 1
+    return zip(keys[np.r_[0, bounds]] if len(keys) else [],
+               np.split(values, bounds))
@@ -1,12 +1,18 @@
 import argparse
+import atexit
 import warnings
 import functools
+import inspect
 import configparser
 import os
+import threading
 
+import pandas as pd
 from sshtunnel import SSHTunnelForwarder
 from pymongo import MongoClient
 
+from . import dateparse
+
 config = configparser.ConfigParser()
 config.read(os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.ini"))
 
@@ -19,6 +25,7 @@ MONGODB_PORT = int(config["MONGODB"]["MONGODB_PORT"])
 MONGODB_AUTHENTICATION_DB = config["MONGODB"]["MONGODB_AUTHENTICATION_DB"]
 MONGODB_USER_NAME = config["MONGODB"]["MONGODB_USER_NAME"]
 MONGODB_PASSWORD = config["MONGODB"]["MONGODB_PASSWORD"]
+MONGODB_POOL_SIZE = config["MONGODB"].getint("MONGODB_POOL_SIZE", fallback=10)
 
 
 EVENT_TRIPLES = config["DATABASE"]["EVENT_TRIPLES"]
@@ -29,9 +36,121 @@ EVENTFLOW_COLLECTION = config["DATABASE"]["EVENTFLOW_COLLECTION"]
 EVENTFLOW_NODES = config["DATABASE"]["EVENTFLOW_NODES"]
 EVENTFLOW_EDGES = config["DATABASE"]["EVENTFLOW_EDGES"]
 
+class ConnectionManager(object):
+    """Long lived connection to the MongoDB, which is shared by all callers.
+
+    The SSH tunnel is started lazily with the first request of the client
+    and restarted, if it dropped in the meantime. The MongoClient keeps a
+    pool of sockets and is thread safe, so the same client can be handed to
+    the db_queries functions from several threads. Everything is closed
+    at exit of the interpreter.
+
+    The manager can be used as context manager::
+
+        with connection as client:
+            db_queries.get_graph(client, actorID)
+
+    or as decorator, in the same way as :func:`adrastea`.
+
+    :param max_pool_size: Maximum number of sockets of the MongoClient
+    :type max_pool_size: int
+    :param tunnel: Whether to connect through the SSH tunnel
+    :type tunnel: bool
+    """
+
+    def __init__(self, max_pool_size=None, tunnel=True):
+        if max_pool_size is None:
+            max_pool_size = MONGODB_POOL_SIZE
+        self.max_pool_size = max_pool_size
+        self.tunnel = tunnel
+        self._server = None
+        self._client = None
+        self._lock = threading.RLock()
+        atexit.register(self.close)
+
+    @property
+    def client(self):
+        """The shared, authenticated client.
+
+        :rtype: pymongo.MongoClient
+        """
+        with self._lock:
+            if self.tunnel and (self._server is None or
+                                not self._server.is_active):
+                self._start_tunnel()
+            if self._client is None:
+                client = MongoClient(MONGODB_HOST, MONGODB_PORT,
+                                     maxPoolSize=self.max_pool_size)
+                client[MONGODB_AUTHENTICATION_DB].authenticate(
+                    MONGODB_USER_NAME, MONGODB_PASSWORD)
+                print('Authenticated on mongodb')
+                self._client = client
+            return self._client
+
+    def close(self):
+        """Close the client and stop the tunnel.
+        The next request of the client connects again."""
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+            if self._server is not None:
+                self._server.stop()
+                self._server = None
+                print('Connection closed')
+
+    def _start_tunnel(self):
+        if self._server is not None:
+            # The tunnel dropped, the client reconnects through the new one
+            self._server.stop()
+        self._server = SSHTunnelForwarder(
+            (SSH_HOST, SSH_PORT),
+            ssh_username=LDAP_USER_NAME,
+            ssh_password=LDAP_PASSWORD,
+            remote_bind_address=('localhost', MONGODB_PORT),
+            local_bind_address=('localhost', MONGODB_PORT))
+        self._server.start()
+        print('Connected via SSH and established port-forwarding')
+
+    def __enter__(self):
+        return self.client
+
+    def __exit__(self, *exc_info):
+        # Keep the connection open for the next caller
+        return False
+
+    def __call__(self, func=None, extra_args=None):
+        def inner(func):
+            @functools.wraps(func)
+            def connected(*args, **kwargs):
+                env = dict()
+                env['client'] = self.client
+                if extra_args is not None:
+                    parser = argparse.ArgumentParser()
+                    env.update(vars(extra_args(parser)))
+                print('-' * 70)
+                print('')
+                args = list(args)
+                args.append(env)
+                return func(*args, **kwargs)
+            # env is passed in by connected, not by the caller (pytest
+            # would look for a fixture otherwise)
+            parameters = list(inspect.signature(func).parameters.values())
+            connected.__signature__ = inspect.Signature(parameters[:-1])
+            return connected
+        if func is not None:
+            return inner(func)
+        return inner
+
+
+connection = ConnectionManager()
+
+
 def adrastea(*args, **kwargs):
     """Wrapper for the automatic ssh connection to the specified SSH-Port and
     MongoDB. The connection details can be set in the config.ini file.
+    All decorated functions share the pooled client of :data:`connection`,
+    so the tunnel is only established once per process.
 
     Possible kwargs:
 
@@ -46,76 +165,14 @@ def adrastea(*args, **kwargs):
         @adrastea()
         def foo():
     """
-    def adrastea_inner(func):
-        def ssh_connect(*args2, **kwargs2):
-            with SSHTunnelForwarder((SSH_HOST, SSH_PORT),
-                                    ssh_username=LDAP_USER_NAME,
-                                    ssh_password=LDAP_PASSWORD,
-                                    remote_bind_address=('localhost', MONGODB_PORT),
-                                    local_bind_address=('localhost', MONGODB_PORT)
-                                    ) as server:
-                print('Connected via SSH and established port-forwarding')
-                client = MongoClient(MONGODB_HOST, MONGODB_PORT)
-                try:
-                    client[MONGODB_AUTHENTICATION_DB].authenticate(
-                        MONGODB_USER_NAME, MONGODB_PASSWORD)
-                    env = dict()
-                    env['client'] = client
-                    if "extra_args" in kwargs:
-                        parser = argparse.ArgumentParser()
-                        env.update(vars(kwargs["extra_args"](parser)))
-                    print('Authenticated on mongodb')
-                    print('-' * 70)
-                    print('')
-                    args2 = list(args2)
-                    args2.append(env)
-                    result = func(*args2, **kwargs2)
-                finally:
-                    client.close()
-                    print('')
-                    print('-' * 70)
-                    print('Connection closed')
-
-            return result
-        return ssh_connect
-    return adrastea_inner
+    return connection(extra_args=kwargs.get("extra_args"))
 
 
 def date_parser(series):
-    years = series.apply(lambda x: int(x.split("-")[0]))
-    months = series.apply(lambda x: int(
-        x.split("-")[1]) if len(x.split("-")) > 1 else 0)
-    days = series.apply(lambda x: int(
-        x.split("-")[2]) if len(x.split("-")) > 2 else 0)
-    return years, months, days
-
-try:
-    from line_profiler import LineProfiler
-
-    def do_profile(follow=[]):
-        def inner(func):
-            def profiled_func(*args, **kwargs):
-                try:
-                    profiler = LineProfiler()
-                    profiler.add_function(func)
-                    for f in follow:
-                        profiler.add_function(f)
-                    profiler.enable_by_count()
-                    return func(*args, **kwargs)
-                finally:
-                    profiler.print_stats()
-            return profiled_func
-        return inner
-
-except ImportError:
-    def do_profile(follow=[]):
-        "Helpful if you accidentally leave in production!"
-        def inner(func):
-            def nothing(*args, **kwargs):
-                return func(*args, **kwargs)
-            return nothing
-        return inner
-
+    years, months, days, _ = dateparse.parse(series.values)
+    return (pd.Series(years, index=series.index),
+            pd.Series(months, index=series.index),
+            pd.Series(days, index=series.index))
 
 def deprecated(func):
     '''This is a decorator which can be used to mark functions
@@ -1,4 +1,4 @@
-from distutils.core import setup
+from setuptools import setup
 
 setup(name='EventFlow',
       version='1.0',
@@ -13,5 +13,9 @@ setup(name='EventFlow',
             'shapely>=1.5.17',
             'matplotlib>=2.0.0',
             'pymongo>=3.3.0',
-            'sshtunnel==0.1.2']
+            'sshtunnel==0.1.2'],
+      extras_require={
+            'flows': ['scipy'],
+            'parquet': ['pyarrow'],
+            'test': ['pytest', 'mongomock']}
      )
@@ -0,0 +1,157 @@
+import json
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+import database_setup
+from eventflow import db_queries, util
+
+
+def client(num_actors = 12, num_locations = 9, num_dates = 300):
+    """Small EVENT_TRIPLES and WIKIDATA stand-in on mongomock.
+    Every triple has its own date, so the order of the events is unique."""
+    random.seed(0)
+    client = mongomock.MongoClient()
+    nodes = [{"nodeType": "ACT", "nodeID": a, "nodeLabel": "Q{}".format(100 + a),
+              "WDlabel": "actor{}".format(a)} for a in range(num_actors)]
+    nodes += [{"nodeType": "LOC", "nodeID": 1000 + l,
+               "nodeLabel": "Q{}".format(500 + l)} for l in range(num_locations)]
+    nodes += [{"nodeType": "DAT", "nodeID": 2000 + d,
+               "nodeLabel": "1900-{:02d}-{:02d}".format(d // 28 + 1, d % 28 + 1),
+               "degree": 1}
+              for d in range(num_dates)]
+    client[util.EVENT_TRIPLES]["nodes"].insert_many(nodes)
+    client[util.EVENT_TRIPLES]["triples"].insert_many(
+        [{"actorID": random.randrange(num_actors),
+          "locationID": 1000 + random.randrange(num_locations),
+          "dateID": 2000 + d} for d in range(num_dates)])
+    client[util.WIKIDATA]["WD_NEs"].insert_many(
+        [{"id": 500 + l, "neClass": "LOC", "location_type": "City",
+          "coordinate": ["{} {}".format(l, -l)], "norm_name": "loc{}".format(l)}
+         for l in range(num_locations) if l % 3])
+    return client
+
+
+def edges(client):
+    edges = pd.DataFrame(list(client[util.EVENTFLOW_COLLECTION][util.EVENTFLOW_EDGES].find({}, {"_id": 0})))
+    edges = edges.sort_values(["actorID", "from_date", "to_date"])
+    return edges[sorted(edges.columns)].reset_index(drop = True)
+
+
+def test_build_connections():
+    triples = pd.DataFrame({"locationID": [3, 1, 2],
+                            "year": [1900, 1899, 1900],
+                            "month": [2, 12, 1],
+                            "day": [1, 31, 5]})
+
+    result = database_setup.build_connections(triples)
+
+    assert result.to_dict(orient = "records") == [
+        {"from_node": 1, "to_node": 2,
+         "from_date": "1899-12-31", "to_date": "1900-01-05"},
+        {"from_node": 2, "to_node": 3,
+         "from_date": "1900-01-05", "to_date": "1900-02-01"}]
+
+
+def test_pipeline_resume(tmpdir):
+    serial = client()
+    database_setup.copy_location_nodes(serial, verbose = False)
+    database_setup.create_edge_collection(serial)
+
+    checkpoint = str(tmpdir.join("checkpoint.json"))
+    pipeline = client()
+    database_setup.run_pipeline(pipeline, checkpoint, processes = 1,
+                                partition_size = 5)
+    pd.util.testing.assert_frame_equal(edges(serial), edges(pipeline))
+    # The triples are sorted by actorID with an index
+    assert "actorID_1" in pipeline[util.EVENT_TRIPLES]["triples"].index_information()
+
+    # Forget the last partition and leave a half written state behind
+    with open(checkpoint, "r") as f:
+        manifest = json.load(f)
+    lo, hi = manifest["edges"].pop()
+    with open(checkpoint, "w") as f:
+        json.dump(manifest, f)
+    pipeline[util.EVENTFLOW_COLLECTION][util.EVENTFLOW_EDGES].insert_one({"actorID": lo, "from_node": -1})
+
+    database_setup.run_pipeline(pipeline, checkpoint, processes = 1,
+                                partition_size = 5)
+    pd.util.testing.assert_frame_equal(edges(serial), edges(pipeline))
+    assert [lo, hi] in database_setup.Checkpoint(checkpoint).finished["edges"]
+
+
+def test_get_graph():
+    db = client()
+    database_setup.copy_location_nodes(db, verbose = False)
+    database_setup.create_edge_collection(db)
+    actor_ids = [1, 2, 3]
+
+    nodes, edges = db_queries.get_graph(db, actor_ids)
+
+    # Client side join of the full documents
+    collection = db[util.EVENTFLOW_COLLECTION]
+    all_edges = pd.DataFrame(list(collection[util.EVENTFLOW_EDGES].find(
+        {"actorID": {"$in": actor_ids}}, {"_id": 0})))
+    all_nodes = pd.DataFrame(list(collection[util.EVENTFLOW_NODES].find(
+        {}, {"_id": 0})))
+    expected = all_edges.merge(all_nodes[["locationID", "lat", "lon"]].add_prefix("from_"),
+                               left_on = "from_node", right_on = "from_locationID")
+    expected = expected.merge(all_nodes[["locationID", "lat", "lon"]].add_prefix("to_"),
+                              left_on = "to_node", right_on = "to_locationID")
+    expected = expected.drop(["to_locationID", "from_locationID"], 1)
+
+    columns = [name for name, _ in db_queries.EDGES_COLUMNS]
+    expected = expected[columns].sort_values(columns).reset_index(drop = True)
+    assert edges.from_node.dtype == np.int64
+    pd.util.testing.assert_frame_equal(
+        edges.sort_values(columns).reset_index(drop = True), expected,
+        check_dtype = False)
+    assert set(nodes.locationID) == set(edges.from_node) | set(edges.to_node)
+    assert list(nodes.columns) == [name for name, _ in db_queries.NODES_COLUMNS]
+
+
+
+def test_read_columns_missing_fields():
+    documents = [{"locationID": 1, "label": "a", "lat": 1.},
+                 {"locationID": 2}]
+    frame = db_queries._read_columns(iter(documents), db_queries.NODES_COLUMNS,
+                                     batch_size = 1)
+
+    assert frame.locationID.tolist() == [1, 2]
+    assert frame.label.tolist()[0] == "a" and np.isnan(frame.label.tolist()[1])
+    assert frame.lat.tolist()[0] == 1. and np.isnan(frame.lat.tolist()[1])
+
+    frame = db_queries._read_columns(iter([{"locationID": 1}, {}]),
+                                     [("locationID", np.int64)])
+    assert frame.locationID.dtype == np.float64
+
+def test_create_indexes():
+    db = client()
+    database_setup.create_indexes(db, verbose = False)
+    database_setup.create_indexes(db, verbose = False)
+
+    edge_indexes = db[util.EVENTFLOW_COLLECTION][util.EVENTFLOW_EDGES].index_information()
+    assert edge_indexes["actorID_1_from_date_1"]["key"] == [("actorID", 1), ("from_date", 1)]
+    node_indexes = db[util.EVENT_TRIPLES]["nodes"].index_information()
+    assert {"nodeType_1_nodeID_1", "nodeLabel_1", "WDlabel_1"} <= set(node_indexes)
+    assert "actorID_1" in db[util.EVENT_TRIPLES]["triples"].index_information()
+
+    plan = {"stage": "FETCH",
+            "inputStage": {"stage": "OR",
+                           "inputStages": [{"stage": "IXSCAN"}, {"stage": "COLLSCAN"}]}}
+    assert database_setup._plan_stages(plan) == ["FETCH", "OR", "IXSCAN", "COLLSCAN"]
+
+
+def test_create_indexes_configured_database(monkeypatch):
+    monkeypatch.setattr(util, "EVENTFLOW_COLLECTION", "eventflow_other")
+    db = client()
+    database_setup.copy_location_nodes(db, verbose = False)
+    database_setup.create_indexes(db, verbose = False)
+
+    nodes = db["eventflow_other"][util.EVENTFLOW_NODES]
+    assert nodes.count_documents({}) > 0
+    assert "locationID_1" in nodes.index_information()
@@ -0,0 +1,66 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from eventflow import dateparse
+
+
+def test_parse_full_dates():
+    dates = [datetime.date(1, 1, 1), datetime.date(1899, 12, 31),
+             datetime.date(1900, 2, 28), datetime.date(2016, 2, 29)]
+    years, months, days, ordinals = dateparse.parse(
+        pd.Series([d.isoformat() for d in dates]))
+
+    assert list(years) == [d.year for d in dates]
+    assert list(months) == [d.month for d in dates]
+    assert list(days) == [d.day for d in dates]
+    assert list(ordinals) == [d.toordinal() for d in dates]
+    assert list(dateparse.from_ordinals(ordinals)) == dates
+
+
+def test_parse_partial_dates():
+    years, months, days, ordinals = dateparse.parse(
+        ["1900", "1900-03", "1900-03-04 ", "-44-03-15"])
+
+    assert list(years) == [1900, 1900, 1900, -44]
+    assert list(months) == [0, 3, 3, 3]
+    assert list(days) == [0, 0, 4, 15]
+    assert list(ordinals[:3]) == [datetime.date(1900, 1, 1).toordinal(),
+                                  datetime.date(1900, 3, 1).toordinal(),
+                                  datetime.date(1900, 3, 4).toordinal()]
+    # 400 years before 356-03-15 in the proleptic Gregorian calendar
+    assert ordinals[3] == datetime.date(356, 3, 15).toordinal() - 146097
+
+    with pytest.raises(ValueError):
+        dateparse.parse(["1900-03", "unknown"])
+
+
+def test_ordinals():
+    dates = np.array([datetime.date(1900, 1, 2), datetime.date(1950, 6, 7)])
+
+    assert list(dateparse.ordinals(dates)) == [d.toordinal() for d in dates]
+    assert list(dateparse.ordinals(["1900-01-02", "1950-06-07"])) == \
+        [d.toordinal() for d in dates]
+    assert dateparse.parse_date("1950-06") == datetime.date(1950, 6, 1)
+
+
+def test_historic_dates():
+    ordinals = dateparse.ordinals(["-0300-01-01", "0000-12-31", "0001-01-01"])
+    dates = dateparse.from_ordinals(ordinals)
+
+    assert isinstance(dates[0], dateparse.HistoricDate)
+    assert (dates[0].year, dates[0].month, dates[0].day) == (-300, 1, 1)
+    assert dates[0].isoformat() == "-0300-01-01"
+    assert dates[1].isoformat() == "0000-12-31"
+    assert dates[2] == datetime.date(1, 1, 1)
+    assert dates[0] < dates[1] < dates[2] < datetime.date(1900, 1, 1)
+    assert datetime.date(1, 1, 1) > dates[1]
+    assert list(dateparse.ordinals(dates)) == list(ordinals)
+    assert dateparse.parse_date("-0300") == dates[0]
+
+    years, months, days = dateparse.to_civil(ordinals)
+    assert list(years) == [-300, 0, 1]
+    assert list(months) == [1, 12, 1]
+    assert list(days) == [1, 31, 1]
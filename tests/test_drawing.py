@@ -1,12 +1,16 @@
+import datetime
+
 import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.testing.decorators import image_comparison
+from matplotlib.collections import LineCollection
 import pytest
 
 import eventflow
 from eventflow.util import adrastea
-from eventflow.drawing import GraphLayer
+from eventflow.drawing import GraphLayer, Playback, Edge
 try:
     from mpl_toolkits.basemap import Basemap
     skip_basemap = False
@@ -68,3 +72,90 @@ def test_graph_layer_w_basemap():
     return drawing()
 
 
+def test_playback_frames():
+    nodes = pd.DataFrame({"label": ["a", "b", "c"], "WDid": ["Q1", "Q2", "Q3"],
+                          "lat": [0., 10., 20.], "lon": [0., 10., 20.]},
+                         index = pd.Index([0, 1, 2], name = "locationID"))
+    edges = pd.DataFrame({"actorID": [1, 1], "from_node": [0, 1],
+                          "from_date": ["1900-01-01", "1900-01-11"],
+                          "to_node": [1, 2],
+                          "to_date": ["1900-01-11", "1900-01-21"]})
+    graph = eventflow.EventGraph(nodes, edges)
+
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    axes = fig.add_subplot(111)
+    playback = Playback(axes, [(1, graph)], window = 10, step = 10)
+
+    def drawn_edges():
+        return [a for a in axes.get_children() if isinstance(a, Edge)]
+
+    assert playback.num_frames == 2
+
+    start, end = playback.show_frame(0)
+    assert start == datetime.date(1900, 1, 1)
+    assert end == datetime.date(1900, 1, 11)
+    assert [e.to_node for e in drawn_edges()] == [1]
+
+    playback.show_frame(1)
+    assert [e.to_node for e in drawn_edges()] == [2]
+
+    playback.show_frame(0)
+    assert [e.to_node for e in drawn_edges()] == [1]
+
+    playback.remove()
+    assert drawn_edges() == []
+
+
+def test_graph_layer_flows():
+    flows = pd.DataFrame({"from_node": [0, 1, 2], "to_node": [1, 0, 0],
+                          "weight": [4, 1, 2], "actors": [2, 1, 1],
+                          "from_lat": [0., 10., float("nan")], "from_lon": [0., 10., 20.],
+                          "to_lat": [10., 0., 0.], "to_lon": [10., 0., 0.]})
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    axes = fig.add_subplot(111)
+    layer = GraphLayer(axes)
+
+    layer.show_flows(flows, max_width = 4.)
+    lines = [c for c in axes.collections if isinstance(c, LineCollection)]
+    assert len(lines) == 1
+    assert [s.tolist() for s in lines[0].get_segments()] == [
+        [[10., 10.], [0., 0.]], [[0., 0.], [10., 10.]]]
+    assert list(lines[0].get_linewidths()) == [1.375, 4.]
+
+    layer.show_flows(flows, min_weight = 2)
+    lines = [c for c in axes.collections if isinstance(c, LineCollection)]
+    assert len(lines) == 1 and len(lines[0].get_segments()) == 1
+
+    layer.hide_flows()
+    assert not [c for c in axes.collections if isinstance(c, LineCollection)]
+
+
+def test_graph_layer_follow():
+    nodes = pd.DataFrame({"label": ["a", "b", "c"], "WDid": ["Q1", "Q2", "Q3"],
+                          "lat": [0., 10., 20.], "lon": [0., 10., 20.]},
+                         index = pd.Index([0, 1, 2], name = "locationID"))
+    edges = pd.DataFrame({"actorID": [1, 1, 1], "from_node": [0, 1, 2],
+                          "from_date": ["1900-01-01", "1900-01-11", "1900-01-21"],
+                          "to_node": [1, 2, 0],
+                          "to_date": ["1900-01-11", "1900-01-21", "1900-01-31"]})
+    graph = eventflow.EventGraph(nodes, edges.iloc[:1].copy())
+    graph.build("1900-01-01", "1900-12-31")
+
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    axes = fig.add_subplot(111)
+    layer = GraphLayer(axes)
+    layer.update(graph, actorID = 1)
+    layer.follow(graph, 1)
+
+    def drawn_edges():
+        return [(a.from_node, a.to_node) for a in axes.get_children() if isinstance(a, Edge)]
+
+    graph.append(nodes, edges.iloc[1:2].copy())
+    assert drawn_edges() == [(0, 1), (1, 2)]
+
+    layer.unfollow()
+    graph.append(nodes, edges.iloc[2:].copy())
+    assert drawn_edges() == [(0, 1), (1, 2)]
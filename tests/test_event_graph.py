@@ -166,3 +166,153 @@ def test_event_graph_errors():
     with pytest.raises(eventflow.EventGraphError):
         eventflow.EventGraph(nodes, edges)
     
+
+def test_event_graph_stays():
+    nodes = pd.DataFrame({"label": ["a", "b", "c"], "WDid": ["Q1", "Q2", "Q3"],
+                          "lat": [0., 10., 20.], "lon": [0., 10., 20.]},
+                         index = pd.Index([0, 1, 2], name = "locationID"))
+    edges = pd.DataFrame({"actorID": [1, 1, 1, 1], "from_node": [0, 1, 1, 2],
+                          "from_date": ["1900-01-01", "1900-01-05",
+                                        "1900-01-09", "1900-02-01"],
+                          "to_node": [1, 1, 2, 1],
+                          "to_date": ["1900-01-05", "1900-01-09",
+                                      "1900-02-01", "1900-02-11"]})
+    e = eventflow.EventGraph(nodes, edges)
+
+    day = lambda *d: datetime.date(*d).toordinal()
+    stays = e.stays
+    assert stays.locationID.tolist() == [0, 1, 2, 1]
+    assert stays.arrival.tolist() == [day(1900, 1, 1), day(1900, 1, 5),
+                                      day(1900, 2, 1), day(1900, 2, 11)]
+    assert stays.duration.tolist() == [0, 4, 0, 0]
+
+    stats = e.stay_statistics()
+    assert stats.loc[1, "visits"] == 2
+    assert stats.loc[1, "total_time"] == 4
+    assert stats.loc[1, "last_visit"] == day(1900, 2, 11)
+
+    e.build("1900-01-07", "1900-02-05", False, False)
+    assert e.stays.locationID.tolist() == [1, 2]
+    assert e.stays.arrival.tolist() == [day(1900, 1, 7), day(1900, 2, 1)]
+
+
+def test_event_graph_empty_active_set():
+    graph = eventflow.EventGraph(*eventflow.empty_graph_data())
+    assert graph.empty
+    assert graph.stays.empty
+    graph._node_population()
+
+    nodes = pd.DataFrame({"label": ["a", "b", "c"], "WDid": ["Q1", "Q2", "Q3"],
+                          "lat": [0., 10., 20.], "lon": [0., 10., 20.]},
+                         index = pd.Index([0, 1, 2], name = "locationID"))
+    first = eventflow.EventGraph(nodes, pd.DataFrame({
+        "actorID": [1], "from_node": [0], "to_node": [1],
+        "from_date": ["1900-01-01"], "to_date": ["1900-01-05"]}))
+    second = eventflow.EventGraph(nodes, pd.DataFrame({
+        "actorID": [2], "from_node": [1], "to_node": [2],
+        "from_date": ["1900-01-01"], "to_date": ["1900-01-05"]}))
+    assert first.build().intersect(second).empty
+
+    # Colors are added to the active set only
+    first.build()
+    assert "color" in first.edges
+    assert "color" not in first.all_edges
+
+
+def test_event_graph_historic_dates():
+    nodes = pd.DataFrame({"label": ["a", "b"], "WDid": ["Q1", "Q2"],
+                          "lat": [0., 10.], "lon": [0., 10.]},
+                         index = pd.Index([0, 1], name = "locationID"))
+    edges = pd.DataFrame({"actorID": [1, 1], "from_node": [0, 1], "to_node": [1, 0],
+                          "from_date": ["-0300-01-01", "-0290-01-01"],
+                          "to_date": ["-0290-01-01", "0010-01-01"]})
+    graph = eventflow.EventGraph(nodes, edges)
+
+    assert graph.min_date.isoformat() == "-0300-01-01"
+    assert graph.max_date == datetime.date(10, 1, 1)
+    assert len(graph.build("-0295", "0100").edges) == 1
+
+def test_event_graph_intersect():
+    nodes = pd.DataFrame({"label": ["a", "b", "c"], "WDid": ["Q1", "Q2", "Q3"],
+                          "lat": [0., 10., 20.], "lon": [0., 10., 20.]},
+                         index = pd.Index([0, 1, 2], name = "locationID"))
+    edges = pd.DataFrame({"actorID": [1, 1], "from_node": [0, 1], "to_node": [1, 2],
+                          "from_date": ["1900-01-01", "1900-01-05"],
+                          "to_date": ["1900-01-05", "1900-01-09"]})
+    first = eventflow.EventGraph(nodes, edges.copy()).build()
+    second = eventflow.EventGraph(nodes, edges.iloc[1:].copy())
+
+    common = first.intersect(second)
+
+    assert list(common.all_edges.from_node) == [1]
+    assert sorted(common.all_nodes.index) == [1, 2]
+
+def test_event_graph_append():
+    nodes = pd.DataFrame({"label": ["a", "b", "c", "d"], "WDid": ["Q1", "Q2", "Q3", "Q4"],
+                          "lat": [0., 10., 20., 30.], "lon": [0., 10., 20., 30.]},
+                         index = pd.Index([0, 1, 2, 3], name = "locationID"))
+    edges = pd.DataFrame({"actorID": [1, 1, 1, 1], "from_node": [0, 1, 1, 2],
+                          "to_node": [1, 1, 2, 3],
+                          "from_date": ["1900-01-01", "1900-01-05", "1900-01-09", "1900-02-01"],
+                          "to_date": ["1900-01-05", "1900-01-09", "1900-02-01", "1900-03-01"]})
+
+    def stays(graph):
+        return graph.stays.values.tolist()
+
+    frame = ("1900-01-01", "1900-03-01")
+    # Appended after the known edges to an open or a fixed time frame,
+    # inserted before a known edge
+    for split, dates, refreshed in [(2, (), True), (2, frame, False), (3, frame, True)]:
+        order = [0, 1, 3, 2] if split == 3 else [0, 1, 2, 3]
+        known, new = edges.iloc[order[:split]], edges.iloc[order[split:]]
+        complete = eventflow.EventGraph(nodes, edges.copy()).build(*dates)
+        graph = eventflow.EventGraph(nodes.loc[np.unique(known[["from_node", "to_node"]].values)],
+                                     known.copy()).build(*dates)
+        notified = []
+        graph.subscribe(lambda g, e, refreshed: notified.append((len(e), refreshed)))
+
+        added = graph.append(nodes, new)
+
+        assert notified == [(len(added), refreshed)]
+        assert len(added) == (4 if refreshed else 2)
+        assert graph.edges.from_node.tolist() == complete.edges.from_node.tolist()
+        assert graph.edges.from_date.tolist() == complete.edges.from_date.tolist()
+        assert graph.edges.color.tolist() == complete.edges.color.tolist()
+        assert graph.edges.index.is_unique
+        assert sorted(graph.nodes.index) == sorted(complete.nodes.index)
+        assert_frame_equal(graph.nodes.sort_index(), complete.nodes.sort_index())
+        assert stays(graph) == stays(complete)
+        assert graph.all_stays.values.tolist() == complete.all_stays.values.tolist()
+        assert graph.max_date == datetime.date(1900, 3, 1)
+
+    graph = eventflow.EventGraph(nodes, edges.iloc[:2].copy())
+    graph.build("1900-01-01", "1900-01-10")
+    added = graph.append(nodes, edges.iloc[2:].copy())
+    assert added.empty
+    assert graph.edges.from_node.tolist() == [0, 1]
+    assert graph.all_edges.from_node.tolist() == [0, 1, 1, 2]
+
+
+def test_event_graph_fingerprint():
+    nodes = pd.DataFrame({"label": ["a", "b", "c"], "WDid": ["Q1", "Q2", "Q3"],
+                          "lat": [0., 10., 20.], "lon": [0., 10., 20.]},
+                         index = pd.Index([0, 1, 2], name = "locationID"))
+    edges = pd.DataFrame({"actorID": [1, 1], "from_node": [0, 1],
+                          "from_date": ["1900-01-01", "1900-01-05"],
+                          "to_node": [1, 2], "to_date": ["1900-01-05", "1900-01-09"]})
+    graph = eventflow.EventGraph(nodes, edges.copy())
+    fingerprint = graph.fingerprint
+
+    assert len(fingerprint) == 2 * eventflow.core.FINGERPRINT_SIZE
+    assert eventflow.EventGraph(nodes.iloc[::-1], edges.copy()).fingerprint == fingerprint
+    # The time frame is not part of the fingerprint, but of the equality
+    framed = eventflow.EventGraph(nodes, edges.copy()).build("1900-01-01", "1900-01-05")
+    assert framed.fingerprint == fingerprint and framed != graph
+    moved = nodes.copy()
+    moved.loc[2, "lat"] = 21.
+    assert eventflow.EventGraph(moved, edges.copy()) != graph
+    assert eventflow.EventGraph(nodes, edges.iloc[:1].copy()) != graph
+
+    graph.append(nodes, pd.DataFrame({"actorID": [1], "from_node": [2], "to_node": [0],
+                                      "from_date": ["1900-01-09"], "to_date": ["1900-02-01"]}))
+    assert graph.fingerprint != fingerprint
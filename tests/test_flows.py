@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import eventflow
+from eventflow import flows, storage
+
+
+def graph(actorID, stops, dates):
+    nodes = pd.DataFrame({"locationID": [10, 20, 30, 40], "label": ["a", "b", "c", "d"],
+                          "WDid": ["Q1", "Q2", "Q3", "Q4"],
+                          "lat": [0., 10., 20., 30.], "lon": [0., 10., 20., 30.]})
+    edges = pd.DataFrame({"actorID": [actorID] * (len(stops) - 1),
+                          "from_node": stops[:-1], "from_date": dates[:-1],
+                          "to_node": stops[1:], "to_date": dates[1:]})
+    return eventflow.EventGraph(nodes, edges)
+
+
+def store():
+    store = storage.SQLiteStore(":memory:")
+    store.load(None, None, pd.DataFrame({"actorID": [1, 2, 3], "WDid": ["Q11", "Q12", "Q13"],
+                                         "name": ["a", "b", "c"]}))
+    return store
+
+
+def test_location_index():
+    index = flows.LocationIndex([30, 10])
+    index.add([20, 10, 5])
+    assert list(index.ids) == [10, 30, 5, 20]
+    assert list(index.positions([5, 10, 20, 30, 7, 99])) == [2, 0, 3, 1, -1, -1]
+    assert list(flows.LocationIndex().positions([1])) == [-1]
+
+
+def test_transition_matrix():
+    pytest.importorskip("scipy")
+    index = flows.LocationIndex()
+    first = graph(1, [10, 20, 10, 20],
+                  ["1800-01-01", "1800-02-01", "1800-03-01", "1800-04-01"])
+    second = graph(2, [20, 30], ["1800-01-15", "1800-02-15"])
+
+    matrix = first.transition_matrix(index=index)
+    assert list(index.ids) == [10, 20]
+    assert matrix.toarray().tolist() == [[0, 2], [1, 0]]
+    window = first.transition_matrix("1800-02-01", "1800-03-01", index)
+    assert window.toarray().tolist() == [[0, 0], [1, 0]]
+    assert first.transition_matrix("1800-02-01", "1800-03-01", index) is window
+
+    second.transition_matrix(index=index)
+    assert first.transition_matrix(index=index).shape == (3, 3)
+    assert first.memory_usage()["transitions"] > 0
+
+    gc = eventflow.GraphCollection([], store())
+    gc.add(eventflow.Actor(1, gc.client), first)
+    gc.add(eventflow.Actor(2, gc.client), second)
+    total = gc.transition_matrix(index=index)
+    assert total.toarray().tolist() == [[0, 2, 0], [1, 0, 1], [0, 0, 0]]
+    normalized = gc.transition_matrix(normalize=True, index=index).toarray()
+    assert np.allclose(normalized, [[0, 1, 0], [0.5, 0, 0.5], [0, 0, 0]])
+    assert gc.transition_matrix(index=index) is total
+    gc.remove_actor(2)
+    assert gc.transition_matrix(index=index).toarray().tolist() == [
+        [0, 2, 0], [1, 0, 0], [0, 0, 0]]
+    assert flows.total([], 2).toarray().tolist() == [[0, 0], [0, 0]]
+
+    assert np.allclose(flows.matrix_power(total.astype(float), 2).toarray(),
+                       total.dot(total).toarray())
+    assert flows.reachability(total, 1).toarray().tolist() == (total > 0).toarray().tolist()
+    assert flows.reachability(total, 3).toarray().tolist() == [
+        [True, True, True], [True, True, True], [False, False, False]]
+
+
+def test_od_flows():
+    first = graph(1, [10, 20, 10, 20],
+                  ["1800-01-01", "1800-02-01", "1800-03-01", "1800-04-01"])
+    second = graph(2, [20, 20, 10], ["1800-01-15", "1800-02-15", "1800-03-15"])
+    gc = eventflow.GraphCollection([], store())
+    gc.add(eventflow.Actor(1, gc.client), first)
+    gc.add(eventflow.Actor(2, gc.client), second)
+
+    def pairs(frame):
+        return [tuple(row) for row in frame[["from_node", "to_node", "weight", "actors"]].values]
+
+    assert pairs(gc.od_flows()) == [(10, 20, 2, 1), (20, 10, 2, 2)]
+    result = gc.od_flows(end_date="1800-03-01")
+    assert pairs(result) == [(10, 20, 1, 1), (20, 10, 1, 1)]
+    assert list(result.columns) == flows.FLOWS_COLUMNS
+    assert result.to_lat.tolist() == [10., 0.]
+
+    third = graph(3, [30, 10], ["1800-01-01", "1800-01-02"])
+    gc.add(eventflow.Actor(3, gc.client), third)
+    assert pairs(gc.od_flows(end_date="1800-03-01")) == [
+        (10, 20, 1, 1), (20, 10, 1, 1), (30, 10, 1, 1)]
+    gc.remove_actor(1)
+    assert pairs(gc.od_flows(end_date="1800-03-01")) == [(30, 10, 1, 1)]
+    assert pairs(gc.od_flows()) == [(20, 10, 1, 1), (30, 10, 1, 1)]
+
+    fresh = flows.ODFlows(index=flows.LocationIndex())
+    fresh.add(2, second)
+    fresh.add(3, third)
+    assert pairs(fresh.flows()) == pairs(gc.od_flows())
+    assert pairs(flows.ODFlows().flows()) == []
+
+
+def test_od_flows_cached_only():
+    loaded = []
+
+    def load_function(client, actorID):
+        loaded.append(actorID)
+        fetched = graph(actorID, [10, 20], ["1800-01-01", "1800-01-02"])
+        return fetched.all_nodes.reset_index(), fetched.all_edges
+
+    gc = eventflow.GraphCollection([1, 2], store(), load_function)
+    gc.add(eventflow.Actor(1, gc.client), graph(1, [20, 30], ["1800-01-01", "1800-01-02"]))
+
+    result = gc.od_flows(fetch=False)
+    assert result[["from_node", "to_node", "weight"]].values.tolist() == [[20, 30, 1]]
+    assert loaded == []
+    assert len(gc.od_flows()) == 2 and loaded == [2]
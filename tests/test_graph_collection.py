@@ -11,6 +11,7 @@ import eventflow
 from eventflow.util import adrastea
 from eventflow import util
 from eventflow import db_queries
+from eventflow import storage
 
 
 @adrastea()
@@ -69,3 +70,190 @@ def test_graph_collection_cache(env):
     graph_c = gc.get_cache_entry(actorID)
 
     assert graph == graph_c
+
+def test_graph_collection_visits():
+    nodes = pd.DataFrame({"label": ["a", "b", "c"], "WDid": ["Q1", "Q2", "Q3"],
+                          "lat": [0., 10., 20.], "lon": [0., 10., 20.]},
+                         index = pd.Index([0, 1, 2], name = "locationID"))
+    edges = pd.DataFrame({"actorID": [1, 1, 1], "from_node": [0, 1, 1],
+                          "from_date": ["1900-01-01", "1900-01-05", "1900-01-09"],
+                          "to_node": [1, 1, 2],
+                          "to_date": ["1900-01-05", "1900-01-09", "1900-02-01"]})
+    actor = eventflow.Actor(1)
+    actor.id = 1
+    actor.name = "a"
+
+    gc = eventflow.GraphCollection([], None)
+    gc.add(actor, eventflow.EventGraph(nodes, edges))
+
+    assert gc.visits(1) == [(actor, datetime.date(1900, 1, 5),
+                             datetime.date(1900, 1, 9))]
+    assert gc.visits(1, start_date = "1900-01-10") == []
+    assert gc.visits(2, end_date = "1900-01-31") == []
+    assert len(gc.visits(0)) == 1
+
+    gc.remove_actor(1)
+    assert gc.visits(1) == []
+
+def test_actor_cache():
+    store = storage.SQLiteStore(":memory:")
+    store.load(None, None, pd.DataFrame({"actorID": [1, 2], "WDid": ["Q11", "Q12"],
+                                         "name": ["a", "b"]}))
+    queries = []
+    actor_query = store._actor
+    store._actor = lambda field, value: queries.append(field) or actor_query(field, value)
+    eventflow.Actor.clear_cache()
+
+    actor = eventflow.Actor("Q11", store)
+    assert (actor.id, actor.WDid, actor.name) == (1, "11", "a")
+    assert [eventflow.Actor(a, store).id for a in [1, " 1", "Q11", "a"]] == [1] * 4
+    assert eventflow.Actor("b", store).id == 2
+    assert queries == ["WDid", "name"]
+
+    assert eventflow.Actor("c", store).id == -1
+    assert eventflow.Actor("c", store).id == -1
+    assert queries == ["WDid", "name", "name", "name"]
+    assert not hasattr(actor, "__dict__")
+
+    # Every client has its own actors, an ambiguous name keeps the actor
+    # of the name lookup
+    other = storage.SQLiteStore(":memory:")
+    other.load(None, None, pd.DataFrame({"actorID": [1, 3], "WDid": ["Q21", "Q23"],
+                                         "name": ["x", "x"]}))
+    assert eventflow.Actor(1, other).name == "x"
+    assert eventflow.Actor("a", store).id == 1
+    first = eventflow.Actor("x", other).id
+    eventflow.Actor(4 - first, other)
+    assert eventflow.Actor("x", other).id == first
+
+    # Numbers are truncated like int(), numeric strings with a fraction are names
+    assert eventflow.Actor(1.5, store).id == 1
+    assert eventflow.Actor("1.5", store).id == -1
+
+def test_actor_cache_unhashable_client():
+    # Like pymongo.MongoClient, which defines __eq__ without __hash__
+    class Store(storage.SQLiteStore):
+        __hash__ = None
+
+    store = Store(":memory:")
+    store.load(None, None, pd.DataFrame({"actorID": [1], "WDid": ["Q11"],
+                                         "name": ["a"]}))
+    eventflow.Actor.clear_cache()
+    assert eventflow.Actor("Q11", store).id == 1
+    assert eventflow.Actor("a", store).id == 1
+    assert len(eventflow.core._actor_cache._entries) == 3
+
+    # The cache does not keep the client alive
+    import gc
+    del store
+    gc.collect()
+    assert len(eventflow.core._actor_cache._entries) == 0
+
+def test_cache_statistics():
+    store = storage.SQLiteStore(":memory:")
+    store.load(None, None, pd.DataFrame({"actorID": [1, 2], "WDid": ["Q11", "Q12"],
+                                         "name": ["a", "b"]}))
+    nodes = pd.DataFrame({"locationID": [0, 1], "label": ["a", "b"],
+                          "WDid": ["Q1", "Q2"], "lat": [0., 10.], "lon": [0., 10.]})
+    edges = pd.DataFrame({"actorID": [1], "from_node": [0], "from_date": ["1900-01-01"],
+                          "to_node": [1], "to_date": ["1900-01-05"]})
+    load_function = lambda client, actorID: (nodes.copy(), edges.copy())
+
+    gc = eventflow.GraphCollection([1, 2], store, load_function)
+    list(gc.graphs())
+    list(gc.graphs())
+    stats = gc.cache_statistics()
+
+    assert (stats["graphs"], stats["hits"], stats["misses"]) == (2, 2, 2)
+    assert stats["hit_ratio"] == 0.5
+    assert sum(count for _, count in stats["load_histogram"]) == 2
+    assert stats["load_histogram"][-1][0] == float("inf")
+
+    usage = gc.get_cache_entry(1).memory_usage()
+    assert usage["edges"] > 0 and usage["reduced_edges"] > 0
+    assert usage["total"] == sum(v for k, v in usage.items() if k != "total")
+    assert stats["memory"] == {1: usage["total"], 2: usage["total"]}
+    assert stats["total_memory"] == 2 * usage["total"]
+
+    gc.get_cache_entry(1).build("1900-01-02", "1900-01-04")
+    assert gc.get_cache_entry(1).memory_usage()["reduced_edges"] < usage["reduced_edges"]
+
+def test_memory_usage_cached(monkeypatch):
+    nodes = pd.DataFrame({"locationID": [0, 1], "label": ["a", "b"],
+                          "WDid": ["Q1", "Q2"], "lat": [0., 10.], "lon": [0., 10.]})
+    edges = pd.DataFrame({"actorID": [1], "from_node": [0], "from_date": ["1900-01-01"],
+                          "to_node": [1], "to_date": ["1900-01-05"]})
+    graph = eventflow.EventGraph(nodes, edges)
+    sizes = []
+    frame_bytes = eventflow.core._frame_bytes
+    monkeypatch.setattr(eventflow.core, "_frame_bytes",
+                        lambda *args: sizes.append(1) or frame_bytes(*args))
+
+    usage = graph.memory_usage()
+    usage["total"] = 0
+    assert graph.memory_usage()["total"] > 0
+    assert len(sizes) == 6
+
+    graph.append(nodes, pd.DataFrame({"actorID": [1], "from_node": [1],
+                                      "from_date": ["1900-01-05"], "to_node": [0],
+                                      "to_date": ["1900-01-09"]}))
+    assert graph.memory_usage()["edges"] > usage["edges"]
+    graph.build()
+    graph.memory_usage()
+    assert len(sizes) == 18
+
+def test_graph_collection_append():
+    nodes = pd.DataFrame({"label": ["a", "b", "c"], "WDid": ["Q1", "Q2", "Q3"],
+                          "lat": [0., 10., 20.], "lon": [0., 10., 20.]},
+                         index = pd.Index([0, 1, 2], name = "locationID"))
+    edges = pd.DataFrame({"actorID": [1, 1], "from_node": [0, 1],
+                          "from_date": ["1900-01-01", "1900-01-05"],
+                          "to_node": [1, 2], "to_date": ["1900-01-05", "1900-01-09"]})
+    actor = eventflow.Actor(1)
+    actor.id = 1
+    actor.name = "a"
+
+    gc = eventflow.GraphCollection([], None)
+    assert gc.append(1, nodes, edges.iloc[1:].copy()) is None
+    gc.add(actor, eventflow.EventGraph(nodes, edges.iloc[:1].copy()))
+    assert gc.visits(2) == []
+
+    gc.append(1, nodes, edges.iloc[1:].copy())
+    assert gc.get_cache_entry(1).all_edges.to_node.tolist() == [1, 2]
+    assert gc.visits(2) == [(actor, datetime.date(1900, 1, 9), datetime.date(1900, 1, 9))]
+
+
+def test_graph_collection_fingerprints():
+    nodes = pd.DataFrame({"label": ["a", "b"], "WDid": ["Q1", "Q2"],
+                          "lat": [0., 10.], "lon": [0., 10.]},
+                         index = pd.Index([0, 1], name = "locationID"))
+    edges = pd.DataFrame({"actorID": [1], "from_node": [0], "from_date": ["1900-01-01"],
+                          "to_node": [1], "to_date": ["1900-01-05"]})
+    actor = eventflow.Actor(1)
+    actor.id = 1
+    graph = eventflow.EventGraph(nodes, edges.copy())
+
+    gc = eventflow.GraphCollection([], None)
+    gc.add(actor, graph)
+    same = eventflow.EventGraph(nodes, edges.copy())
+    gc.add(actor, same)
+    assert gc.get_cache_entry(1) is same
+    assert gc.fingerprints() == {1: graph.fingerprint}
+
+    # Coordinates are compared with a tolerance, the rest exactly
+    moved = nodes.copy()
+    moved.lat += 1e-12
+    assert eventflow.EventGraph(moved, edges.copy()) == graph
+    assert eventflow.EventGraph(moved, edges.copy()).fingerprint != graph.fingerprint
+    moved.lat += 1.
+    assert eventflow.EventGraph(moved, edges.copy()) != graph
+    moved = nodes.copy()
+    moved.label = ["a", "c"]
+    assert eventflow.EventGraph(moved, edges.copy()) != graph
+
+    # Like the active sets, the time frame is compared
+    other = eventflow.EventGraph(nodes, edges.copy())
+    other.build("1900-01-02", "1900-01-04")
+    assert other != graph and other.fingerprint == graph.fingerprint
+    graph.build("1900-01-02", "1900-01-04")
+    assert other == graph
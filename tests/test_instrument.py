@@ -0,0 +1,66 @@
+import json
+
+from eventflow import instrument
+
+
+def test_instrument(tmpdir):
+    instrument.reset()
+    instrument.disable()
+
+    @instrument.traced("work")
+    def work(n):
+        return sum(range(n))
+
+    with instrument.span("outer"):
+        work(10)
+    instrument.count("calls")
+    assert instrument.summary() == {}
+    assert instrument.counters() == {}
+
+    instrument.enable()
+    try:
+        start = instrument.mark()
+        with instrument.span("outer", actorID=3):
+            assert work(10) == 45
+            work(10)
+        instrument.count("calls")
+        instrument.count("calls", 2)
+    finally:
+        instrument.disable()
+
+    totals = instrument.summary(start)
+    assert list(totals) == ["outer", "work"]
+    assert totals["work"][1] == 2
+    assert totals["outer"][0] >= totals["work"][0]
+    assert instrument.counters() == {"calls": 3}
+    assert instrument.format_summary(totals, limit=1).startswith("outer ")
+    assert instrument.summary(instrument.mark()) == {}
+
+    filename = str(tmpdir.join("trace.json"))
+    instrument.export_chrome_trace(filename)
+    with open(filename, "r") as f:
+        trace = json.load(f)["traceEvents"]
+    spans = [e for e in trace if e["ph"] == "X"]
+    assert [e["name"] for e in spans] == ["work", "work", "outer"]
+    assert spans[-1]["args"] == {"actorID": 3}
+    assert [e["args"] for e in trace if e["ph"] == "C"] == [{"calls": 3}]
+    instrument.reset()
+
+
+def test_instrument_bounded(monkeypatch):
+    instrument.reset()
+    monkeypatch.setattr(instrument, "_events", instrument.deque(maxlen=2))
+    instrument.enable()
+    try:
+        start = instrument.mark()
+        for _ in range(3):
+            with instrument.span("work"):
+                pass
+    finally:
+        instrument.disable()
+
+    # Only the last events are kept, the totals count all of them
+    assert len(instrument._events) == 2
+    assert instrument.summary(start)["work"][1] == 3
+    assert instrument.summary()["work"][1] == 3
+    instrument.reset()
@@ -0,0 +1,128 @@
+import pytest
+
+pytest.importorskip("mongomock")
+
+import database_setup
+import eventflow
+from eventflow import db_queries, util
+from eventflow.invalidation import Invalidator
+
+from test_database_setup import client
+
+
+def collection(db, actor_ids):
+    gc = eventflow.GraphCollection([], db)
+    for actor_id in actor_ids:
+        actor = eventflow.Actor(actor_id)
+        actor.id = actor_id
+        gc.add(actor, eventflow.EventGraph(*db_queries.get_graph(db, actor_id)))
+    return gc
+
+
+def test_invalidator_polling():
+    db = client()
+    database_setup.copy_location_nodes(db, verbose = False)
+    database_setup.create_edge_collection(db)
+    edges = db[util.EVENTFLOW_COLLECTION][util.EVENTFLOW_EDGES]
+    nodes = db[util.EVENTFLOW_COLLECTION][util.EVENTFLOW_NODES]
+    gc = collection(db, [1, 2])
+    reported = []
+    invalidator = Invalidator(gc, db, interval = 60, callback = reported.append)
+
+    # mongomock has no change streams
+    assert invalidator.start() == "polling"
+    invalidator.stop()
+    assert invalidator.poll() == set()
+
+    edge = edges.find_one({"actorID": 1}, {"_id": 0})
+    edges.insert_one(dict(edge, from_date = "1950-01-01", to_date = "1950-02-01"))
+    assert invalidator.poll() == {1}
+    assert gc.cached_actor_ids == [2]
+    assert reported == [{1}]
+
+    location_id = gc.get_cache_entry(2).all_edges.from_node.iloc[0]
+    nodes.update_one({"locationID": int(location_id)}, {"$set": {"lat": 89.}})
+    assert invalidator.poll() == {2}
+    assert gc.cached_actor_ids == []
+    assert [a.id for a, _ in gc.graphs()] == [1, 2]
+    assert gc.get_cache_entry(1).max_date.year == 1950
+
+
+def test_invalidator_changes():
+    db = client()
+    database_setup.copy_location_nodes(db, verbose = False)
+    database_setup.create_edge_collection(db)
+    edges = db[util.EVENTFLOW_COLLECTION][util.EVENTFLOW_EDGES]
+    gc = collection(db, [1, 2])
+    invalidator = Invalidator(gc, db)
+    num_edges = len(gc.get_cache_entry(1).all_edges)
+
+    edge = edges.find_one({"actorID": 1})
+    new_edge = dict(edge, from_date = "1950-01-01", to_date = "1950-02-01")
+    assert invalidator.process({"operationType": "insert", "fullDocument": new_edge},
+                               util.EVENTFLOW_EDGES) == {1}
+    assert len(gc.get_cache_entry(1).all_edges) == num_edges + 1
+    assert invalidator.process({"operationType": "insert",
+                                "fullDocument": dict(edge, actorID = 7)},
+                               util.EVENTFLOW_EDGES) == set()
+
+    assert invalidator.process({"operationType": "update", "fullDocument": edge},
+                               util.EVENTFLOW_EDGES) == {1}
+    assert gc.cached_actor_ids == [2]
+
+    node = {"locationID": int(gc.get_cache_entry(2).all_edges.to_node.iloc[0])}
+    assert invalidator.process({"operationType": "insert", "fullDocument": node},
+                               util.EVENTFLOW_NODES) == set()
+    assert invalidator.process({"operationType": "replace", "fullDocument": node},
+                               util.EVENTFLOW_NODES) == {2}
+
+    # Deletes only drop the graph of the edge or the visitors of the node
+    gc = collection(db, [1, 2])
+    invalidator.gc = gc
+    # Like start, before any change
+    invalidator._track()
+    edges.delete_one({"_id": edge["_id"]})
+    assert invalidator.process({"operationType": "delete", "documentKey": {"_id": edge["_id"]}},
+                               util.EVENTFLOW_EDGES) == {1}
+    assert gc.cached_actor_ids == [2]
+    node = db[util.EVENTFLOW_COLLECTION][util.EVENTFLOW_NODES].find_one(node)
+    assert invalidator.process({"operationType": "delete", "documentKey": {"_id": node["_id"]}},
+                               util.EVENTFLOW_NODES) == {2}
+
+    # Graphs cached after the delete do not know the edge, it may
+    # belong to any of them
+    gc = collection(db, [1, 2])
+    invalidator.gc = gc
+    assert invalidator.process({"operationType": "delete", "documentKey": {"_id": edge["_id"]}},
+                               util.EVENTFLOW_EDGES) == {1, 2}
+
+    # An update, which moves an edge to another actor, affects both
+    gc = collection(db, [1, 2])
+    invalidator.gc = gc
+    invalidator._track()
+    edge = edges.find_one({"actorID": 1})
+    assert invalidator.process({"operationType": "update",
+                                "fullDocument": dict(edge, actorID = 2)},
+                               util.EVENTFLOW_EDGES) == {1, 2}
+
+
+def test_invalidator_follow_errors():
+    db = client()
+    database_setup.copy_location_nodes(db, verbose = False)
+    database_setup.create_edge_collection(db)
+    gc = collection(db, [1, 2])
+    reported = []
+    invalidator = Invalidator(gc, db, callback = reported.append)
+    processed = []
+
+    def process(change, name):
+        if change == "bad":
+            raise KeyError(change)
+        processed.append(change)
+
+    # The stream is followed further, but nothing cached can be trusted
+    invalidator.process = process
+    invalidator._follow((util.EVENTFLOW_EDGES, iter(["bad", "good"])))
+    assert processed == ["good"]
+    assert gc.cached_actor_ids == []
+    assert reported == [{1, 2}]
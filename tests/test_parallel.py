@@ -0,0 +1,91 @@
+import operator
+
+import pandas as pd
+
+import eventflow
+from eventflow import parallel
+
+
+def graph(actorID, stops, dates):
+    nodes = pd.DataFrame({"locationID": [10, 20, 30], "label": ["a", "b", "c"],
+                          "WDid": ["Q1", "Q2", "Q3"],
+                          "lat": [0., 10., 20.], "lon": [0., 10., 20.]})
+    edges = pd.DataFrame({"actorID": [actorID] * (len(stops) - 1),
+                          "from_node": stops[:-1], "from_date": dates[:-1],
+                          "to_node": stops[1:], "to_date": dates[1:]})
+    for prefix in ["from", "to"]:
+        coordinates = [(stop - 10) / 1. for stop in edges[prefix + "_node"]]
+        edges[prefix + "_lat"] = coordinates
+        edges[prefix + "_lon"] = coordinates
+    return eventflow.EventGraph(nodes, edges)
+
+
+def num_edges(actor_id, graph):
+    return len(graph.edges)
+
+
+def locations(actor_id, graph):
+    return set(graph.nodes.index)
+
+
+def collection():
+    gc = eventflow.GraphCollection([], None)
+    for actor_id in range(5):
+        actor = eventflow.Actor(actor_id)
+        actor.id = actor_id
+        stops = [10, 20, 30][:actor_id % 3 + 1] + [10]
+        dates = ["1900-01-{:02d}".format(d + 1) for d in range(len(stops))]
+        gc.add(actor, graph(actor_id, stops, dates))
+    return gc
+
+
+def test_columns():
+    original = graph(3, [10, 20, 10], ["1900-01-01", "1900-01-05", "1900-02-01"])
+    columns = original.columns()
+    assert list(columns) == eventflow.core.GRAPH_NODE_COLUMNS + eventflow.core.GRAPH_EDGE_COLUMNS
+    restored = eventflow.EventGraph.from_columns(columns)
+    assert restored == original
+    assert restored.all_edges.from_lat.tolist() == [0., 10.]
+
+    # Missing labels stay missing, they are no "None" strings
+    nodes = original.all_nodes.copy()
+    nodes.loc[20, "label"] = None
+    original = eventflow.EventGraph(nodes, original.all_edges.copy())
+    columns = original.columns()
+    assert columns["label"].tolist() == ["a", "", "c"]
+    assert columns["label_missing"].tolist() == [False, True, False]
+    restored = eventflow.EventGraph.from_columns(columns)
+    assert restored.all_nodes.label.tolist() == ["a", None, "c"]
+
+
+def test_pack():
+    gc = collection()
+    arrays = parallel.pack((actor.id, g) for actor, g in gc.graphs())
+    # The nodes of all graphs are the same, they are stored once
+    assert arrays["locationID"].tolist() == [10, 20, 30]
+    assert len(arrays["node_index"]) == 15
+    for position, (actor, g) in enumerate(gc.graphs()):
+        assert parallel.read_graph(arrays, position) == (actor.id, g)
+
+    moved = graph(5, [10, 20], ["1900-01-01", "1900-01-05"])
+    nodes = moved.all_nodes.copy()
+    nodes.loc[10, "lat"] = -0.
+    moved = eventflow.EventGraph(nodes, moved.all_edges.copy())
+    arrays = parallel.pack([(0, gc.get_cache_entry(0)), (5, moved)])
+    assert "node_index" not in arrays and len(arrays["locationID"]) == 6
+    assert parallel.read_graph(arrays, 1)[1].all_nodes.lat.tolist() == [-0., 10., 20.]
+
+
+def test_map_reduce():
+    gc = collection()
+    serial = {actor.id: num_edges(actor.id, g) for actor, g in gc.graphs()}
+
+    for processes in [1, 2]:
+        assert gc.map_reduce(num_edges, processes = processes) == serial
+        assert gc.map_reduce(num_edges, operator.add, 0,
+                             processes = processes) == sum(serial.values())
+        assert gc.map_reduce(locations, operator.or_, processes = processes) == {10, 20, 30}
+        assert gc.map_reduce(num_edges, operator.add, processes = processes,
+                             end_date = "1900-01-02") == 5
+
+    assert parallel.map_reduce([], num_edges, operator.add, processes = 1) is None
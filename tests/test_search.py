@@ -0,0 +1,51 @@
+import numpy as np
+
+from eventflow.search import ActorIndex, INDEX_ARRAYS, STRING_ARRAYS
+
+
+def index():
+    return ActorIndex([1, 2, 3, 4, 5],
+                      ["Q1", "Q2", "Q3", "Q4", "Q5"],
+                      ["Ptolemy I Soter", "Ptolemy", "Theophrastus",
+                       "Ptolemy II Philadelphus", u"René Descartes"])
+
+
+def test_prefix():
+    actors = index()
+
+    assert actors.prefix("ptolemy") == [
+        (2, "Q2", "Ptolemy"), (1, "Q1", "Ptolemy I Soter"),
+        (4, "Q4", "Ptolemy II Philadelphus")]
+    assert actors.prefix("Sot") == [(1, "Q1", "Ptolemy I Soter")]
+    assert actors.prefix("rene", limit = 1) == [(5, "Q5", u"René Descartes")]
+    assert actors.prefix("x") == []
+
+
+def test_fuzzy_and_persistence(tmpdir):
+    actors = index()
+    filename = str(tmpdir.join("actors.npz"))
+    actors.save(filename)
+    loaded = ActorIndex.load(filename)
+
+    for a in [actors, loaded]:
+        assert a.fuzzy("Theofrastus")[0] == (3, "Q3", "Theophrastus")
+        assert a.search("ptolemy soter")[0] == (1, "Q1", "Ptolemy I Soter")
+        assert a.resolve(["Descartes", "zzzzzz"]) == [(5, "Q5", u"René Descartes"), None]
+    assert len(loaded) == 5
+
+
+def test_string_storage(tmpdir):
+    actors = ActorIndex([1, 2], ["Q1", "Q2"], ["", u"Ptolemy I Soter"])
+    assert actors.labels.dtype == object and actors.words.dtype == object
+    filename = str(tmpdir.join("actors.npz"))
+    actors.save(filename)
+    with np.load(filename) as arrays:
+        assert arrays["labels"].dtype == np.uint8
+    assert list(ActorIndex.load(filename).labels) == ["", u"Ptolemy I Soter"]
+
+    # Indexes of older versions with unicode arrays
+    arrays = {name: getattr(actors, name) for name in INDEX_ARRAYS}
+    for name in STRING_ARRAYS:
+        arrays[name] = arrays[name].astype(str)
+    np.savez(filename, **arrays)
+    assert ActorIndex.load(filename).prefix("sot") == [(2, "Q2", "Ptolemy I Soter")]
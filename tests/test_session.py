@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import eventflow
+from eventflow import session
+
+
+def collection():
+    nodes = pd.DataFrame({"label": ["a", "b", "c"], "WDid": ["Q1", "Q2", "Q3"],
+                          "lat": [0., 10., 20.], "lon": [0., 10., 20.]},
+                         index = pd.Index([0, 1, 2], name = "locationID"))
+    gc = eventflow.GraphCollection([], None)
+    for actor_id, stops in [(1, [0, 1, 2]), (2, [2, 0]), (3, None)]:
+        actor = eventflow.Actor(actor_id)
+        actor.id = actor_id
+        actor.WDid = 100 + actor_id
+        actor.name = "actor {}".format(actor_id)
+        if stops is None:
+            # Resolved, but without a graph
+            gc.update_actor_list(actor)
+            continue
+        dates = ["1900-01-{:02d}".format(5 * i + 1) for i in range(len(stops))]
+        edges = pd.DataFrame({"actorID": actor_id, "from_node": stops[:-1],
+                              "from_date": dates[:-1], "to_node": stops[1:],
+                              "to_date": dates[1:]})
+        for prefix in ["from", "to"]:
+            edges[prefix + "_lat"] = nodes.lat.loc[edges[prefix + "_node"]].values
+            edges[prefix + "_lon"] = nodes.lon.loc[edges[prefix + "_node"]].values
+        gc.add(actor, eventflow.EventGraph(nodes.loc[np.unique(stops)], edges))
+    return gc
+
+
+def test_session_save_load(tmpdir):
+    gc = collection()
+    filename = str(tmpdir.join("session.npz"))
+    session.save(filename, gc, {"start_date": "1900-01-01"})
+
+    restored, meta = session.load(filename)
+    assert meta == {"start_date": "1900-01-01"}
+    assert [a.id for a in restored.actors] == [1, 2, 3]
+    assert [(a.WDid, a.name) for a in restored.actors] == [(a.WDid, a.name) for a in gc.actors]
+    assert restored.fingerprints() == gc.fingerprints()
+    assert restored.get_cache_entry(1) == gc.get_cache_entry(1)
+    assert restored.get_cache_entry(3) is None
+    assert [(a.id, start, end) for a, start, end in restored.visits(2)] == \
+        [(a.id, start, end) for a, start, end in gc.visits(2)]
+
+    session.save(filename, gc, graphs = False)
+    restored, meta = session.load(filename)
+    assert meta == {} and restored.cached_actor_ids == []
+    assert restored.num_actors == 3
+
+
+def test_session_corrupted(tmpdir):
+    filename = str(tmpdir.join("session.npz"))
+    session.save(filename, collection())
+    with np.load(filename) as data:
+        arrays = {name: data[name] for name in data.files}
+    arrays["lat"] = arrays["lat"] + 1.
+    np.savez(filename, **arrays)
+
+    with pytest.raises(eventflow.core.EventGraphError):
+        session.load(filename)
+    assert session.load(filename, verify = False)[0].get_cache_entry(1).nodes.lat.max() == 21.
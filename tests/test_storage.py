@@ -0,0 +1,70 @@
+import pandas as pd
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+import database_setup
+import eventflow
+from eventflow import db_queries, storage, util
+from test_database_setup import client
+
+
+def mongo():
+    db = client()
+    database_setup.copy_location_nodes(db, verbose = False)
+    database_setup.create_edge_collection(db)
+    return db
+
+
+def sorted_frame(frame, columns):
+    names = [name for name, _ in columns]
+    return frame[names].sort_values(names).reset_index(drop = True)
+
+
+def stores(tmpdir):
+    yield storage.SQLiteStore(str(tmpdir.join("eventflow.sqlite")))
+    if storage.pq is not None:
+        yield storage.ParquetStore(str(tmpdir.mkdir("parquet")), num_partitions = 4)
+
+
+def test_stores(tmpdir):
+    db = mongo()
+    for store in stores(tmpdir):
+        store.copy_from(db)
+
+        for actor_ids in [[1, 2, 3], 4, [99]]:
+            nodes, edges = store.get_graph(actor_ids)
+            expected_nodes, expected_edges = db_queries.get_graph(db, actor_ids)
+            assert nodes.empty == expected_nodes.empty
+            if expected_nodes.empty:
+                continue
+            pd.util.testing.assert_frame_equal(
+                sorted_frame(edges, db_queries.EDGES_COLUMNS),
+                sorted_frame(expected_edges, db_queries.EDGES_COLUMNS))
+            pd.util.testing.assert_frame_equal(
+                sorted_frame(nodes, db_queries.NODES_COLUMNS),
+                sorted_frame(expected_nodes, db_queries.NODES_COLUMNS))
+
+        assert store.actor_by_id(3) == db_queries.actor_by_id(db, 3)
+        assert store.actor_by_WDid("Q105") == db_queries.actor_by_WDid(db, "Q105")
+        assert store.actor_by_name("actor7") == db_queries.actor_by_name(db, "actor7")
+        assert store.actor_by_name("nobody")["id"] == -1
+
+        gc = eventflow.GraphCollection(["Q101", "actor2"], store)
+        assert sorted(actor.id for actor in gc.actors) == [1, 2]
+        assert len(list(gc.graphs())) == 2
+
+
+def test_sqlite_load_twice():
+    db = mongo()
+    store = storage.SQLiteStore(":memory:")
+    store.copy_from(db)
+    counts = [store._connection.execute("SELECT COUNT(*) FROM " + table).fetchone()[0]
+              for table in ["nodes", "edges", "actors"]]
+    nodes, edges = store.get_graph(1)
+
+    store.copy_from(db)
+    assert [store._connection.execute("SELECT COUNT(*) FROM " + table).fetchone()[0]
+            for table in ["nodes", "edges", "actors"]] == counts
+    assert len(store.get_graph(1)[1]) == len(edges)
+    assert counts[1] == db[util.EVENTFLOW_COLLECTION][util.EVENTFLOW_EDGES].count_documents({})
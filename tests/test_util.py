@@ -0,0 +1,64 @@
+import inspect
+
+from eventflow import util
+
+
+class FakeTunnel(object):
+    started = 0
+
+    def __init__(self, *args, **kwargs):
+        self.is_active = False
+
+    def start(self):
+        FakeTunnel.started += 1
+        self.is_active = True
+
+    def stop(self):
+        self.is_active = False
+
+
+class FakeClient(dict):
+    def __init__(self, *args, **kwargs):
+        self.kwargs = kwargs
+        self.closed = False
+
+    def __missing__(self, key):
+        return self
+
+    def authenticate(self, *args):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def test_connection_manager(monkeypatch):
+    monkeypatch.setattr(util, "SSHTunnelForwarder", FakeTunnel)
+    monkeypatch.setattr(util, "MongoClient", FakeClient)
+    connection = util.ConnectionManager(max_pool_size = 3)
+
+    @connection
+    def first(env):
+        return env["client"]
+
+    @connection(extra_args = lambda parser: parser.parse_args([]))
+    def second(env):
+        return env["client"]
+
+    with connection as client:
+        assert client.kwargs["maxPoolSize"] == 3
+    assert first() is client
+    assert second() is client
+    assert FakeTunnel.started == 1
+    # env is no parameter for the callers, e.g. no fixture for pytest
+    assert str(inspect.signature(first)) == "()"
+    assert first.__name__ == "first"
+
+    # Reconnect, if the tunnel dropped
+    connection._server.is_active = False
+    assert connection.client is client
+    assert FakeTunnel.started == 2
+
+    connection.close()
+    assert client.closed
+    assert connection.client is not client